@@ -6,19 +6,316 @@ from __future__ import annotations
 
 import json
 import os
+import re
 import textwrap
+import threading
+import time
 import traceback
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, List
 
 import streamlit as st
-from openai import OpenAI, APIError
+
+from modules import llm_cassette
+from modules.cancellation import Cancelled, CancelToken, current_token, use_token
+from modules.circuit_breaker import CircuitOpenError, get_breaker
+from modules.context_digest import get_digest_cache
+from modules.hedging import get_hedger, latency_histogram
+from modules.llm_providers import Provider, is_api_error, resolve
+from modules.metrics import metrics
+from modules.model_routing import estimate_tokens, get_router
+from modules.scheduler import PRIORITY_INTERACTIVE
+from modules.singleflight import llm_flight
+from modules.structured_output import (
+    ItemStream,
+    SchemaValidator,
+    parse_structured,
+    repair_json,
+)
 
 # ----------------------------------------------------------------------
-# OpenAIクライアント設定
+# 接続先（modules.llm_providers。openai SDK の import とクライアント生成は初回呼び出し時）
+#   OPENAI_BASE_URL を設定すると OpenAI互換サーバーへ向く
+#   （例: python -m modules.llm_standin → http://127.0.0.1:8011/v1）
+#   AI_DOCK_PROVIDERS / AI_DOCK_STEP_PROVIDERS で、ステップごとに自前の互換サーバーへ
 # ----------------------------------------------------------------------
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# 呼び出し元が指定するモデル。実際のモデルはステップ別の経路で決まる（modules.model_routing）
 _DEFAULT_MODEL = "o3-mini"
 
+
+# ストリームの差分（delta）の受け取り手を、上流へ送るたびに新しく作る関数
+DeltaListener = Callable[[], Callable[[Dict[str, Any]], None]]
+
+
+def _chat_completion(
+    step: str, *, listener: DeltaListener | None = None, **params: Any
+):
+    """
+    chat.completions.create の唯一の呼び出し口。
+    step はどの処理からの呼び出しか（external / questions / swot / root_cause / actions ...）。
+    AI_DOCK_LLM_CASSETTE が設定されていればカセットへ録画／カセットから再生する。
+    同一リクエストが同時に来た場合は上流へ1回だけ送り、結果を共有する。
+    上流へ送る分は公平スケジューラ（modules.scheduler）の枠を取ってから送る。
+    接続先＋モデルごとのサーキットブレーカーが開いていれば CircuitOpenError で即失敗。
+    AI_DOCK_HEDGE=1 なら、所要時間が p95 を超えた呼び出しをもう1本送って早い方を使う
+    （modules.hedging）。
+    バックグラウンドジョブ内ではジョブのキャンセルトークンに従い、キャンセル／期限切れで
+    上流への接続ごと打ち切って Cancelled を送出する。それ以外の呼び出しも
+    AI_DOCK_LLM_DEADLINE_SEC（既定 300秒）でタイムアウトする。
+    上流へ送った呼び出しは、入力トークン数とプロンプトキャッシュのヒット分を記録する。
+    AI_DOCK_MODEL_ROUTING=1 なら、モデルはステップと入力の大きさで選び直し
+    （modules.model_routing）、SLO を超えた・エラーになった場合は次の候補のモデルで
+    送り直す（ステップの temperature をかけ直す）。
+    接続先はステップとモデル名で決まり（modules.llm_providers）、パラメータと応答は
+    接続先の能力（function calling の形式・ストリーミング・トークン上限の名前）に合わせて直す。
+    params・応答はどの接続先でも OpenAI の functions / function_call の形。
+    listener を渡すと、ストリーミングで受け取る呼び出しでは上流へ送るたびに listener() を
+    呼び、返った関数に届いた差分を順に渡す（モデルを切り替えて送り直したら作り直す）。
+    """
+    router = get_router()
+    prompt_tokens = estimate_tokens(params.get("messages", []))
+    route = router.route(step, prompt_tokens) if router is not None else None
+    if route is None:
+        return _send_completion(step, listener=listener, **params)
+    if params.get("stream"):
+        # ストリームは読み始めたら切り替えられないため第一候補のみ
+        return _send_completion(step, **route.request(params, route.models[0]))
+
+    parent = current_token()
+    for attempt, model in enumerate(route.models):
+        last = attempt == len(route.models) - 1
+        token = parent
+        if not last and route.slo_sec is not None:
+            token = (
+                parent.child(route.slo_sec) if parent else CancelToken(route.slo_sec)
+            )
+        t0 = time.monotonic()
+        outcome, error = "ok", ""
+        try:
+            with use_token(token):
+                return _send_completion(
+                    step, listener=listener, **route.request(params, model)
+                )
+        except Cancelled as e:
+            outcome, error = "cancelled", str(e)
+            if last or token is parent or parent is not None and parent.cancelled:
+                raise
+            outcome = "slo_exceeded"
+        except Exception as e:
+            outcome, error = "error", f"{type(e).__name__}: {e}"
+            if last:
+                raise
+        finally:
+            if token is not parent:
+                token.cancel("呼び出しが終了しました")  # SLO タイマーを止める
+            router.record(
+                step,
+                model,
+                attempt=attempt,
+                outcome=outcome,
+                elapsed_sec=time.monotonic() - t0,
+                prompt_tokens=prompt_tokens,
+                route=route,
+                error=error,
+            )
+
+
+def _send_completion(
+    step: str, *, listener: DeltaListener | None = None, **params: Any
+):
+    """モデルを決めた1回分の呼び出し（_chat_completion から）。"""
+    identity = _call_identity()
+    provider, model = resolve(step, params.get("model", ""))
+    request = provider.prepare(dict(params, model=model))
+    breaker = get_breaker(provider.endpoint(model))
+    scheduler = provider.scheduler()
+    token = current_token()
+    if token is not None:
+        token.raise_if_cancelled()
+    deadline_sec = provider.timeout_sec or float(
+        os.getenv("AI_DOCK_LLM_DEADLINE_SEC", "300")
+    )
+    client = provider.client
+
+    def create():
+        cassette = llm_cassette.active()
+        if cassette is not None:
+            return cassette.call(
+                step, request, lambda: client().chat.completions.create(**request)
+            )
+        t0 = time.perf_counter()
+        rsp = client().chat.completions.create(**request, timeout=deadline_sec)
+        if not request.get("stream"):
+            latency_histogram(step).observe(time.perf_counter() - t0)
+            _record_usage(step, rsp)
+        return rsp
+
+    def send():
+        return breaker.call(create, wait=scheduler.slot(**identity))
+
+    if params.get("stream"):
+        if not provider.streaming:
+            raise ValueError(f"接続先 {provider.name} はストリーミングに対応していません")
+        # ストリームは呼び出し元ごとに読み進めるため共有しない
+        return send()
+
+    # 差分を受け取る呼び出しはヘッジしない（2本の出力が混ざるため）
+    hedger = get_hedger() if listener is None else None
+    own = None
+    if llm_cassette.active() is None and (token is not None or hedger is not None):
+        own = token or CancelToken(deadline_sec)
+
+        def attempt(t: CancelToken):
+            return breaker.call(
+                lambda: _create_cancellable(step, provider, request, t, listener),
+                wait=scheduler.slot(**identity, token=t),
+            )
+
+        def send():
+            return hedger.run(step, attempt, own) if hedger else attempt(own)
+
+    key = llm_cassette.request_key(dict(request, provider=provider.name))
+    try:
+        while True:
+            try:
+                return provider.adapt(llm_flight.do(key, send, label=step), params)
+            except Cancelled:
+                if own is None or own.cancelled:
+                    raise
+                # 相乗りしていた先行呼び出しが取り消された → 自分で送り直す
+    finally:
+        if own is not None and own is not token:
+            own.cancel("呼び出しが終了しました")  # 期限タイマーを止める
+
+
+def _create_cancellable(
+    step: str,
+    provider: Provider,
+    params: Dict[str, Any],
+    token: CancelToken,
+    listener: DeltaListener | None = None,
+):
+    """
+    ストリーミングで送って応答を組み立てる（非ストリーミングの呼び出しは途中で
+    止められないため）。token がキャンセルされたら接続を切って Cancelled。
+    ストリーミング非対応の接続先は通常の呼び出しで送り、キャンセル時は応答を待たずに戻る。
+    """
+    from openai.types.chat import ChatCompletion
+
+    from modules.llm_stream import call_cancellable, collect
+
+    token.raise_if_cancelled()
+    limits = [x for x in (token.remaining(), provider.timeout_sec) if x is not None]
+    timeout = {"timeout": min(limits)} if limits else {}
+    create = provider.client().chat.completions.create
+    t0 = time.perf_counter()
+    if provider.streaming:
+        stream = call_cancellable(
+            lambda: create(
+                **params, stream=True, stream_options={"include_usage": True}, **timeout
+            ),
+            token=token,
+        )
+        on_delta = listener() if listener is not None else None
+        rsp = ChatCompletion.model_validate(
+            collect(stream, token=token, on_delta=on_delta)
+        )
+    else:
+        rsp = call_cancellable(lambda: create(**params, **timeout), token=token)
+    latency_histogram(step).observe(time.perf_counter() - t0)
+    _record_usage(step, rsp)
+    return rsp
+
+
+def _record_usage(step: str, rsp: Any) -> None:
+    """
+    入力トークン数と、そのうちプロバイダー側のプロンプトキャッシュから読まれた分
+    （usage.prompt_tokens_details.cached_tokens）をステップ別に記録する。
+    """
+    usage = getattr(rsp, "usage", None)
+    if usage is None or not usage.prompt_tokens:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) or 0
+    metrics.counter(f"llm.tokens.prompt.{step}").inc(usage.prompt_tokens)
+    metrics.counter(f"llm.tokens.cached.{step}").inc(cached)
+    metrics.histogram(f"llm.prompt_cache_ratio.{step}").observe(
+        cached / usage.prompt_tokens
+    )
+
+
+# ----------------------------------------------------------------------
+# バックグラウンド実行（modules.jobs のワーカースレッド）用
+#   ワーカーには ScriptRunContext が無いため、st.session_state の代わりに
+#   ジョブ登録時のスナップショット（dict）を読み書きし、
+#   st.error / st.warning はメッセージとして結果に積む。
+# ----------------------------------------------------------------------
+_local = threading.local()
+
+
+def _state():
+    state = getattr(_local, "state", None)
+    return st.session_state if state is None else state
+
+
+def _call_identity() -> Dict[str, Any]:
+    """スケジューラに渡す呼び出し元（セッション・テナント・優先度）。"""
+    identity = getattr(_local, "identity", None)
+    if identity is not None:
+        return identity
+    from modules.session_store import current_session_id, current_tenant_id
+
+    return {
+        "session": current_session_id(),
+        "tenant": current_tenant_id(),
+        "priority": PRIORITY_INTERACTIVE,
+    }
+
+
+def _notify(level: str, message: str) -> None:
+    messages = getattr(_local, "messages", None)
+    if messages is None:
+        getattr(st, level)(message)
+    else:
+        messages.append((level, message))
+
+
+# 診断関数が state へ書く、結果以外の値（ジョブの結果と一緒にセッションへ戻す）
+_DIAGNOSTIC_KEYS = ("action_error_trace",)
+
+
+def run_detached(
+    func_name: str,
+    user_input: dict,
+    state: Dict[str, Any],
+    identity: Dict[str, Any] | None = None,
+    **kwargs: Any,
+) -> Dict:
+    """
+    func_name の診断関数を state 上で実行し、結果と画面メッセージ、state へ書かれた
+    診断用の値（_DIAGNOSTIC_KEYS。呼び出し元がセッションへ戻す）を返す。
+    identity は呼び出し元 {"session", "tenant", "priority"}（スケジューラ用）。
+    kwargs は func_name の関数へそのまま渡す。
+    """
+    func = globals()[func_name]
+    _local.state, _local.messages = dict(state), []
+    _local.identity = {
+        "session": None,
+        "tenant": None,
+        "priority": PRIORITY_INTERACTIVE,
+        **(identity or {}),
+    }
+    try:
+        result = func(user_input, **kwargs)
+        written = {
+            k: _local.state[k]
+            for k in _DIAGNOSTIC_KEYS
+            if k in _local.state and _local.state[k] != state.get(k)
+        }
+        return {"result": result, "messages": _local.messages, "state": written}
+    finally:
+        _local.state = _local.messages = _local.identity = None
+
+
 _SYSTEM_PROMPT = (
     "あなたは超一流の経営コンサルタントです。"
     "経営者・事業責任者に対して、シンプルかつ信頼感のある表現で、"
@@ -34,6 +331,7 @@ def run_gpt(
     model: str = _DEFAULT_MODEL,
     max_tokens: int = 4096,
     temperature: float = 0.0,
+    step: str = "run_gpt",
 ) -> str:
     try:
         params: Dict[str, Any] = {
@@ -42,52 +340,59 @@ def run_gpt(
                 {"role": "system", "content": _SYSTEM_PROMPT},
                 {"role": "user", "content": prompt},
             ],
+            # o系モデルでは送信時に temperature を外し、上限を max_completion_tokens に
+            # 直す（Provider.prepare）。モデルを切り替えて送り直す場合にも残しておく
+            "temperature": temperature,
+            "max_tokens": max_tokens,
         }
-        if model.startswith("o3"):
-            params["max_completion_tokens"] = max_tokens
-        else:
-            params["temperature"] = temperature
-            params["max_tokens"] = max_tokens
 
-        rsp = client.chat.completions.create(**params)
+        rsp = _chat_completion(step, **params)
         return (rsp.choices[0].message.content or "").strip()
-    except APIError as e:
-        st.error(f"❌ OpenAI APIError: {e}")
+    except Exception as e:
+        if not is_api_error(e):
+            raise
+        _notify("error", f"❌ OpenAI APIError: {e}")
         return ""
 
 
 # ======================================================================
 # 外部環境分析（GPT-4o推奨・Web検索なしでも安定）
 # ======================================================================
-import openai
-import streamlit as st
-import time
+# 外部環境分析の観点 (日本語, 英語)
+EXTERNAL_ASPECTS = [
+    ("政治・制度", "Politics"),
+    ("経済", "Economy"),
+    ("社会・文化", "Society / Culture"),
+    ("技術", "Technology"),
+    ("業界構造", "Industry Structure"),
+    ("競合ポジション", "Competition Position"),
+]
 
 
-def show_external_environment_analysis_ai(user_input: dict, max_retry=2) -> str:
+def external_aspect_prompt(
+    aspect_ja: str, aspect_en: str, user_input: dict, *, generic: bool = False
+) -> str:
+    """
+    外部環境分析の1観点分のプロンプト。
+    generic=True は業種×地域だけで作る共有キャッシュ用（会社固有の情報を含めない）。
+    業種・地域はキャッシュのキーと同じく正規化したもの（都道府県の単位）を使い、
+    最初に入力した会社の市区町村・書き方がキーを共有する他社へ渡らないようにする。
+    観点ごとに変わる部分は末尾に置き、共通の指示＋企業情報を6観点で同じ先頭部分に
+    する（プロバイダー側のプロンプトキャッシュが効くように）。
+    """
     c = lambda k, d="未入力": user_input.get(k, d)
-    aspects = [
-        ("政治・制度", "Politics"),
-        ("経済", "Economy"),
-        ("社会・文化", "Society / Culture"),
-        ("技術", "Technology"),
-        ("業界構造", "Industry Structure"),
-        ("競合ポジション", "Competition Position"),
-    ]
+    if generic:
+        from modules.external_cache import ExternalCache
 
-    def build_prompt(aspect_ja, aspect_en):
-        return f"""
-あなたは「中小企業専門の経営コンサルタント」です。
-必ず「リアルタイムの公的情報・信頼できる専門メディア」のWeb検索結果も活用し、
-下記ルールで「{aspect_ja}（{aspect_en}）」に関する**経営判断に役立つ“深い洞察・現場示唆・打ち手ヒント”を含む厚い要約**を
-Markdownで**200～250字で出力**してください。
-
-- 必ず経営判断や現場実務に本当に役立つ具体的視点（なぜ重要か／何をすべきか／他社事例／リスク／数字・現場例等）を含めること
-- ニュースの羅列・一般的説明・抽象論は禁止
-- **補助金・助成金・給付金など特定の公的制度名や金額は一切記載しないこと。**
-- 必ず信頼できる一次ソース（行政発表・日経/業界新聞・政府Web・専門媒体等）の出典URL・媒体名を2つ以上記載
-
-【企業情報】
+        industry, region = ExternalCache.key(
+            c("業種（できるだけ詳しく）", ""), c("地域", "")
+        )
+        company = f"""【対象（業種×地域）】
+業種: {industry or '未入力'}
+地域: {region or '未入力'}
+※特定の1社ではなく、この業種・地域の中小企業に共通して役立つ内容にすること"""
+    else:
+        company = f"""【企業情報】
 会社名: {c('会社名・屋号')}
 業種: {c('業種（できるだけ詳しく）')}
 地域: {c('地域')}
@@ -97,7 +402,22 @@ Markdownで**200～250字で出力**してください。
 粗利率: {c('粗利率（おおよそ）')}
 最終利益: {c('最終利益（税引後・おおよそ）')}
 借入金額: {c('借入金額（だいたい）')}
-経営の問題点: {c('経営の問題点')}
+経営の問題点: {c('経営の問題点')}"""
+    return f"""
+あなたは「中小企業専門の経営コンサルタント」です。
+必ず「リアルタイムの公的情報・信頼できる専門メディア」のWeb検索結果も活用し、
+下記ルールで、末尾の【今回の観点】に関する**経営判断に役立つ“深い洞察・現場示唆・打ち手ヒント”を含む厚い要約**を
+Markdownで**200～250字で出力**してください。
+
+- 必ず経営判断や現場実務に本当に役立つ具体的視点（なぜ重要か／何をすべきか／他社事例／リスク／数字・現場例等）を含めること
+- ニュースの羅列・一般的説明・抽象論は禁止
+- **補助金・助成金・給付金など特定の公的制度名や金額は一切記載しないこと。**
+- 必ず信頼できる一次ソース（行政発表・日経/業界新聞・政府Web・専門媒体等）の出典URL・媒体名を2つ以上記載
+
+{company}
+
+【今回の観点】
+「{aspect_ja}（{aspect_en}）」
 
 【Markdown出力フォーマット（例）】
 ## {aspect_ja} ({aspect_en})
@@ -105,47 +425,174 @@ Markdownで**200～250字で出力**してください。
 - 出典: 東京都中小企業振興公社 https://www.tokyo-kosha.or.jp, 日本経済新聞 https://www.nikkei.com
 """
 
+
+def external_aspect_ai(
+    aspect_ja: str,
+    aspect_en: str,
+    user_input: dict,
+    *,
+    generic: bool = False,
+    max_retry: int = 2,
+) -> str | None:
+    """1観点分を生成する（失敗時は max_retry 回まで再試行し、それでもだめなら None）。"""
+    # モデルは共有キャッシュのキー（生成元）と同じもの（AI_DOCK_EXTERNAL_MODEL）
+    from modules.external_cache import external_model
+
+    prompt = external_aspect_prompt(aspect_ja, aspect_en, user_input, generic=generic)
+    for _ in range(max_retry + 1):
+        try:
+            response = _chat_completion(
+                "external",
+                model=external_model(),  # "gpt-4.1-mini"や"gpt-4o"も可
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=1500,
+                temperature=0.7,
+            )
+            result = response.choices[0].message.content.strip()
+        except (CircuitOpenError, Cancelled):
+            # 遮断中／キャンセル時は残りの観点も再試行せずに打ち切る
+            raise
+        except Exception as e:
+            result = f"【AIエラー発生】{aspect_ja} ({aspect_en}) : {e}"
+
+        if "【AIエラー発生】" not in result:
+            return result
+        time.sleep(2)  # API制限対策
+    return None
+
+
+def refresh_external_aspect(user_input: dict, aspect_ja: str) -> bool:
+    """
+    共有キャッシュ用に1観点を生成し直して保存する（modules.external_warmup から使う）。
+    user_input は業種・地域だけでよい（プロンプトではキャッシュのキーと同じく正規化する）。
+    """
+    from modules.external_cache import get_external_cache
+
+    cache = get_external_cache()
+    if cache is None or not cache.cacheable(aspect_ja):
+        return False
+    aspect_en = dict(EXTERNAL_ASPECTS)[aspect_ja]
+    result = external_aspect_ai(aspect_ja, aspect_en, user_input, generic=True)
+    if result is None:
+        return False
+    cache.put(
+        aspect_ja,
+        user_input.get("業種（できるだけ詳しく）", ""),
+        user_input.get("地域", ""),
+        result,
+    )
+    return True
+
+
+def show_external_environment_analysis_ai(user_input: dict, max_retry=2) -> str:
+    # 業種×地域で決まる観点は会社をまたいだ共有キャッシュ（modules.external_cache）を使う。
+    # キャッシュにない観点も業種×地域だけのプロンプトで生成して保存する（会社固有の事情は
+    # 反映されない）。AI_DOCK_EXTERNAL_CACHE_GENERIC=0 なら会社固有のプロンプトで生成し、保存しない
+    from modules.external_cache import generic_on_miss, get_external_cache
+
+    cache = get_external_cache()
+    store = generic_on_miss()
+    industry = user_input.get("業種（できるだけ詳しく）", "")
+    region = user_input.get("地域", "")
     outputs = []
-    client = openai.OpenAI()
 
-    for aspect_ja, aspect_en in aspects:
-        retry = 0
-        while retry <= max_retry:
-            prompt = build_prompt(aspect_ja, aspect_en)
-            try:
-                response = client.chat.completions.create(
-                    model="gpt-4.1",  # "gpt-4.1-mini"や"gpt-4o"も可
-                    messages=[{"role": "user", "content": prompt}],
-                    max_tokens=1500,
-                    temperature=0.7,
-                )
-                result = response.choices[0].message.content.strip()
-            except Exception as e:
-                result = f"【AIエラー発生】{aspect_ja} ({aspect_en}) : {e}"
-
-            if "【AIエラー発生】" not in result:
-                outputs.append(result)
-                break
-            else:
-                retry += 1
-                time.sleep(2)  # API制限対策
-
-        if retry > max_retry:
+    for aspect_ja, aspect_en in EXTERNAL_ASPECTS:
+        shared = cache is not None and cache.cacheable(aspect_ja)
+        if shared:
+            cached = cache.get(aspect_ja, industry, region)
+            if cached is not None:
+                outputs.append(cached)
+                continue
+        generic = shared and store
+        result = external_aspect_ai(
+            aspect_ja, aspect_en, user_input, generic=generic, max_retry=max_retry
+        )
+        if result is None:
             outputs.append(f"【AIエラー発生】（{aspect_ja}）")
+            continue
+        if generic:
+            cache.put(aspect_ja, industry, region, result)
+        outputs.append(result)
 
     final_markdown = "\n\n".join(outputs)
-    st.session_state["external_output"] = final_markdown
+    _state()["external_output"] = final_markdown
     return final_markdown
 
 
+# ======================================================================
+# 関数呼び出しの引数の解析
+#   壊れたJSON（途中で切れた・末尾のカンマ・全角引用符）はローカルで直し、欠けた必須項目は
+#   既定値で埋める。最後の手段として、欠けた項目だけを同じ会話の続きで聞き直す
+#   （先頭が同じなのでプロンプトキャッシュが効き、出力も短い）。modules.structured_output
+# ======================================================================
+_REASK_PROMPT = (
+    "直前の出力は途中で切れたか、次の項目が欠けていました: {names}\n"
+    "これらの項目の値だけを fill_missing 関数で返してください"
+    "（項目名はそのまま、他の項目は出力しないこと）。"
+)
+
+
+def _function_arguments(
+    step: str,
+    rsp: Any,
+    output: SchemaValidator,
+    messages: List[Dict[str, Any]],
+) -> Any:
+    def reask(fields: Dict[str, Dict[str, Any]], partial: Any) -> Dict[str, Any]:
+        rsp = _chat_completion(
+            step,
+            model=_DEFAULT_MODEL,
+            messages=messages
+            + [
+                {"role": "assistant", "content": json.dumps(partial, ensure_ascii=False)},
+                {"role": "user", "content": _REASK_PROMPT.format(names="、".join(fields))},
+            ],
+            functions=[
+                {
+                    "name": "fill_missing",
+                    "parameters": {
+                        "type": "object",
+                        "properties": fields,
+                        "required": list(fields),
+                    },
+                }
+            ],
+            function_call={"name": "fill_missing"},
+        )
+        return repair_json(rsp.choices[0].message.function_call.arguments)[0]
+
+    return parse_structured(
+        rsp.choices[0].message.function_call.arguments, output, reask=reask
+    )
+
+
 # ======================================================================
 # AIからの質問
 # ======================================================================
-def deep_dive_questions_ai(user_input: dict) -> list[dict]:
-    import textwrap, json, streamlit as st
+_QUESTIONS_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "questions": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "category": {"type": "string"},
+                    "question": {"type": "string"},
+                    "rationale": {"type": "string"},
+                },
+                "required": ["category", "question", "rationale"],
+            },
+        }
+    },
+    "required": ["questions"],
+}
+_QUESTIONS_OUTPUT = SchemaValidator(_QUESTIONS_SCHEMA)
+
 
+def deep_dive_questions_ai(user_input: dict) -> list[dict]:
     basic_json = json.dumps(user_input, ensure_ascii=False)[:2500]
-    external = st.session_state.get("external_output", "")[:1800]
+    external = _state().get("external_output", "")[:1800]
     prompt = textwrap.dedent(
         f"""
 あなたは「中小企業の現場・実務を熟知したプロ経営コンサルタント兼AIコーチ」です。
@@ -183,102 +630,30 @@ def deep_dive_questions_ai(user_input: dict) -> list[dict]:
         """
     )
 
-    schema = {
-        "type": "object",
-        "properties": {
-            "questions": {
-                "type": "array",
-                "items": {
-                    "type": "object",
-                    "properties": {
-                        "category": {"type": "string"},
-                        "question": {"type": "string"},
-                        "rationale": {"type": "string"},
-                    },
-                    "required": ["category", "question", "rationale"],
-                },
-            }
-        },
-        "required": ["questions"],
-    }
+    messages = [
+        {"role": "system", "content": _SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
     try:
-        rsp = client.chat.completions.create(
+        rsp = _chat_completion(
+            "questions",
             model=_DEFAULT_MODEL,
-            messages=[
-                {"role": "system", "content": _SYSTEM_PROMPT},
-                {"role": "user", "content": prompt},
-            ],
-            functions=[{"name": "make_questions", "parameters": schema}],
+            messages=messages,
+            functions=[{"name": "make_questions", "parameters": _QUESTIONS_SCHEMA}],
             function_call={"name": "make_questions"},
         )
-        return json.loads(rsp.choices[0].message.function_call.arguments)["questions"]
+        return _function_arguments("questions", rsp, _QUESTIONS_OUTPUT, messages)[
+            "questions"
+        ]
     except Exception as e:
-        st.warning(f"⚠️ Question JSON 生成失敗: {e}")
+        _notify("warning", f"⚠️ Question JSON 生成失敗: {e}")
         return []
 
 
 # ======================================================================
-# SWOT分析
+# 真因分析・改善アクションの出力形式（一括実行モードと共通）
 # ======================================================================
-def show_swot_section_ai(user_input: dict) -> str:
-    external = st.session_state.get("external_output", "(外部環境分析 未実行)")
-    deep_ans = st.session_state.get("deep_dive_questions", [])
-    deep_answers = st.session_state.get("deep_dive_answers", {})
-    # 質問＋ユーザー回答を集約
-    question_and_answers = "\n".join(
-        f"{i+1}. {q['category']}｜{q['question']} → {deep_answers.get(f'qq_{i+1}','')}"
-        for i, q in enumerate(deep_ans)
-    )
-    prompt = textwrap.dedent(
-        f"""
-        下記すべての情報をもとに、S（強み）W（弱み）O（機会）T（脅威）を
-        それぞれ3～5点ずつ挙げてください。強み・弱みには「課題」や「AIからの質問内容」も反映させてください。
-        各項目は「要点＋根拠」のセットで、論理的かつ端的に。
-
-        【課題】
-        {user_input.get('経営の問題点','未入力')}
-        【基本・財務情報】
-        会社名: {user_input.get('会社名・屋号')}
-        業種: {user_input.get('業種（できるだけ詳しく）')}
-        地域: {user_input.get('地域')}
-        年間売上高: {user_input.get('年間売上高（おおよそ）')}
-        粗利率: {user_input.get('粗利率（おおよそ）')}
-        最終利益: {user_input.get('最終利益（税引後・おおよそ）')}
-        借入金額: {user_input.get('借入金額（だいたい）')}
-
-        【外部環境】
-        {external}
-
-        【AIからの質問・回答】
-        {question_and_answers}
-        """
-    )
-    swot = run_gpt(prompt)
-    st.session_state["swot_output"] = swot
-    return swot
-
-
-# ======================================================================
-# 真因分析（すべての情報から）
-# ======================================================================
-def root_cause_analysis_ai(user_input: dict) -> str:
-    import textwrap, streamlit as st
-    import re
-
-    external = st.session_state.get("external_output", "(外部環境分析 未実行)")
-    swot = st.session_state.get("swot_output", "(SWOT 未実行)")
-    deep_ans = st.session_state.get("deep_dive_questions", [])
-    deep_answers = st.session_state.get("deep_dive_answers", {})
-    question_and_answers = "\n".join(
-        f"{i+1}. {q['category']}｜{q['question']} → {deep_answers.get(f'qq_{i+1}','')}"
-        for i, q in enumerate(deep_ans)
-    )
-
-    prompt = textwrap.dedent(
-        f"""
-あなたは現場・経営に強い超一流コンサルタントです。
-下記情報をもとに、必ず以下の順で構造的に出力してください。
-
+_ROOT_CAUSE_FORMAT = """\
 1. # 現在の問題点
   - 箇条書きで2～5点程度、現象や症状を具体的に（できれば数字・現場証拠も）。
 2. # 主な原因
@@ -299,58 +674,9 @@ def root_cause_analysis_ai(user_input: dict) -> str:
 # 真因（Root Cause）
 **営業戦略の多角化不足**
 なぜこれが真因か：既存顧客依存度が高く、新規市場開拓リソースが不足しているため。
+"""
 
----
-【問題】
-{user_input.get('経営の問題点','未入力')}
-【基本・財務情報】
-会社名: {user_input.get('会社名・屋号')}
-業種: {user_input.get('業種（できるだけ詳しく）')}
-地域: {user_input.get('地域')}
-年間売上高: {user_input.get('年間売上高（おおよそ）')}
-粗利率: {user_input.get('粗利率（おおよそ）')}
-最終利益: {user_input.get('最終利益（税引後・おおよそ）')}
-借入金額: {user_input.get('借入金額（だいたい）')}
-
-【外部環境】
-{external}
-
-【AIからの質問・回答】
-{question_and_answers}
-
-【SWOT分析】
-{swot}
-    """
-    )
-
-    txt = run_gpt(prompt)
-    # 念のためHTMLタグ除去（AIが万一タグを返しても大丈夫なように）
-    clean_txt = re.sub(r"<[^>]+>", "", txt)
-    st.session_state["root_cause_output"] = clean_txt
-    return clean_txt
-
-
-# ======================================================================
-# 改善アクション提案＋統合評価
-# ======================================================================
-def action_with_eval_ai(user_input: dict) -> Dict[str, Any]:
-    import textwrap, streamlit as st, json, traceback
-
-    external = st.session_state.get("external_output", "")
-    swot = st.session_state.get("swot_output", "")
-    root = st.session_state.get("root_cause_output", "")
-    deep_ans = st.session_state.get("deep_dive_questions", [])
-    deep_answers = st.session_state.get("deep_dive_answers", {})
-    question_and_answers = "\n".join(
-        f"{i+1}. {q['category']}｜{q['question']} → {deep_answers.get(f'qq_{i+1}','')}"
-        for i, q in enumerate(deep_ans)
-    )
-    prompt = textwrap.dedent(
-        f"""
-下記の全情報を統合し、「最も効果的な改善アクション（1～2個）」を【🚩最優先アクション】として必ず"最上位で目立つように"、さらに重要なアクションも加えて計3つ提案してください。
-【重要】最優先アクション（is_best:true）は、必ず合計点（total）が最大のものに設定してください。
-複数同点がある場合は、最も即効性・重要性が高い施策1つのみis_best:true、それ以外はis_best:falseとしてください。
-
+_ACTION_RULES = """\
 各アクションごとに、下記13項目を必ずJSON形式で記述してください（空欄禁止）。
 
 1. title（タイトル。最優先は"【🚩最優先アクション】"で始める）
@@ -370,9 +696,9 @@ def action_with_eval_ai(user_input: dict) -> Dict[str, Any]:
 15. total（合計点数）, rank（A/B/C）, is_best（bool/最優先true）
 
 【JSON出力例】
-{{
+{
   "actions": [
-    {{
+    {
       "title": "【🚩最優先アクション】特定整備認証と電子整備対応体制の即時強化",
       "content": "...",
       "evidence": "...",
@@ -390,120 +716,249 @@ def action_with_eval_ai(user_input: dict) -> Dict[str, Any]:
       "total": 41,
       "rank": "A",
       "is_best": true
-    }},
+    },
     ...
   ]
-}}
+}
+"""
+
+_ACTION_ITEM_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "content": {"type": "string"},
+        "evidence": {"type": "string"},
+        "risk": {"type": "string"},
+        "kpi": {"type": "string"},
+        "V": {"type": "integer"},
+        "root_V": {"type": "string"},
+        "R": {"type": "integer"},
+        "root_R": {"type": "string"},
+        "I": {"type": "integer"},
+        "root_I": {"type": "string"},
+        "O": {"type": "integer"},
+        "root_O": {"type": "string"},
+        "市場成長性": {"type": "integer"},
+        "root_市場成長性": {"type": "string"},
+        "実行難易度": {"type": "integer"},
+        "root_実行難易度": {"type": "string"},
+        "投資効率": {"type": "integer"},
+        "root_投資効率": {"type": "string"},
+        "顧客評価": {"type": "integer"},
+        "root_顧客評価": {"type": "string"},
+        "リスク": {"type": "integer"},
+        "root_リスク": {"type": "string"},
+        "total": {"type": "integer"},
+        "rank": {"type": "string"},
+        "is_best": {"type": "boolean"},
+    },
+    "required": [
+        "title",
+        "content",
+        "evidence",
+        "risk",
+        "kpi",
+        "V",
+        "root_V",
+        "R",
+        "root_R",
+        "I",
+        "root_I",
+        "O",
+        "root_O",
+        "市場成長性",
+        "root_市場成長性",
+        "実行難易度",
+        "root_実行難易度",
+        "投資効率",
+        "root_投資効率",
+        "顧客評価",
+        "root_顧客評価",
+        "リスク",
+        "root_リスク",
+        "total",
+        "rank",
+        "is_best",
+    ],
+}
+_ACTIONS_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {"actions": {"type": "array", "items": _ACTION_ITEM_SCHEMA}},
+    "required": ["actions"],
+}
+_ACTIONS_OUTPUT = SchemaValidator(_ACTIONS_SCHEMA)
+
+
+# ======================================================================
+# Step4〜6 共通の前提（課題・基本情報・外部環境・質問と回答）
+#   入力ごとに1度だけ組み立て、回答が長ければ要約して使い回す（modules.context_digest）
+#   各ステップのプロンプトはこの前提を先頭に置き、ステップ固有の指示・前段の結果は後ろに
+#   置く（システムプロンプト＋前提が共通の先頭部分になり、プロンプトキャッシュが効く）
+# ======================================================================
+_DIGEST_MODEL = os.getenv("AI_DOCK_DIGEST_MODEL", "gpt-4.1-mini")
+
+
+def _context_digest(user_input: dict) -> str:
+    return get_digest_cache().build(
+        user_input,
+        _state().get("external_output") or "(外部環境分析 未実行)",
+        _state().get("deep_dive_questions") or [],
+        _state().get("deep_dive_answers") or {},
+        summarize=_summarize_answers,
+    )
 
-【外部環境】
-{external}
 
-【AIからの質問・回答】
-{question_and_answers}
+def _summarize_answers(question_and_answers: str, max_chars: int) -> str:
+    prompt = textwrap.dedent(
+        f"""
+        以下は経営者へのヒアリング（質問と回答）です。後続のSWOT分析・真因分析・
+        改善アクション提案に使うため、{max_chars}文字以内に要約してください。
+        数値・固有名詞・具体的な事実は省かずに残し、質問の番号とカテゴリごとに箇条書きで。
+
+        """
+    ) + question_and_answers
+    rsp = _chat_completion(
+        "digest",
+        model=_DIGEST_MODEL,
+        messages=[
+            {"role": "system", "content": _SYSTEM_PROMPT},
+            {"role": "user", "content": prompt},
+        ],
+        temperature=0.2,
+    )
+    return rsp.choices[0].message.content.strip()
+
+
+# ======================================================================
+# SWOT分析
+# ======================================================================
+def show_swot_section_ai(user_input: dict) -> str:
+    prompt = f"""{_context_digest(user_input)}
 
+---
+上記すべての情報をもとに、S（強み）W（弱み）O（機会）T（脅威）を
+それぞれ3～5点ずつ挙げてください。強み・弱みには「課題」や「AIからの質問内容」も反映させてください。
+各項目は「要点＋根拠」のセットで、論理的かつ端的に。
+"""
+    swot = run_gpt(prompt, step="swot")
+    _state()["swot_output"] = swot
+    return swot
+
+
+# ======================================================================
+# 真因分析（すべての情報から）
+# ======================================================================
+def root_cause_analysis_ai(user_input: dict) -> str:
+    swot = _state().get("swot_output", "(SWOT 未実行)")
+
+    prompt = f"""{_context_digest(user_input)}
+
+---
+あなたは現場・経営に強い超一流コンサルタントです。
+上記情報と末尾のSWOT分析をもとに、必ず以下の順で構造的に出力してください。
+
+{_ROOT_CAUSE_FORMAT}
+---
+【SWOT分析】
+{swot}
+"""
+
+    txt = run_gpt(prompt, step="root_cause")
+    # 念のためHTMLタグ除去（AIが万一タグを返しても大丈夫なように）
+    clean_txt = re.sub(r"<[^>]+>", "", txt)
+    _state()["root_cause_output"] = clean_txt
+    return clean_txt
+
+
+# ======================================================================
+# 改善アクション提案＋統合評価
+# ======================================================================
+def action_with_eval_ai(user_input: dict) -> Dict[str, Any]:
+    swot = _state().get("swot_output", "")
+    root = _state().get("root_cause_output", "")
+    prompt = f"""{_context_digest(user_input)}
+
+---
+上記と下記の全情報を統合し、「最も効果的な改善アクション（1～2個）」を【🚩最優先アクション】として必ず"最上位で目立つように"、さらに重要なアクションも加えて計3つ提案してください。
+【重要】最優先アクション（is_best:true）は、必ず合計点（total）が最大のものに設定してください。
+複数同点がある場合は、最も即効性・重要性が高い施策1つのみis_best:true、それ以外はis_best:falseとしてください。
+
+{_ACTION_RULES}
 【SWOT分析】
 {swot}
 
 【真因分析】
 {root}
-        """
-    )
-    schema = {
-        "type": "object",
-        "properties": {
-            "actions": {
-                "type": "array",
-                "items": {
-                    "type": "object",
-                    "properties": {
-                        "title": {"type": "string"},
-                        "content": {"type": "string"},
-                        "evidence": {"type": "string"},
-                        "risk": {"type": "string"},
-                        "kpi": {"type": "string"},
-                        "V": {"type": "integer"},
-                        "root_V": {"type": "string"},
-                        "R": {"type": "integer"},
-                        "root_R": {"type": "string"},
-                        "I": {"type": "integer"},
-                        "root_I": {"type": "string"},
-                        "O": {"type": "integer"},
-                        "root_O": {"type": "string"},
-                        "市場成長性": {"type": "integer"},
-                        "root_市場成長性": {"type": "string"},
-                        "実行難易度": {"type": "integer"},
-                        "root_実行難易度": {"type": "string"},
-                        "投資効率": {"type": "integer"},
-                        "root_投資効率": {"type": "string"},
-                        "顧客評価": {"type": "integer"},
-                        "root_顧客評価": {"type": "string"},
-                        "リスク": {"type": "integer"},
-                        "root_リスク": {"type": "string"},
-                        "total": {"type": "integer"},
-                        "rank": {"type": "string"},
-                        "is_best": {"type": "boolean"},
-                    },
-                    "required": [
-                        "title",
-                        "content",
-                        "evidence",
-                        "risk",
-                        "kpi",
-                        "V",
-                        "root_V",
-                        "R",
-                        "root_R",
-                        "I",
-                        "root_I",
-                        "O",
-                        "root_O",
-                        "市場成長性",
-                        "root_市場成長性",
-                        "実行難易度",
-                        "root_実行難易度",
-                        "投資効率",
-                        "root_投資効率",
-                        "顧客評価",
-                        "root_顧客評価",
-                        "リスク",
-                        "root_リスク",
-                        "total",
-                        "rank",
-                        "is_best",
-                    ],
-                },
-            }
-        },
-        "required": ["actions"],
-    }
+"""
+    messages = [
+        {"role": "system", "content": _SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
     try:
-        rsp = client.chat.completions.create(
+        rsp = _chat_completion(
+            "actions",
+            listener=_action_listener(),
             model=_DEFAULT_MODEL,
-            messages=[
-                {"role": "system", "content": _SYSTEM_PROMPT},
-                {"role": "user", "content": prompt},
-            ],
-            functions=[{"name": "make_actions", "parameters": schema}],
+            messages=messages,
+            functions=[{"name": "make_actions", "parameters": _ACTIONS_SCHEMA}],
             function_call={"name": "make_actions"},
         )
 
-        raw = json.loads(rsp.choices[0].message.function_call.arguments)["actions"]
-
-        # 合計点最大のものだけ is_best=True に補正（複数あれば最初の1つのみTrue）
-        max_score = max(a.get("total", 0) for a in raw)
-        first_flag = False
-        for a in raw:
-            if a.get("total", 0) == max_score and not first_flag:
-                a["is_best"] = True
-                first_flag = True
-            else:
-                a["is_best"] = False
+        raw = _function_arguments("actions", rsp, _ACTIONS_OUTPUT, messages)["actions"]
+        _mark_best_action(raw)
 
     except Exception as e:
-        st.session_state["action_error_trace"] = traceback.format_exc()
-        st.error(f"⚠️ Action+Eval 生成失敗: {e}")
+        _state()["action_error_trace"] = traceback.format_exc()
+        _notify("error", f"⚠️ Action+Eval 生成失敗: {e}")
         return {"actions_md": "", "evaluations": []}
 
+    return _action_result(raw)
+
+
+def _action_listener() -> DeltaListener | None:
+    """
+    ジョブ内なら、ストリームで届く make_actions の引数からアクションが1件閉じるたびに
+    途中経過（_action_result の形）をジョブへ保存する。is_best は最後に _mark_best_action で補正。
+    """
+    from modules.jobs import progress_reporter
+
+    report = progress_reporter()
+    if report is None:
+        return None
+    sent = False
+
+    def listener():
+        nonlocal sent
+        if sent:
+            report(None)  # 別のモデルで送り直し → 途中経過を消す
+        sent = True
+        items = ItemStream("actions", _ACTIONS_OUTPUT)
+
+        def on_delta(delta: Dict[str, Any]) -> None:
+            fc = delta.get("function_call") or next(
+                (tc.get("function") or {} for tc in delta.get("tool_calls") or []), {}
+            )
+            if items.feed(fc.get("arguments") or delta.get("content") or ""):
+                report(_action_result(items.items))
+
+        return on_delta
+
+    return listener
+
+
+def _mark_best_action(raw: List[Dict[str, Any]]) -> None:
+    # 合計点最大のものだけ is_best=True に補正（複数あれば最初の1つのみTrue）
+    max_score = max(a.get("total", 0) for a in raw)
+    first_flag = False
+    for a in raw:
+        if a.get("total", 0) == max_score and not first_flag:
+            a["is_best"] = True
+            first_flag = True
+        else:
+            a["is_best"] = False
+
+
+def _action_result(raw: List[Dict[str, Any]]) -> Dict[str, Any]:
     # Markdown用出力（最優先アクションをアイコン強調！）
     md = []
     for a in raw:
@@ -521,6 +976,73 @@ def action_with_eval_ai(user_input: dict) -> Dict[str, Any]:
     return {"actions_md": "\n".join(md), "evaluations": raw}
 
 
+# ======================================================================
+# 一括実行モード：SWOT＋真因分析＋改善アクションを1回の呼び出しで
+#   各ステップと同じ入力を1度だけ送り、結果は同じセッションキー・同じ表示形式で返す
+# ======================================================================
+_DIAGNOSIS_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "swot": {"type": "string"},
+        "root_cause": {"type": "string"},
+        "actions": {"type": "array", "items": _ACTION_ITEM_SCHEMA},
+    },
+    "required": ["swot", "root_cause", "actions"],
+}
+_DIAGNOSIS_OUTPUT = SchemaValidator(_DIAGNOSIS_SCHEMA)
+
+
+def diagnose_fused_ai(user_input: dict) -> Dict[str, Any]:
+    prompt = f"""{_context_digest(user_input)}
+
+---
+上記すべての情報をもとに、(1) SWOT分析 (2) 真因分析 (3) 改善アクション提案＋統合評価 を
+この順に考え、make_diagnosis 関数の swot / root_cause / actions にそれぞれ出力してください。
+後の分析は必ず前の分析の結果を踏まえること。
+
+## (1) swot（Markdown文字列）
+S（強み）W（弱み）O（機会）T（脅威）をそれぞれ3～5点ずつ挙げてください。
+強み・弱みには「課題」や「AIからの質問内容」も反映させてください。
+各項目は「要点＋根拠」のセットで、論理的かつ端的に。
+
+## (2) root_cause（Markdown文字列）
+必ず以下の順で構造的に出力してください。
+{_ROOT_CAUSE_FORMAT}
+## (3) actions（配列）
+「最も効果的な改善アクション（1～2個）」を【🚩最優先アクション】として必ず"最上位で目立つように"、さらに重要なアクションも加えて計3つ提案してください。
+【重要】最優先アクション（is_best:true）は、必ず合計点（total）が最大のものに設定してください。
+{_ACTION_RULES}"""
+    messages = [
+        {"role": "system", "content": _SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+    try:
+        rsp = _chat_completion(
+            "fused",
+            model=_DEFAULT_MODEL,
+            messages=messages,
+            functions=[{"name": "make_diagnosis", "parameters": _DIAGNOSIS_SCHEMA}],
+            function_call={"name": "make_diagnosis"},
+        )
+        data = _function_arguments("fused", rsp, _DIAGNOSIS_OUTPUT, messages)
+        _mark_best_action(data["actions"])
+    except Exception as e:
+        _state()["action_error_trace"] = traceback.format_exc()
+        _notify("error", f"⚠️ 一括診断の生成失敗: {e}")
+        return {}
+
+    swot = data["swot"].strip()
+    # 念のためHTMLタグ除去（個別実行の真因分析と同じ）
+    root_cause = re.sub(r"<[^>]+>", "", data["root_cause"]).strip()
+    _state()["swot_output"] = swot
+    _state()["root_cause_output"] = root_cause
+    return {
+        "swot_output": swot,
+        "root_cause_output": root_cause,
+        "action_result": _action_result(data["actions"]),
+    }
+
+
 # ----------------------------------------------------------------------
 # 公開シンボル
 # ----------------------------------------------------------------------
@@ -530,5 +1052,6 @@ __all__ = [
     "show_swot_section_ai",
     "root_cause_analysis_ai",
     "action_with_eval_ai",
+    "diagnose_fused_ai",
     "run_gpt",
 ]
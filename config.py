@@ -1,6 +1,13 @@
 # config.py
+import hashlib
+from functools import lru_cache
+from pathlib import Path
+
 import streamlit as st
 
+# .streamlit/config.toml の server.enableStaticServing で /app/static/ から配信
+_STATIC_DIR = Path(__file__).parent / "static"
+
 
 def init_page(
     *,
@@ -12,37 +19,50 @@ def init_page(
     - この関数を **各ページの最上段** で呼び出すだけで
       ・set_page_config
       ・共通 CSS / フォント
+      ・退避中のセッション値の復元（modules.session_store）
       を自動適用。
-    - 2 回目以降の呼び出しは無視されるので重複エラーが起きない。
+    - 2 回目以降の set_page_config は呼ばないので重複エラーが起きない。
+    - CSS は静的ファイルへの <link> だけを送るため、毎回の再実行でも軽い。
     """
-    if "_page_initialized" in st.session_state:
-        return
+    from modules.session_store import restore_session_state
 
-    st.set_page_config(page_title=title, layout=layout)
+    restore_session_state()
 
     if styles_once:
         _apply_global_styles()
 
+    if "_page_initialized" in st.session_state:
+        return
+
+    st.set_page_config(page_title=title, layout=layout)
+
     st.session_state["_page_initialized"] = True
 
 
-# ---------- 共通スタイル ----------
-def _apply_global_styles() -> None:
-    if "_style_injected" in st.session_state:
-        return
+# ---------- 静的アセット ----------
+@lru_cache(maxsize=None)
+def static_url(rel_path: str) -> str:
+    """static/ 配下のファイルURL。内容ハッシュ付きなのでブラウザキャッシュを安全に使える。"""
+    digest = hashlib.md5((_STATIC_DIR / rel_path).read_bytes()).hexdigest()[:10]
+    return f"/app/static/{rel_path}?v={digest}"
+
+
+def use_stylesheet(name: str) -> None:
+    """static/css/<name> を読み込む（<style> 本文は送らない）。"""
     st.markdown(
-        """
-<style>
-html,body,[class*="css"]{font-family:"Helvetica Neue","Roboto",sans-serif;color:#212121;}
-h2{color:#1F4E79;margin-top:0.8rem;}
-a{color:#1F4E79;}
-div[data-testid="stProgress"]>div>div>div{height:10px;}
-.stButton>button{border:1px solid #1F4E79 !important;border-radius:6px !important;
-                 color:#1F4E79 !important;background:#fff !important;padding:.35rem 1.2rem !important;
-                 font-weight:600 !important;}
-.stButton>button:hover{background:#1F4E79 !important;color:#fff !important;}
-</style>
-""",
+        f'<link rel="stylesheet" href="{static_url(f"css/{name}")}">',
         unsafe_allow_html=True,
     )
-    st.session_state["_style_injected"] = True
+
+
+def inject_analytics() -> None:
+    """Google Analytics（GA4）。初期化処理は static/js/ga4.js 側で1回だけ実行。"""
+    st.html(
+        f'<script src="{static_url("js/ga4.js")}"></script>',
+        unsafe_allow_javascript=True,
+    )
+
+
+# ---------- 共通スタイル ----------
+def _apply_global_styles() -> None:
+    use_stylesheet("global.css")
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+# ======================================================================
+# modules/admission.py ― 診断フローの同時実行数制御（待ち行列＋ETA）
+# ======================================================================
+"""
+AI経営診断（Step2〜6）を同時に進められるセッション数をサーバー全体で制限する。
+上限に達している間に来たセッションは先着順の待ち行列に入り、
+順番と待ち時間の目安（ETA）を表示して待つ。
+
+- 入場したセッションは、アクション提案まで終わるか、リセットするか、
+  一定時間アクセスがない（タブを閉じた等）と枠を返す。ページを開いている間は
+  画面側が touch() で定期的に最終アクセスを更新する（質問への回答の入力中など、
+  操作がなくても枠を失わないように）。
+- ETA は直近のステップ所要時間（metrics の diagnosis.step_sec.<step>）の
+  中央値から1診断あたりの所要時間を見積もり、進行中の診断の残り時間と
+  合わせて計算する。実績がない間は既定値を使う。
+
+設定（環境変数）:
+    AI_DOCK_MAX_ACTIVE_DIAGNOSES   同時に進められる診断数（既定 20, 0 で無制限）
+    AI_DOCK_ADMISSION_IDLE_SEC     この秒数操作がなければ枠／順番を返す（既定 900）
+"""
+
+from __future__ import annotations
+
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List
+
+from modules.metrics import metrics
+
+# 実績がない間の各ステップ所要時間の目安（秒）
+DEFAULT_STEP_SEC: Dict[str, float] = {
+    "external": 60.0,
+    "questions": 20.0,
+    "swot": 30.0,
+    "root_cause": 30.0,
+    "actions": 45.0,
+}
+# 質問への回答など、AI実行以外に利用者がかける時間の目安（秒）
+USER_THINK_SEC = 120.0
+
+
+@dataclass
+class Admission:
+    admitted: bool
+    position: int = 0  # 待ち行列での順番（1始まり、入場済みなら 0）
+    eta_sec: float = 0.0
+    active: int = 0
+    limit: int = 0
+
+
+def step_latency_sec(step: str) -> float:
+    p50 = metrics.histogram(f"diagnosis.step_sec.{step}").percentile(50)
+    return DEFAULT_STEP_SEC.get(step, 30.0) if math.isnan(p50) else p50
+
+
+def estimated_diagnosis_sec() -> float:
+    """1診断（入場から完了まで）の所要時間の見積もり。"""
+    return sum(step_latency_sec(s) for s in DEFAULT_STEP_SEC) + USER_THINK_SEC
+
+
+class AdmissionController:
+    def __init__(self, *, max_active: int = 20, idle_sec: float = 900) -> None:
+        self.max_active = max_active
+        self.idle_sec = idle_sec
+        self._lock = threading.Lock()
+        # session_id → (入場時刻, 最終アクセス時刻)
+        self._active: "OrderedDict[str, List[float]]" = OrderedDict()
+        # session_id → 最終アクセス時刻（先着順）
+        self._waiting: "OrderedDict[str, float]" = OrderedDict()
+
+    def enter(self, session_id: str | None) -> Admission:
+        """診断ページの実行ごとに呼ぶ。入場済みなら最終アクセスを更新する。"""
+        if session_id is None or self.max_active <= 0:
+            return Admission(admitted=True)
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            if session_id in self._active:
+                self._active[session_id][1] = now
+                return Admission(True, active=len(self._active), limit=self.max_active)
+            self._waiting[session_id] = now
+            self._admit(now)
+            if session_id in self._active:
+                return Admission(True, active=len(self._active), limit=self.max_active)
+            position = list(self._waiting).index(session_id) + 1
+            return Admission(
+                False,
+                position=position,
+                eta_sec=self._eta(position, now),
+                active=len(self._active),
+                limit=self.max_active,
+            )
+
+    def touch(self, session_id: str | None) -> None:
+        """ページを開いている間の定期更新。入場済み・待ち行列のどちらでも最終アクセスを更新する。"""
+        if session_id is None:
+            return
+        now = time.time()
+        with self._lock:
+            if session_id in self._active:
+                self._active[session_id][1] = now
+            elif session_id in self._waiting:
+                self._waiting[session_id] = now
+
+    def leave(self, session_id: str | None, *, completed: bool = False) -> None:
+        if session_id is None:
+            return
+        now = time.time()
+        with self._lock:
+            entry = self._active.pop(session_id, None)
+            self._waiting.pop(session_id, None)
+            if entry and completed:
+                metrics.histogram("diagnosis.session_sec").observe(now - entry[0])
+            self._admit(now)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "active": len(self._active),
+                "waiting": len(self._waiting),
+                "limit": self.max_active,
+            }
+
+    # ---------------- 内部処理（self._lock を保持して呼ぶ） ----------------
+    def _expire(self, now: float) -> None:
+        for sid, (_, seen) in list(self._active.items()):
+            if now - seen > self.idle_sec:
+                del self._active[sid]
+        for sid, seen in list(self._waiting.items()):
+            if now - seen > self.idle_sec:
+                del self._waiting[sid]
+        self._admit(now)
+
+    def _admit(self, now: float) -> None:
+        while self._waiting and len(self._active) < self.max_active:
+            sid, _ = self._waiting.popitem(last=False)
+            self._active[sid] = [now, now]
+
+    def _eta(self, position: int, now: float) -> float:
+        """position 番目の待ちが入場できるまでの見積もり（秒）。"""
+        observed = metrics.histogram("diagnosis.session_sec").percentile(50)
+        per = estimated_diagnosis_sec() if math.isnan(observed) else observed
+        # 進行中の診断の残り時間（早く空く順）
+        remaining = sorted(
+            max(0.0, per - (now - t0)) for t0, _ in self._active.values()
+        )
+        if not remaining:
+            return 0.0
+        slot = (position - 1) % len(remaining)
+        rounds = (position - 1) // len(remaining)
+        return remaining[slot] + rounds * per
+
+
+_CONTROLLER: AdmissionController | None = None
+_CONTROLLER_LOCK = threading.Lock()
+
+
+def get_admission() -> AdmissionController:
+    global _CONTROLLER
+    with _CONTROLLER_LOCK:
+        if _CONTROLLER is None:
+            _CONTROLLER = AdmissionController(
+                max_active=int(os.getenv("AI_DOCK_MAX_ACTIVE_DIAGNOSES", "20")),
+                idle_sec=float(os.getenv("AI_DOCK_ADMISSION_IDLE_SEC", "900")),
+            )
+        return _CONTROLLER
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# ======================================================================
+# modules/cancellation.py ― キャンセルトークン
+# ======================================================================
+"""
+実行中の LLM 呼び出しを外から打ち切るためのトークン。
+
+    token = CancelToken()
+    unregister = token.on_cancel(stream.close)   # キャンセル時に呼ぶ処理
+    ...
+    token.cancel("不要になった")                   # 別スレッドから
+    token.raise_if_cancelled()                    # → Cancelled
+
+child() で作ったトークンは親がキャンセルされると一緒にキャンセルされる。
+deadline_sec を指定すると、その秒数が過ぎた時点で自動的にキャンセルされる。
+
+バックグラウンドジョブ（modules.jobs）は実行中のジョブのトークンを
+use_token() でスレッドに結び付け、LLM 呼び出し側は current_token() で参照する。
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, List
+
+
+class Cancelled(Exception):
+    """キャンセルされたため処理を中断した。"""
+
+
+class CancelToken:
+    def __init__(self, deadline_sec: float | None = None) -> None:
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._callbacks: List[Callable[[], None]] = []
+        self.reason = ""
+        self.deadline: float | None = None  # time.monotonic() 基準
+        if deadline_sec is not None:
+            self.deadline = time.monotonic() + deadline_sec
+            timer = threading.Timer(
+                deadline_sec,
+                self.cancel,
+                args=(f"制限時間（{deadline_sec:.0f}秒）を超えたため中断しました",),
+            )
+            timer.daemon = True
+            timer.start()
+            self._callbacks.append(timer.cancel)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "キャンセルされました") -> None:
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for cb in callbacks:
+            try:
+                cb()
+            except Exception:
+                pass
+
+    def on_cancel(self, cb: Callable[[], None]) -> Callable[[], None]:
+        """キャンセル時に cb を呼ぶ（既にキャンセル済みなら即呼ぶ）。解除関数を返す。"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(cb)
+
+                def unregister() -> None:
+                    with self._lock:
+                        if cb in self._callbacks:
+                            self._callbacks.remove(cb)
+
+                return unregister
+        cb()
+        return lambda: None
+
+    def remaining(self) -> float | None:
+        """期限までの残り秒数（期限なしなら None）。"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def raise_if_cancelled(self) -> None:
+        if self._event.is_set():
+            raise Cancelled(self.reason)
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self._event.wait(timeout)
+
+    def child(self, deadline_sec: float | None = None) -> "CancelToken":
+        """
+        親のキャンセルに連動するトークン。deadline_sec を渡すと、親の期限より
+        早い場合はそれを期限にする（子だけが期限切れになっても親はそのまま）。
+        """
+        remaining = self.remaining()
+        if deadline_sec is not None and (remaining is None or deadline_sec < remaining):
+            child = CancelToken(deadline_sec)
+        else:
+            child = CancelToken()
+            child.deadline = self.deadline
+        unregister = self.on_cancel(lambda: child.cancel(self.reason))
+        child.on_cancel(unregister)
+        return child
+
+
+_local = threading.local()
+
+
+def current_token() -> CancelToken | None:
+    """このスレッドで実行中の処理に結び付いたトークン。"""
+    return getattr(_local, "token", None)
+
+
+@contextmanager
+def use_token(token: CancelToken | None):
+    prev = current_token()
+    _local.token = token
+    try:
+        yield token
+    finally:
+        _local.token = prev
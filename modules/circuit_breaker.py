@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+# ======================================================================
+# modules/circuit_breaker.py ― モデルのエンドポイント単位のサーキットブレーカー
+# ======================================================================
+"""
+上流が不安定なとき、タイムアウトまで待ってから失敗する呼び出しを繰り返さないよう、
+直近の呼び出し結果からエンドポイント（接続先＋モデル）ごとに遮断する。
+
+- closed     通常。直近 window 件のうち、失敗率または遅延率がしきい値を超えたら open
+- open       open_sec の間は呼び出さずに CircuitOpenError で即失敗
+- half_open  open_sec 経過後、1件だけ試しに通す（成功→closed／失敗→open）
+
+失敗として数えるのは、接続エラー・タイムアウト・5xx（status_code を持たないか 500 以上）。
+4xx（リクエスト不正やレート制限）は上流の障害ではないので数えない。
+
+設定（環境変数）:
+    AI_DOCK_BREAKER_WINDOW       判定に使う直近の呼び出し数（既定 20）
+    AI_DOCK_BREAKER_MIN_CALLS    判定に必要な最小件数（既定 5）
+    AI_DOCK_BREAKER_ERROR_RATE   失敗率のしきい値（既定 0.5）
+    AI_DOCK_BREAKER_SLOW_SEC     「遅い」とみなす所要時間（既定 60秒）
+    AI_DOCK_BREAKER_SLOW_RATE    遅延率のしきい値（既定 0.5）
+    AI_DOCK_BREAKER_OPEN_SEC     遮断を続ける時間（既定 30秒）
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from typing import Any, Callable, ContextManager, Deque, Dict, List, Tuple
+
+from modules.cancellation import Cancelled
+from modules.metrics import metrics
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """遮断中のため呼び出さなかった。"""
+
+    def __init__(self, name: str, retry_in: float) -> None:
+        self.name = name
+        self.retry_in = retry_in
+        super().__init__(
+            f"AIサービス（{name}）が不安定なため、一時的に呼び出しを停止しています。"
+            f"約{max(1, round(retry_in))}秒後に再度お試しください。"
+        )
+
+
+def is_upstream_failure(exc: BaseException) -> bool:
+    status = getattr(exc, "status_code", None)
+    return status is None or status >= 500
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        *,
+        window: int = 20,
+        min_calls: int = 5,
+        error_rate: float = 0.5,
+        slow_sec: float = 60.0,
+        slow_rate: float = 0.5,
+        open_sec: float = 30.0,
+    ) -> None:
+        self.name = name
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_sec = slow_sec
+        self.slow_rate = slow_rate
+        self.open_sec = open_sec
+        self._lock = threading.Lock()
+        self._results: Deque[Tuple[bool, bool]] = deque(maxlen=window)  # (失敗, 遅延)
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+
+    def call(self, fn: Callable[[], Any], *, wait: ContextManager | None = None) -> Any:
+        """
+        遮断中でなければ fn を呼ぶ。wait（スケジューラの枠取りなど）は fn の前に
+        入り、その待ち時間は所要時間に含めない。
+        """
+        probe = self._before()
+        recorded = False
+        try:
+            with wait or nullcontext():
+                t0 = time.perf_counter()
+                try:
+                    result = fn()
+                except Cancelled:
+                    raise  # こちらから打ち切った呼び出しは成否に数えない
+                except BaseException as e:
+                    recorded = True
+                    self._record(is_upstream_failure(e), time.perf_counter() - t0)
+                    raise
+                recorded = True
+                self._record(False, time.perf_counter() - t0)
+                return result
+        finally:
+            if probe and not recorded:
+                # 試行が上流へ届かなかった（待ち中の中断など）→ 次の呼び出しで再試行
+                with self._lock:
+                    self._probing = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            n = len(self._results)
+            return {
+                "endpoint": self.name,
+                "state": self.state,
+                "calls": n,
+                "failures": sum(f for f, _ in self._results),
+                "slow": sum(s for _, s in self._results),
+            }
+
+    # ---------------- 内部処理 ----------------
+    def _before(self) -> bool:
+        """通してよければ返る（half_open の試行なら True）。遮断中は例外。"""
+        with self._lock:
+            if self.state == CLOSED:
+                return False
+            remaining = self._opened_at + self.open_sec - time.monotonic()
+            if self.state == OPEN and remaining <= 0:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True  # この1件を試しに通す
+                return True
+        metrics.counter("llm.breaker.rejected").inc()
+        raise CircuitOpenError(self.name, max(remaining, 1.0))
+
+    def _record(self, failed: bool, latency: float) -> None:
+        slow = latency >= self.slow_sec
+        with self._lock:
+            if self.state == HALF_OPEN and self._probing:
+                self._probing = False
+                if failed or slow:
+                    self._trip()
+                else:
+                    self.state = CLOSED
+                    self._results.clear()
+                return
+            self._results.append((failed, slow))
+            n = len(self._results)
+            if self.state != CLOSED or n < self.min_calls:
+                return
+            failures = sum(f for f, _ in self._results)
+            slows = sum(s for _, s in self._results)
+            if failures / n >= self.error_rate or slows / n >= self.slow_rate:
+                self._trip()
+
+    def _trip(self) -> None:
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._results.clear()
+        metrics.counter("llm.breaker.tripped").inc()
+
+
+_BREAKERS: Dict[str, CircuitBreaker] = {}
+_BREAKERS_LOCK = threading.Lock()
+
+
+def get_breaker(endpoint: str) -> CircuitBreaker:
+    with _BREAKERS_LOCK:
+        breaker = _BREAKERS.get(endpoint)
+        if breaker is None:
+            env = os.getenv
+            breaker = _BREAKERS[endpoint] = CircuitBreaker(
+                endpoint,
+                window=int(env("AI_DOCK_BREAKER_WINDOW", "20")),
+                min_calls=int(env("AI_DOCK_BREAKER_MIN_CALLS", "5")),
+                error_rate=float(env("AI_DOCK_BREAKER_ERROR_RATE", "0.5")),
+                slow_sec=float(env("AI_DOCK_BREAKER_SLOW_SEC", "60")),
+                slow_rate=float(env("AI_DOCK_BREAKER_SLOW_RATE", "0.5")),
+                open_sec=float(env("AI_DOCK_BREAKER_OPEN_SEC", "30")),
+            )
+        return breaker
+
+
+def breaker_states() -> List[Dict[str, Any]]:
+    with _BREAKERS_LOCK:
+        breakers = list(_BREAKERS.values())
+    return [b.snapshot() for b in breakers]
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+# ======================================================================
+# modules/context_digest.py ― Step4〜6 共通の「診断の前提」ブロック（入力ごとに1回だけ作る）
+# ======================================================================
+"""
+SWOT分析・真因分析・改善アクション（と一括実行）のプロンプトに共通で入れる
+課題・基本財務情報・外部環境・AIからの質問と回答を、入力のフィンガープリントごとに
+1度だけ組み立て、以降のステップでは同じ文字列を使い回す。
+
+- 質問への回答が長い場合は、上限文字数以内の要約に圧縮できる
+  （AI_DOCK_DIGEST_MAX_CHARS）。圧縮の AI 呼び出しも入力ごとに1回だけで、
+  Step4〜6 のプロンプトの長さが回答の長さに比例しなくなる
+- 同じ入力の組み立てが同時に来た場合は1回にまとめる（singleflight）
+- プロセス内の LRU に保持する（ジョブのワーカーは同じプロセスで動く）
+
+設定（環境変数）:
+    AI_DOCK_DIGEST_MAX_CHARS    質問・回答がこの文字数を超えたら要約する（既定 0 = 要約しない）
+    AI_DOCK_DIGEST_CACHE_SIZE   保持する件数（既定 256）
+
+メトリクス:
+    digest.hit / digest.miss / digest.compressed / digest.compress_failed
+    digest.chars_saved          要約で減った文字数の合計
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List
+
+from modules.cancellation import Cancelled
+from modules.metrics import metrics
+from modules.singleflight import SingleFlight
+
+# 要約関数: (質問・回答の全文, 上限文字数) → 要約
+Summarizer = Callable[[str, int], str]
+
+
+def company_text(user_input: Dict[str, Any]) -> str:
+    return "\n".join(
+        [
+            "【課題】",
+            f"{user_input.get('経営の問題点', '未入力')}",
+            "【基本・財務情報】",
+            f"会社名: {user_input.get('会社名・屋号')}",
+            f"業種: {user_input.get('業種（できるだけ詳しく）')}",
+            f"地域: {user_input.get('地域')}",
+            f"年間売上高: {user_input.get('年間売上高（おおよそ）')}",
+            f"粗利率: {user_input.get('粗利率（おおよそ）')}",
+            f"最終利益: {user_input.get('最終利益（税引後・おおよそ）')}",
+            f"借入金額: {user_input.get('借入金額（だいたい）')}",
+        ]
+    )
+
+
+def qa_text(questions: List[Dict[str, Any]], answers: Dict[str, Any]) -> str:
+    return "\n".join(
+        f"{i+1}. {q['category']}｜{q['question']} → {answers.get(f'qq_{i+1}', '')}"
+        for i, q in enumerate(questions)
+    )
+
+
+def fingerprint(
+    user_input: Dict[str, Any],
+    external: str,
+    questions: List[Dict[str, Any]],
+    answers: Dict[str, Any],
+    max_chars: int,
+) -> str:
+    payload = [user_input, external, questions, answers, max_chars]
+    blob = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()[:16]
+
+
+class DigestCache:
+    def __init__(self, max_entries: int = 256, max_chars: int = 0) -> None:
+        self.max_entries = max_entries
+        self.max_chars = max_chars  # 0 なら要約しない
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._flight = SingleFlight("digest.singleflight")
+
+    def _get(self, key: str) -> str | None:
+        with self._lock:
+            digest = self._entries.get(key)
+            if digest is not None:
+                self._entries.move_to_end(key)
+            return digest
+
+    def _put(self, key: str, digest: str) -> None:
+        with self._lock:
+            self._entries[key] = digest
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def build(
+        self,
+        user_input: Dict[str, Any],
+        external: str,
+        questions: List[Dict[str, Any]],
+        answers: Dict[str, Any],
+        *,
+        summarize: Summarizer | None = None,
+    ) -> str:
+        """前提ブロックを返す（同じ入力なら2回目以降は組み立て・要約しない）。"""
+        key = fingerprint(user_input, external, questions, answers, self.max_chars)
+        digest = self._get(key)
+        if digest is not None:
+            metrics.counter("digest.hit").inc()
+            return digest
+        metrics.counter("digest.miss").inc()
+        return self._flight.do(
+            key,
+            lambda: self._assemble(
+                key, user_input, external, questions, answers, summarize
+            ),
+        )
+
+    def _assemble(
+        self,
+        key: str,
+        user_input: Dict[str, Any],
+        external: str,
+        questions: List[Dict[str, Any]],
+        answers: Dict[str, Any],
+        summarize: Summarizer | None,
+    ) -> str:
+        qa = qa_text(questions, answers)
+        qa_title = "【AIからの質問・回答】"
+        cache = True
+        if summarize is not None and 0 < self.max_chars < len(qa):
+            try:
+                summary = summarize(qa, self.max_chars)[: self.max_chars]
+            except Cancelled:
+                raise
+            except Exception:
+                # 要約できなければ全文を使う（次の呼び出しでまた要約を試す）
+                metrics.counter("digest.compress_failed").inc()
+                cache = False
+            else:
+                metrics.counter("digest.compressed").inc()
+                metrics.counter("digest.chars_saved").inc(len(qa) - len(summary))
+                qa, qa_title = summary, "【AIからの質問・回答（要約）】"
+        digest = "\n".join(
+            [company_text(user_input), "", "【外部環境】", external, "", qa_title, qa]
+        )
+        if cache:
+            self._put(key, digest)
+        return digest
+
+
+_CACHE: DigestCache | None = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_digest_cache() -> DigestCache:
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = DigestCache(
+                int(os.getenv("AI_DOCK_DIGEST_CACHE_SIZE", "256")),
+                int(os.getenv("AI_DOCK_DIGEST_MAX_CHARS", "0")),
+            )
+        return _CACHE
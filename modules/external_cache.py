@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+# ======================================================================
+# modules/external_cache.py ― 外部環境分析の業種×地域キャッシュ（会社をまたいで共有）
+# ======================================================================
+"""
+外部環境分析のうち、会社ではなく業種と地域でほぼ決まる観点（政治・制度／経済／
+社会・文化／技術／業界構造）の結果を、正規化した業種×都道府県をキーに保存し、
+同じ業種・地域の別の会社でも再利用する。
+
+- 観点ごとに鮮度（TTL）を変える（経済は短め、制度・社会は長め）
+- 会社固有の観点（競合ポジション）はキャッシュしない
+- キャッシュする観点は、会社名などを含まない業種×地域だけのプロンプトで生成する
+  （他社の情報が混ざらないようにするため）。キャッシュにない場合も同じプロンプトで
+  生成して保存するので、これらの観点には会社固有の事情（事業内容・問題点など）が
+  反映されない。共有による速さ・費用と引き換えの割り切りで、
+  AI_DOCK_EXTERNAL_CACHE_GENERIC=0 ならキャッシュにない観点は会社固有の
+  プロンプトで生成する（その結果は他社と共有しないので保存しない）。
+  すべての観点を会社固有にするには AI_DOCK_EXTERNAL_CACHE=0
+- SQLite に保存するので、プロセス・サーバー再起動をまたいで共有される
+- 生成元（接続先のホスト＋モデル）もキーに含める。スタンドイン・カセットの再生
+  （modules.llm_standin / modules.llm_cassette）の間は既定でキャッシュを使わない
+  （ベンチマークの出力を本番が読まないように）
+
+設定（環境変数）:
+    AI_DOCK_EXTERNAL_CACHE       0 で無効、1 で常に有効（既定 ローカルの接続先・
+                                 カセット使用時以外は有効）
+    AI_DOCK_EXTERNAL_CACHE_GENERIC  0 でキャッシュにない観点を会社固有のプロンプトで
+                                 生成し、保存しない（既定 1：業種×地域で生成して保存）
+    AI_DOCK_EXTERNAL_MODEL       観点を生成するモデル（既定 gpt-4.1。キーに含める）
+    AI_DOCK_EXTERNAL_CACHE_DB    保存先 SQLite（既定 <tmp>/ai_dock_external_cache.sqlite3）
+    AI_DOCK_EXTERNAL_CACHE_TTL   観点ごとの TTL 上書き（"経済=86400,技術=604800" の形式, 秒）
+
+メトリクス:
+    external_cache.hit / external_cache.miss / external_cache.hit.<観点>
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import unicodedata
+from contextlib import closing
+from typing import Dict, List, Tuple
+
+from modules.metrics import metrics
+
+_DAY = 24 * 60 * 60
+
+# 観点 → 鮮度（秒）。ここに無い観点（競合ポジション）はキャッシュしない
+ASPECT_TTL_SEC: Dict[str, float] = {
+    "政治・制度": 30 * _DAY,
+    "経済": 7 * _DAY,
+    "社会・文化": 30 * _DAY,
+    "技術": 14 * _DAY,
+    "業界構造": 30 * _DAY,
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS external_aspects (
+    source TEXT NOT NULL,
+    aspect TEXT NOT NULL,
+    industry TEXT NOT NULL,
+    region TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (source, aspect, industry, region)
+)
+"""
+_LOOPBACK_HOSTS = ("127.0.0.1", "localhost", "[::1]", "0.0.0.0")
+
+_PREFECTURE = re.compile(r"^(北海道|東京都|(?:京都|大阪)府|.{2,3}?県)")
+
+
+def normalize_industry(industry: str) -> str:
+    """全角半角・空白・括弧書きの揺れを吸収する（「自動車整備業（車検）」→「自動車整備業」）。"""
+    s = unicodedata.normalize("NFKC", industry or "").lower()
+    s = re.sub(r"[(\[].*?[)\]]", "", s)
+    return re.sub(r"[\s・,、/]+", "", s)
+
+
+def normalize_region(region: str) -> str:
+    """都道府県の単位にまとめる（「東京都新宿区」→「東京都」）。"""
+    s = re.sub(r"\s+", "", unicodedata.normalize("NFKC", region or ""))
+    m = _PREFECTURE.match(s)
+    return m.group(1) if m else s
+
+
+def parse_ttl(spec: str | None) -> Dict[str, float]:
+    ttl = dict(ASPECT_TTL_SEC)
+    for item in (spec or "").split(","):
+        if "=" in item:
+            aspect, sec = item.rsplit("=", 1)
+            ttl[aspect.strip()] = float(sec)
+    return ttl
+
+
+def external_model() -> str:
+    return os.getenv("AI_DOCK_EXTERNAL_MODEL", "gpt-4.1")
+
+
+def generator_source() -> Tuple[str, bool]:
+    """(生成元 "ホスト/モデル", ローカルの接続先か)。接続先は modules.llm_providers で解決する。"""
+    from modules.llm_providers import resolve
+
+    provider, model = resolve("external", external_model())
+    host = (provider.base_url or "").split("://", 1)[-1].split("/", 1)[0]
+    local = host.rsplit(":", 1)[0] in _LOOPBACK_HOSTS if host else False
+    return provider.endpoint(model), local
+
+
+class ExternalCache:
+    def __init__(
+        self,
+        db_path: str | None = None,
+        ttl: Dict[str, float] | None = None,
+        source: str = "",
+    ) -> None:
+        self.db_path = db_path or os.path.join(
+            tempfile.gettempdir(), "ai_dock_external_cache.sqlite3"
+        )
+        self.ttl = dict(ASPECT_TTL_SEC if ttl is None else ttl)
+        self.source = source  # 生成元。別の接続先・モデルの結果は読まない
+        with closing(self._connect()) as conn, conn:
+            columns = {
+                r[1] for r in conn.execute("PRAGMA table_info(external_aspects)")
+            }
+            if columns and "source" not in columns:
+                # 生成元を持たない頃の行はどこで作られたか分からないので捨てる
+                conn.execute("DROP TABLE external_aspects")
+            conn.execute(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def cacheable(self, aspect: str) -> bool:
+        return aspect in self.ttl
+
+    @staticmethod
+    def key(industry: str, region: str) -> Tuple[str, str]:
+        return normalize_industry(industry), normalize_region(region)
+
+    def get(self, aspect: str, industry: str, region: str) -> str | None:
+        """期限内の結果があれば返す。"""
+        ind, reg = self.key(industry, region)
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT content FROM external_aspects WHERE source=?"
+                " AND aspect=? AND industry=? AND region=? AND expires_at > ?",
+                (self.source, aspect, ind, reg, time.time()),
+            ).fetchone()
+        if row is None:
+            metrics.counter("external_cache.miss").inc()
+            return None
+        metrics.counter("external_cache.hit").inc()
+        metrics.counter(f"external_cache.hit.{aspect}").inc()
+        return row[0]
+
+    def expires_at(self, aspect: str, industry: str, region: str) -> float | None:
+        ind, reg = self.key(industry, region)
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT expires_at FROM external_aspects"
+                " WHERE source=? AND aspect=? AND industry=? AND region=?",
+                (self.source, aspect, ind, reg),
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def put(self, aspect: str, industry: str, region: str, content: str) -> None:
+        if not self.cacheable(aspect):
+            return
+        ind, reg = self.key(industry, region)
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO external_aspects"
+                " (source, aspect, industry, region, content, created_at, expires_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self.source, aspect, ind, reg, content, now, now + self.ttl[aspect]),
+            )
+
+    def entries(self) -> List[Dict]:
+        with closing(self._connect()) as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(
+                "SELECT aspect, industry, region, created_at, expires_at"
+                " FROM external_aspects WHERE source=? ORDER BY expires_at",
+                (self.source,),
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def purge_expired(self) -> int:
+        with closing(self._connect()) as conn, conn:
+            cur = conn.execute(
+                "DELETE FROM external_aspects WHERE expires_at <= ?", (time.time(),)
+            )
+            return cur.rowcount
+
+
+_CACHE: ExternalCache | None = None
+_CACHE_LOCK = threading.Lock()
+
+
+def generic_on_miss() -> bool:
+    """キャッシュにない観点を業種×地域のプロンプトで生成して保存するなら True。"""
+    return os.getenv("AI_DOCK_EXTERNAL_CACHE_GENERIC", "1") != "0"
+
+
+def get_external_cache() -> ExternalCache | None:
+    """
+    無効なら None（AI_DOCK_EXTERNAL_CACHE=0、または未指定でカセット使用中・
+    接続先がローカル＝スタンドインのとき）。
+    """
+    global _CACHE
+    mode = os.getenv("AI_DOCK_EXTERNAL_CACHE", "")
+    if mode == "0":
+        return None
+    source, local = generator_source()
+    if mode != "1" and (local or os.getenv("AI_DOCK_LLM_CASSETTE")):
+        return None
+    with _CACHE_LOCK:
+        if _CACHE is None or _CACHE.source != source:
+            _CACHE = ExternalCache(
+                os.getenv("AI_DOCK_EXTERNAL_CACHE_DB") or None,
+                parse_ttl(os.getenv("AI_DOCK_EXTERNAL_CACHE_TTL")),
+                source,
+            )
+        return _CACHE
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+# ======================================================================
+# modules/external_warmup.py ― 外部環境分析キャッシュの事前生成（ウォームアップ）
+# ======================================================================
+"""
+過去の診断（modules.report_archive）で多い業種×地域の組み合わせについて、
+業種×地域で共有する外部環境分析の観点（modules.external_cache）を事前に生成し、
+期限切れが近いものは切れる前に作り直す。各業種で最初の利用者も
+Step2 をキャッシュから即表示できるようにするため。
+
+- 生成は画面と同じプロンプト（ai_engine.external_aspect_prompt, generic=True）
+- LLM 呼び出しは batch 優先度で送るので、画面操作からの呼び出しを邪魔しない
+- 1分あたりの呼び出し数（--rate）と1回の実行での上限（--max-calls）で抑える
+
+cron などで定期実行する:
+    python -m modules.external_warmup --top 30 --rate 20
+    python -m modules.external_warmup --loop 3600      # 常駐して1時間ごとに実行
+"""
+
+from __future__ import annotations
+
+import sys
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Sequence, Tuple
+
+from modules.external_cache import ExternalCache, get_external_cache
+from modules.metrics import metrics
+from modules.scheduler import PRIORITY_BATCH
+
+_DAY = 24 * 60 * 60
+_IDENTITY = {
+    "session": "external-warmup",
+    "tenant": "warmup",
+    "priority": PRIORITY_BATCH,
+}
+
+
+@dataclass
+class WarmupTask:
+    industry: str
+    region: str
+    aspect: str
+    expires_at: float | None  # 未生成なら None
+
+
+def popular_pairs(top: int, *, path: str | None = None) -> List[Tuple[str, str, int]]:
+    """アーカイブから、正規化した業種×地域ごとの件数が多い順に top 件。"""
+    from modules import report_archive
+
+    merged: Dict[Tuple[str, str], List] = {}
+    for industry, region, n in report_archive.industry_region_counts(path=path):
+        if not industry.strip() or not region.strip():
+            continue
+        key = ExternalCache.key(industry, region)
+        if key in merged:
+            merged[key][2] += n
+        else:
+            merged[key] = [industry, region, n]  # 最初に出た表記をプロンプトに使う
+    ranked = sorted(merged.values(), key=lambda v: -v[2])
+    return [tuple(v) for v in ranked[:top]]
+
+
+def plan(
+    cache: ExternalCache,
+    pairs: Sequence[Tuple[str, str]],
+    *,
+    refresh_before: float,
+    now: float | None = None,
+) -> List[WarmupTask]:
+    """未生成・期限切れ・refresh_before 秒以内に切れるものを、切れるのが早い順に。"""
+    now = time.time() if now is None else now
+    tasks = []
+    for industry, region in pairs:
+        for aspect in cache.ttl:
+            expires = cache.expires_at(aspect, industry, region)
+            if expires is None or expires - now <= refresh_before:
+                tasks.append(WarmupTask(industry, region, aspect, expires))
+    return sorted(tasks, key=lambda t: t.expires_at or 0.0)
+
+
+def run_once(
+    *,
+    top: int = 30,
+    rate_per_min: float = 20,
+    max_calls: int = 200,
+    refresh_before: float = _DAY,
+    pairs: Sequence[Tuple[str, str]] | None = None,
+    archive_path: str | None = None,
+) -> Dict[str, int]:
+    """1回分のウォームアップ。rate_per_min を超えないよう間隔を空けて生成する。"""
+    from ai_engine import run_detached
+
+    cache = get_external_cache()
+    if cache is None:
+        raise RuntimeError(
+            "外部環境分析キャッシュが無効です（AI_DOCK_EXTERNAL_CACHE=0、または"
+            "スタンドイン・カセット使用中。使う場合は AI_DOCK_EXTERNAL_CACHE=1）"
+        )
+    if pairs is None:
+        pairs = [(i, r) for i, r, _ in popular_pairs(top, path=archive_path)]
+    tasks = plan(cache, pairs, refresh_before=refresh_before)
+    interval = 60.0 / rate_per_min if rate_per_min > 0 else 0.0
+    stats = {"pairs": len(pairs), "planned": len(tasks), "refreshed": 0, "failed": 0}
+    next_at = time.monotonic()
+    for task in tasks[:max_calls]:
+        time.sleep(max(0.0, next_at - time.monotonic()))
+        next_at = time.monotonic() + interval
+        user_input = {"業種（できるだけ詳しく）": task.industry, "地域": task.region}
+        try:
+            ok = run_detached(
+                "refresh_external_aspect",
+                user_input,
+                {},
+                _IDENTITY,
+                aspect_ja=task.aspect,
+            )["result"]
+        except Exception:
+            ok = False
+        name = "refreshed" if ok else "failed"
+        stats[name] += 1
+        metrics.counter(f"external_cache.warmup.{name}").inc()
+    stats["skipped"] = max(0, len(tasks) - max_calls)
+    return stats
+
+
+# ----------------------------------------------------------------------
+# CLI
+# ----------------------------------------------------------------------
+def _main(argv: Sequence[str] | None = None) -> int:
+    import argparse
+
+    p = argparse.ArgumentParser(description="外部環境分析キャッシュの事前生成")
+    p.add_argument("--top", type=int, default=30, help="対象にする業種×地域の数")
+    p.add_argument("--rate", type=float, default=20, help="1分あたりの最大呼び出し数")
+    p.add_argument(
+        "--max-calls", type=int, default=200, help="1回の実行での最大呼び出し数"
+    )
+    p.add_argument(
+        "--refresh-before",
+        type=float,
+        default=_DAY,
+        help="期限切れまでこの秒数を切ったものを作り直す",
+    )
+    p.add_argument(
+        "--pair",
+        action="append",
+        metavar="業種:地域",
+        help="アーカイブの代わりに対象を直接指定（複数可）",
+    )
+    p.add_argument("--db", help="アーカイブDBパス（省略時は $AI_DOCK_ARCHIVE_DB）")
+    p.add_argument(
+        "--loop", type=float, default=0, help="指定秒ごとに繰り返す（0 で1回）"
+    )
+    a = p.parse_args(argv)
+
+    pairs = None
+    if a.pair:
+        if not all(":" in s for s in a.pair):
+            p.error("--pair は 業種:地域 の形式で指定してください")
+        pairs = [tuple(s.split(":", 1)) for s in a.pair]
+    else:
+        from modules import report_archive
+
+        if not (a.db or report_archive.is_enabled()):
+            p.error(
+                "対象の業種×地域を決めるアーカイブDBがありません。"
+                "AI_DOCK_ARCHIVE_DB（または --db）を設定するか、--pair 業種:地域 で"
+                "対象を指定してください"
+            )
+    while True:
+        try:
+            stats = run_once(
+                top=a.top,
+                rate_per_min=a.rate,
+                max_calls=a.max_calls,
+                refresh_before=a.refresh_before,
+                pairs=pairs,
+                archive_path=a.db,
+            )
+        except RuntimeError as e:  # キャッシュ・アーカイブが無効
+            print(f"エラー: {e}", file=sys.stderr)
+            return 1
+        print(
+            f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 業種×地域 {stats['pairs']}件 / "
+            f"生成 {stats['refreshed']} 失敗 {stats['failed']} 見送り {stats['skipped']}"
+        )
+        if a.loop <= 0:
+            return 0
+        time.sleep(a.loop)
+
+
+if __name__ == "__main__":
+    raise SystemExit(_main())
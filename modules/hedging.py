@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# ======================================================================
+# modules/hedging.py ― 遅い LLM 呼び出しのヘッジ（重複リクエスト）
+# ======================================================================
+"""
+呼び出しがステップ別の所要時間のパーセンタイル（既定 p95）を超えても終わらなければ、
+同じリクエストをもう1本送り、先に終わった方を採用して残りをキャンセルする。
+
+- しきい値は metrics の llm.latency_sec.<step> から都度計算する（実績が
+  min_samples 件たまるまではヘッジしない）
+- 追加で送る本数は全呼び出しの budget 割合まで（既定 5%）
+
+設定（環境変数）:
+    AI_DOCK_HEDGE              1 で有効（既定 無効）
+    AI_DOCK_HEDGE_STEPS        対象ステップ（既定 "external,swot"）
+    AI_DOCK_HEDGE_PERCENTILE   しきい値のパーセンタイル（既定 95）
+    AI_DOCK_HEDGE_MIN_SAMPLES  しきい値を使い始める件数（既定 20）
+    AI_DOCK_HEDGE_BUDGET       ヘッジ本数の上限（全呼び出しに対する割合, 既定 0.05）
+
+メトリクス:
+    llm.hedge.fired / llm.hedge.won / llm.hedge.primary_won / llm.hedge.skipped_budget
+"""
+
+from __future__ import annotations
+
+import math
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Iterable
+
+from modules.cancellation import CancelToken
+from modules.metrics import metrics
+
+
+def latency_histogram(step: str):
+    return metrics.histogram(f"llm.latency_sec.{step}")
+
+
+class Hedger:
+    def __init__(
+        self,
+        *,
+        steps: Iterable[str] = ("external", "swot"),
+        percentile: float = 95,
+        min_samples: int = 20,
+        budget: float = 0.05,
+        max_workers: int = 32,
+    ) -> None:
+        self.steps = set(steps)
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.budget = budget
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="ai-dock-hedge"
+        )
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._hedges = 0
+
+    def threshold(self, step: str) -> float | None:
+        hist = latency_histogram(step)
+        if step not in self.steps or len(hist.values()) < self.min_samples:
+            return None
+        value = hist.percentile(self.percentile)
+        return None if math.isnan(value) else value
+
+    def _take_budget(self) -> bool:
+        with self._lock:
+            if self._hedges + 1 > self.budget * self._calls:
+                return False
+            self._hedges += 1
+            return True
+
+    def run(
+        self,
+        step: str,
+        attempt: Callable[[CancelToken], Any],
+        token: CancelToken | None = None,
+    ) -> Any:
+        """attempt(token) を実行し、しきい値を超えたらもう1本送って早い方を返す。"""
+        token = token or CancelToken()
+        with self._lock:
+            self._calls += 1
+        delay = self.threshold(step)
+        if delay is None:
+            return attempt(token)
+
+        primary_token = token.child()
+        primary = self._pool.submit(attempt, primary_token)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+        if not self._take_budget():
+            metrics.counter("llm.hedge.skipped_budget").inc()
+            return primary.result()
+
+        metrics.counter("llm.hedge.fired").inc()
+        hedge_token = token.child()
+        hedge = self._pool.submit(attempt, hedge_token)
+        tokens = {primary: primary_token, hedge: hedge_token}
+        pending = {primary, hedge}
+        error: BaseException | None = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                if fut.exception() is not None:
+                    error = fut.exception()
+                    continue
+                # 先に成功した方を採用し、残りはキャンセル（上流の生成も止める）
+                for other in pending:
+                    tokens[other].cancel("ヘッジの相手が先に完了しました")
+                name = "llm.hedge.won" if fut is hedge else "llm.hedge.primary_won"
+                metrics.counter(name).inc()
+                return fut.result()
+        raise error  # type: ignore[misc]
+
+
+_HEDGER: Hedger | None = None
+_HEDGER_LOCK = threading.Lock()
+
+
+def get_hedger() -> Hedger | None:
+    """AI_DOCK_HEDGE=1 のときだけヘッジャーを返す。"""
+    global _HEDGER
+    if os.getenv("AI_DOCK_HEDGE", "0") != "1":
+        return None
+    with _HEDGER_LOCK:
+        if _HEDGER is None:
+            steps = os.getenv("AI_DOCK_HEDGE_STEPS", "external,swot")
+            _HEDGER = Hedger(
+                steps=[s.strip() for s in steps.split(",") if s.strip()],
+                percentile=float(os.getenv("AI_DOCK_HEDGE_PERCENTILE", "95")),
+                min_samples=int(os.getenv("AI_DOCK_HEDGE_MIN_SAMPLES", "20")),
+                budget=float(os.getenv("AI_DOCK_HEDGE_BUDGET", "0.05")),
+            )
+        return _HEDGER
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# ======================================================================
+# modules/importtime.py ― ページごとの import 時間バジェット計測
+# ======================================================================
+"""
+``python -X importtime`` を別プロセスで実行し、各ページが最初の描画までに
+import するモジュールの所要時間を集計・判定する。計測する import はページの
+ソースから ast で求める（ページを直せば計測対象も追従する）。
+
+streamlit 本体はどのページでも必ず読み込まれるため先に import しておき、
+その後に増える分だけをページのコストとして数える。
+
+    python -m modules.importtime            # 全ページのレポート
+    python -m modules.importtime --strict   # バジェット超過で終了コード 1
+"""
+
+from __future__ import annotations
+
+import ast
+import glob
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, List, Sequence, Tuple
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 計測するページ（アプリのルートからの相対パス）
+PAGES: List[str] = ["ホーム.py"] + sorted(
+    os.path.relpath(path, _ROOT)
+    for path in glob.glob(os.path.join(_ROOT, "pages", "*.py"))
+)
+
+# ページごとの上限（ミリ秒, streamlit 本体を除く）
+PAGE_BUDGET_MS: Dict[str, float] = {page: 50.0 for page in PAGES}
+
+# 最初の描画では読み込んではいけない重い依存（使う処理の中で遅延 import する）
+DEFERRED_PACKAGES = ("openai", "reportlab", "pyarrow", "pandas")
+
+_PRELOAD = "streamlit"
+_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+
+def _is_app_module(name: str) -> bool:
+    base = os.path.join(_ROOT, *name.split("."))
+    return os.path.isfile(base + ".py") or os.path.isfile(
+        os.path.join(base, "__init__.py")
+    )
+
+
+def page_imports(page: str) -> List[str]:
+    """
+    ページのソースを解析し、モジュールの先頭レベルで import するアプリ側モジュールを返す
+    （最初の描画までに読み込まれるもの）。関数・クラスの中の import は遅延 import なので
+    数えない。
+    """
+    with open(os.path.join(_ROOT, page), encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=page)
+    names: List[str] = []
+    pending: List[ast.AST] = list(tree.body)
+    while pending:
+        node = pending.pop(0)
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            continue
+        if isinstance(node, ast.Import):
+            names += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.append(node.module)
+            # from modules import pipeline → modules.pipeline
+            names += [f"{node.module}.{alias.name}" for alias in node.names]
+        else:
+            # if / try / with の中（モジュールの先頭レベルで実行される）も見る
+            pending += [
+                c for c in ast.iter_child_nodes(node) if isinstance(c, ast.stmt)
+            ]
+    return list(dict.fromkeys(n for n in names if _is_app_module(n)))
+
+
+def _run_importtime(modules: Sequence[str]) -> List[Tuple[int, int, int, str]]:
+    """(self_us, cumulative_us, depth, name) のリストを返す（preload 分は除外）。"""
+    code = f"import {_PRELOAD}; import sys; print('--', file=sys.stderr); " + "; ".join(
+        f"import {m}" for m in modules
+    )
+    env = dict(
+        os.environ, PYTHONPATH=_ROOT + os.pathsep + os.environ.get("PYTHONPATH", "")
+    )
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    stderr = proc.stderr.split("--\n", 1)[-1]
+    rows = []
+    for line in stderr.splitlines():
+        m = _LINE.match(line)
+        if m:
+            depth = (len(m.group(3)) - 1) // 2
+            rows.append((int(m.group(1)), int(m.group(2)), depth, m.group(4)))
+    return rows
+
+
+def measure_page(page: str) -> Dict[str, object]:
+    rows = _run_importtime(page_imports(page))
+    top = [r for r in rows if r[2] == 0]
+    total_ms = sum(r[1] for r in top) / 1000
+    loaded = {r[3] for r in rows}
+    heavy = sorted(
+        {p for p in DEFERRED_PACKAGES for name in loaded if name.split(".")[0] == p}
+    )
+    slowest = sorted(rows, key=lambda r: r[0], reverse=True)[:5]
+    return {
+        "page": page,
+        "total_ms": round(total_ms, 1),
+        "budget_ms": PAGE_BUDGET_MS[page],
+        "deferred_loaded": heavy,
+        "slowest": [
+            (name, round(self_us / 1000, 1)) for self_us, _, _, name in slowest
+        ],
+        "ok": total_ms <= PAGE_BUDGET_MS[page] and not heavy,
+    }
+
+
+def report(pages: Sequence[str] | None = None) -> List[Dict[str, object]]:
+    return [measure_page(p) for p in (pages or PAGES)]
+
+
+def _main(argv: Sequence[str] | None = None) -> int:
+    import argparse
+
+    p = argparse.ArgumentParser(description="ページ別 import 時間レポート")
+    p.add_argument("--strict", action="store_true", help="超過時に終了コード1")
+    p.add_argument("pages", nargs="*")
+    a = p.parse_args(argv)
+
+    results = report(a.pages or None)
+    for r in results:
+        mark = "OK " if r["ok"] else "NG "
+        print(f"{mark}{r['page']}: {r['total_ms']}ms / {r['budget_ms']}ms")
+        if r["deferred_loaded"]:
+            print(f"    遅延すべき依存を読み込み: {', '.join(r['deferred_loaded'])}")
+        for name, ms in r["slowest"]:
+            print(f"    {ms:>7.1f}ms  {name}")
+    return 0 if (not a.strict or all(r["ok"] for r in results)) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(_main())
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+# ======================================================================
+# modules/jobs.py ― バックグラウンドジョブ（ワーカープール＋状態の永続化）
+# ======================================================================
+"""
+「▶ AI実行」の LLM 呼び出しをスクリプト実行から切り離し、プロセス内の
+ワーカースレッドで実行する。ジョブの状態と結果は SQLite に保存するため、
+再実行（rerun）やページ移動をまたいでジョブIDで参照できる。
+
+    job_id = get_queue().submit("swot", func, arg1, owner=session_id)
+    get_queue().get(job_id)   # {"status": "running", ...}
+
+状態: queued → running → done / error / cancelled
+      （実行していたプロセスが終了して中断されたものは lost）
+
+ジョブごとに期限付きの CancelToken（modules.cancellation）を作り、実行中は
+ワーカースレッドに結び付ける。cancel() / cancel_owner() でキャンセルすると、
+実行中の LLM 呼び出しは接続ごと打ち切られる。
+
+実行中の関数は progress_reporter() で途中経過を保存でき、get() の "progress" で
+読める（結果が出る前に届いた分から表示するため）。
+
+設定（環境変数）:
+    AI_DOCK_JOB_WORKERS       ワーカースレッド数（既定 32）
+                              LLM への同時実行数と公平性は modules.scheduler が制御するため、
+                              ここはジョブが待ち行列で詰まらない程度に多めにしておく
+    AI_DOCK_JOB_DEADLINE_SEC  1ジョブの制限時間（既定 600秒, 登録から数える）
+    AI_DOCK_JOBS_DB           状態を保存する SQLite のパス（既定 <tmp>/ai_dock_jobs.sqlite3）
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from typing import Any, Callable, Dict, List
+
+from modules.cancellation import Cancelled, CancelToken, use_token
+
+ACTIVE_STATUSES = ("queued", "running")
+_KEEP_SEC = 24 * 60 * 60  # 終了したジョブの保持期間
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    owner TEXT,
+    pid INTEGER,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    result TEXT,
+    error TEXT,
+    progress TEXT
+)
+"""
+
+
+def _pid_alive(pid: int | None) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobQueue:
+    def __init__(
+        self,
+        *,
+        workers: int = 32,
+        db_path: str | None = None,
+        deadline_sec: float | None = 600,
+    ) -> None:
+        self.deadline_sec = deadline_sec
+        self._tokens: Dict[str, CancelToken] = {}
+        self._tokens_lock = threading.Lock()
+        self.db_path = db_path or os.path.join(
+            tempfile.gettempdir(), "ai_dock_jobs.sqlite3"
+        )
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="ai-dock-job"
+        )
+        with closing(self._connect()) as conn, conn:
+            conn.execute(_SCHEMA)
+            columns = {r["name"] for r in conn.execute("PRAGMA table_info(jobs)")}
+            if "progress" not in columns:
+                # progress 列がなかった頃の DB
+                conn.execute("ALTER TABLE jobs ADD COLUMN progress TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_jobs_owner ON jobs(owner)")
+            # 既に終了したプロセスで実行中だったジョブは中断扱い
+            rows = conn.execute(
+                "SELECT id, pid FROM jobs WHERE status IN (?, ?)", ACTIVE_STATUSES
+            ).fetchall()
+            for row in rows:
+                if not _pid_alive(row["pid"]):
+                    conn.execute(
+                        "UPDATE jobs SET status='lost', error=? WHERE id=?",
+                        ("サーバーの再起動により中断されました", row["id"]),
+                    )
+            conn.execute(
+                "DELETE FROM jobs WHERE created_at < ?", (time.time() - _KEEP_SEC,)
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _update(self, job_id: str, **fields: Any) -> None:
+        cols = ", ".join(f"{k}=?" for k in fields)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                f"UPDATE jobs SET {cols} WHERE id=?", (*fields.values(), job_id)
+            )
+
+    # ---------------- 公開API ----------------
+    def submit(
+        self,
+        kind: str,
+        func: Callable[..., Any],
+        *args: Any,
+        owner: str | None = None,
+        **kwargs: Any,
+    ) -> str:
+        """ジョブを登録してIDを返す。func の戻り値は JSON で保存できる値にすること。"""
+        job_id = uuid.uuid4().hex
+        with self._tokens_lock:
+            self._tokens[job_id] = CancelToken(self.deadline_sec)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, owner, pid, status, created_at) "
+                "VALUES (?, ?, ?, ?, 'queued', ?)",
+                (job_id, kind, owner, os.getpid(), time.time()),
+            )
+        self._pool.submit(self._run, job_id, func, args, kwargs)
+        return job_id
+
+    def get(self, job_id: str) -> Dict[str, Any] | None:
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        job["progress"] = json.loads(job["progress"]) if job["progress"] else None
+        return job
+
+    def set_progress(self, job_id: str, progress: Any) -> None:
+        """途中経過を保存する（None で消す）。"""
+        self._update(
+            job_id,
+            progress=(
+                None
+                if progress is None
+                else json.dumps(progress, ensure_ascii=False, default=str)
+            ),
+        )
+
+    def cancel(self, job_id: str, reason: str = "キャンセルされました") -> bool:
+        """このプロセスで待機中／実行中のジョブをキャンセルする。"""
+        with self._tokens_lock:
+            token = self._tokens.get(job_id)
+        if token is None:
+            return False
+        token.cancel(reason)
+        return True
+
+    def cancel_owner(
+        self,
+        owner: str | None,
+        kinds: tuple | None = None,
+        reason: str = "キャンセルされました",
+    ) -> int:
+        """owner（セッション）の待機中／実行中のジョブをまとめてキャンセルする。"""
+        if owner is None:
+            return 0
+        sql = "SELECT id, kind FROM jobs WHERE owner=? AND status IN (?, ?)"
+        with closing(self._connect()) as conn:
+            rows = conn.execute(sql, (owner, *ACTIVE_STATUSES)).fetchall()
+        return sum(
+            self.cancel(r["id"], reason)
+            for r in rows
+            if kinds is None or r["kind"] in kinds
+        )
+
+    def list_jobs(self, owner: str | None = None, limit: int = 50) -> List[Dict]:
+        sql = (
+            "SELECT id, kind, owner, status, created_at, started_at, finished_at"
+            " FROM jobs"
+        )
+        params: tuple = ()
+        if owner is not None:
+            sql += " WHERE owner=?"
+            params = (owner,)
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                sql + " ORDER BY created_at DESC LIMIT ?", (*params, limit)
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    # ---------------- ワーカー ----------------
+    def _run(self, job_id: str, func: Callable[..., Any], args, kwargs) -> None:
+        with self._tokens_lock:
+            token = self._tokens[job_id]
+        try:
+            if token.cancelled:
+                self._update(
+                    job_id,
+                    status="cancelled",
+                    finished_at=time.time(),
+                    error=token.reason,
+                )
+                return
+            self._update(job_id, status="running", started_at=time.time())
+            _current.job = (self, job_id)
+            with use_token(token):
+                result = func(*args, **kwargs)
+            if token.cancelled:
+                # 途中の呼び出しが打ち切られた結果は使わない
+                raise Cancelled(token.reason)
+            self._update(
+                job_id,
+                status="done",
+                finished_at=time.time(),
+                result=json.dumps(result, ensure_ascii=False, default=str),
+            )
+        except Cancelled as e:
+            self._update(
+                job_id, status="cancelled", finished_at=time.time(), error=str(e)
+            )
+        except Exception as e:
+            self._update(
+                job_id,
+                status="error",
+                finished_at=time.time(),
+                error=f"{e}\n{traceback.format_exc()}",
+            )
+        finally:
+            _current.job = None
+            with self._tokens_lock:
+                self._tokens.pop(job_id, None)
+            token.cancel("ジョブが終了しました")  # 期限タイマーを止める
+
+
+_current = threading.local()
+
+
+def progress_reporter() -> Callable[[Any], None] | None:
+    """
+    実行中のジョブの途中経過を保存する関数（ジョブの外なら None）。
+    ジョブに結び付いているので、他のスレッドから呼んでもよい。
+    """
+    current = getattr(_current, "job", None)
+    if current is None:
+        return None
+    queue, job_id = current
+    return lambda progress: queue.set_progress(job_id, progress)
+
+
+_QUEUE: JobQueue | None = None
+_QUEUE_LOCK = threading.Lock()
+
+
+def get_queue() -> JobQueue:
+    global _QUEUE
+    with _QUEUE_LOCK:
+        if _QUEUE is None:
+            _QUEUE = JobQueue(
+                workers=int(os.getenv("AI_DOCK_JOB_WORKERS", "32")),
+                db_path=os.getenv("AI_DOCK_JOBS_DB") or None,
+                deadline_sec=float(os.getenv("AI_DOCK_JOB_DEADLINE_SEC", "600")),
+            )
+        return _QUEUE
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+# ======================================================================
+# modules/llm_cassette.py ― LLM 呼び出しの録画・再生（カセット）
+# ======================================================================
+"""
+ai_engine._chat_completion を通るリクエスト／レスポンスを、元のレイテンシと
+トークン使用量つきでカセットファイル（JSON Lines）に記録し、再生モードでは
+ネットワークを使わず決定的に返す。
+
+設定（環境変数）:
+    AI_DOCK_LLM_CASSETTE        カセットファイルのパス（未設定なら無効）
+    AI_DOCK_LLM_CASSETTE_MODE   record / replay（既定 replay）
+    AI_DOCK_LLM_REPLAY_SPEED    0 = 待ちなしで即返す（既定）
+                                1 = 記録時と同じ速さ、2 = 半分の待ち時間 ...
+
+ファイル形式:
+    1行目   {"format": "ai-dock-cassette", "version": 1, "created_at": ...}
+    2行目〜 {"step", "key", "request", "response", "latency_sec", "usage", ...}
+
+    python -m modules.llm_cassette summary cassettes/baseline.jsonl
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Sequence
+
+CASSETTE_FORMAT = "ai-dock-cassette"
+CASSETTE_VERSION = 1
+
+
+class CassetteError(RuntimeError):
+    pass
+
+
+class CassetteMiss(CassetteError):
+    """再生モードで該当するリクエストが記録されていない。"""
+
+
+def request_key(params: Dict[str, Any]) -> str:
+    """リクエストパラメータを正規化したハッシュ（キー順・空白に依存しない）。"""
+    blob = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()[:32]
+
+
+def _usage_of(data: Dict[str, Any]) -> Dict[str, Any]:
+    return data.get("usage") or {}
+
+
+class Cassette:
+    def __init__(self, path: str, mode: str = "replay", speed: float = 0.0) -> None:
+        if mode not in ("record", "replay"):
+            raise CassetteError(f"不明なカセットモード: {mode}")
+        self.path = path
+        self.mode = mode
+        self.speed = speed
+        self._lock = threading.Lock()
+        self._by_key: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._served: Dict[str, int] = defaultdict(int)
+        if mode == "replay":
+            for rec in load(path):
+                self._by_key[rec["key"]].append(rec)
+        elif not os.path.exists(path) or os.path.getsize(path) == 0:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            header = {
+                "format": CASSETTE_FORMAT,
+                "version": CASSETTE_VERSION,
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            }
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(json.dumps(header, ensure_ascii=False) + "\n")
+        else:
+            load(path)  # 既存ファイルへの追記はバージョン確認だけ行う
+
+    def call(self, step: str, params: Dict[str, Any], send: Callable[[], Any]):
+        if self.mode == "replay":
+            return self._replay(step, params)
+        if params.get("stream"):
+            # ストリーミング応答はそのまま流す（記録対象外）
+            return send()
+        return self._record(step, params, send)
+
+    def _record(self, step: str, params: Dict[str, Any], send: Callable[[], Any]):
+        t0 = time.perf_counter()
+        rsp = send()
+        latency = time.perf_counter() - t0
+        data = rsp.model_dump(mode="json", exclude_none=True)
+        rec = {
+            "step": step,
+            "key": request_key(params),
+            "request": params,
+            "response": data,
+            "latency_sec": round(latency, 4),
+            "usage": _usage_of(data),
+            "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        line = json.dumps(rec, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+        return rsp
+
+    def _replay(self, step: str, params: Dict[str, Any]):
+        from openai.types.chat import ChatCompletion
+
+        key = request_key(params)
+        with self._lock:
+            recs = self._by_key.get(key)
+            if not recs:
+                raise CassetteMiss(
+                    f"カセットに記録のないリクエストです（step={step}, key={key}）"
+                )
+            # 同じリクエストが複数回記録されていれば順に返し、尽きたら最後を繰り返す
+            i = self._served[key]
+            self._served[key] = i + 1
+            rec = recs[min(i, len(recs) - 1)]
+        if self.speed > 0:
+            time.sleep(rec.get("latency_sec", 0.0) / self.speed)
+        return ChatCompletion.model_validate(rec["response"])
+
+
+def load(path: str) -> List[Dict[str, Any]]:
+    """カセットを読み込み、記録（ヘッダー行を除く）のリストを返す。"""
+    with open(path, encoding="utf-8") as f:
+        lines = [line for line in f if line.strip()]
+    if not lines:
+        raise CassetteError(f"カセットが空です: {path}")
+    header = json.loads(lines[0])
+    if header.get("format") != CASSETTE_FORMAT:
+        raise CassetteError(f"カセット形式ではありません: {path}")
+    if header.get("version") != CASSETTE_VERSION:
+        raise CassetteError(
+            f"カセットのバージョンが違います: {header.get('version')}"
+            f"（対応: {CASSETTE_VERSION}）"
+        )
+    return [json.loads(line) for line in lines[1:]]
+
+
+_ACTIVE: Cassette | None = None
+_ACTIVE_CONF: tuple | None = None
+_ACTIVE_LOCK = threading.Lock()
+
+
+def active() -> Cassette | None:
+    """環境変数の設定に応じたカセット（無効なら None）。"""
+    global _ACTIVE, _ACTIVE_CONF
+    path = os.getenv("AI_DOCK_LLM_CASSETTE")
+    if not path:
+        return None
+    conf = (
+        path,
+        os.getenv("AI_DOCK_LLM_CASSETTE_MODE", "replay"),
+        float(os.getenv("AI_DOCK_LLM_REPLAY_SPEED", "0") or 0),
+    )
+    with _ACTIVE_LOCK:
+        if _ACTIVE_CONF != conf:
+            _ACTIVE = Cassette(*conf)
+            _ACTIVE_CONF = conf
+        return _ACTIVE
+
+
+# ----------------------------------------------------------------------
+# 集計
+# ----------------------------------------------------------------------
+def summarize_cassette(path: str) -> Dict[str, Dict[str, Any]]:
+    from modules.metrics import summarize
+
+    by_step: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for rec in load(path):
+        by_step[rec["step"]].append(rec)
+    out = {}
+    for step, recs in by_step.items():
+        s = summarize([r.get("latency_sec", 0.0) for r in recs])
+        s["prompt_tokens"] = sum(r["usage"].get("prompt_tokens", 0) for r in recs)
+        s["completion_tokens"] = sum(
+            r["usage"].get("completion_tokens", 0) for r in recs
+        )
+        s["cached_tokens"] = sum(
+            (r["usage"].get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+            for r in recs
+        )
+        out[step] = s
+    return out
+
+
+def _main(argv: Sequence[str] | None = None) -> int:
+    import argparse
+
+    p = argparse.ArgumentParser(description="LLM カセットの集計")
+    p.add_argument("command", choices=["summary"])
+    p.add_argument("path")
+    a = p.parse_args(argv)
+
+    print(
+        f"{'step':<12}{'件数':>6}{'p50':>8}{'p95':>8}"
+        f"{'入力tok':>10}{'うちキャッシュ':>12}{'出力tok':>10}"
+    )
+    for step, s in summarize_cassette(a.path).items():
+        print(
+            f"{step:<12}{s['count']:>6}{s['p50']:>8.2f}{s['p95']:>8.2f}"
+            f"{s['prompt_tokens']:>10}{s['cached_tokens']:>12}{s['completion_tokens']:>10}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(_main())
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+# ======================================================================
+# modules/llm_providers.py ― LLM の接続先（プロバイダー）と、その能力の違いの吸収
+# ======================================================================
+"""
+OpenAI 本家と、自前のサーバーで動かす OpenAI互換サーバー（vLLM / llama.cpp など）を
+同じ呼び出し口（ai_engine._chat_completion）から使い分けるための接続先の定義。
+
+プロバイダーごとに持つもの:
+- base_url / APIキー / タイムアウト
+- 同時実行数の上限（指定すると、そのプロバイダー専用の公平スケジューラで待つ。
+  未指定なら全体のスケジューラ modules.scheduler を使う）
+- 能力フラグ
+    function_calling   functions（OpenAI の旧形式）/ tools / none
+                       none は関数定義の代わりに JSON スキーマをプロンプトに付けて
+                       JSON で答えさせ、応答を function_call の形に直す
+    streaming          False ならストリーミングせずに送る（キャンセルは応答待ちを打ち切る）
+    token_limit_param  auto（o系モデルは max_completion_tokens、他は max_tokens）/
+                       max_tokens / max_completion_tokens
+    json_mode          none のとき response_format={"type": "json_object"} を付ける
+- model を指定すると、ステップのモデル名をそのプロバイダーのモデル名に置き換える
+
+どのステップをどのプロバイダーで送るかは AI_DOCK_STEP_PROVIDERS で決める。
+モデル選択の候補（modules.model_routing）に "local:qwen2.5-32b" のように
+"プロバイダー名:モデル名" で書けば、その候補だけ別のプロバイダーへ送る。
+
+設定（環境変数）:
+    OPENAI_BASE_URL / OPENAI_API_KEY   既定プロバイダー openai の接続先
+    AI_DOCK_PROVIDERS       追加のプロバイダー（JSON）
+        {"local": {"base_url": "http://gpu01:8000/v1", "max_concurrency": 4,
+                   "timeout_sec": 60, "function_calling": "tools",
+                   "token_limit_param": "max_tokens", "model": "qwen2.5-32b-instruct"}}
+        api_key は直接書くか api_key_env で環境変数名を指定する
+    AI_DOCK_STEP_PROVIDERS  ステップ → プロバイダー（"questions=local,digest=local"）
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Tuple
+
+from modules.scheduler import FairScheduler, get_scheduler
+
+DEFAULT_PROVIDER = "openai"
+_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$")
+_REASONING_MODEL = re.compile(r"o\d")
+
+
+def is_reasoning_model(model: str) -> bool:
+    """o1 / o3 / o3-mini / o4-mini 等の推論モデルなら True（openchat 等は対象外）。"""
+    return bool(_REASONING_MODEL.match(model or ""))
+
+
+@dataclass(frozen=True)
+class Provider:
+    name: str
+    base_url: str | None = None  # None なら OpenAI 本家
+    api_key: str | None = None
+    max_concurrency: int = 0  # 0 なら全体のスケジューラを使う
+    timeout_sec: float | None = None  # None なら AI_DOCK_LLM_DEADLINE_SEC
+    function_calling: str = "functions"  # functions / tools / none
+    streaming: bool = True
+    token_limit_param: str = "auto"  # auto / max_tokens / max_completion_tokens
+    json_mode: bool = False
+    model: str | None = None  # ステップのモデル名の置き換え
+
+    def endpoint(self, model: str) -> str:
+        """サーキットブレーカーの単位（接続先のホスト＋モデル）。"""
+        host = (self.base_url or "api.openai.com").split("://", 1)[-1]
+        return f"{host.split('/', 1)[0]}/{model}"
+
+    # ---------------- リクエスト ----------------
+    def prepare(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """呼び出し元のパラメータを、このプロバイダーが受け付ける形に直す。"""
+        out = dict(params)
+        model = out.get("model", "")
+        reasoning = is_reasoning_model(model)
+        limit = out.pop("max_completion_tokens", None)
+        limit = out.pop("max_tokens", None) or limit
+        if reasoning:
+            out.pop("temperature", None)  # o系モデルは temperature を受け付けない
+        if limit is not None:
+            param = self.token_limit_param
+            if param == "auto":
+                param = "max_completion_tokens" if reasoning else "max_tokens"
+            out[param] = limit
+        functions = out.pop("functions", None)
+        function_call = out.pop("function_call", None)
+        if functions:
+            if self.function_calling == "functions":
+                out["functions"] = functions
+                if function_call is not None:
+                    out["function_call"] = function_call
+            elif self.function_calling == "tools":
+                out["tools"] = [{"type": "function", "function": f} for f in functions]
+                if isinstance(function_call, dict):
+                    out["tool_choice"] = {"type": "function", "function": function_call}
+            else:
+                out["messages"] = _with_json_instruction(
+                    out.get("messages", []), _target_function(functions, function_call)
+                )
+                if self.json_mode:
+                    out["response_format"] = {"type": "json_object"}
+        return out
+
+    # ---------------- 応答 ----------------
+    def adapt(self, rsp: Any, params: Dict[str, Any]) -> Any:
+        """
+        応答を function_call の形にそろえる（tools → tool_calls、none → JSON本文）。
+        params は prepare 前の呼び出し元のパラメータ。
+        """
+        functions = params.get("functions")
+        if not functions or self.function_calling == "functions":
+            return rsp
+        from openai.types.chat import ChatCompletion
+
+        name = _target_function(functions, params.get("function_call"))["name"]
+        data = rsp.model_dump()
+        for choice in data.get("choices") or []:
+            msg = choice.get("message") or {}
+            if self.function_calling == "tools":
+                calls = msg.get("tool_calls") or []
+                if not calls:
+                    continue
+                fn = calls[0]["function"]
+                msg["function_call"] = {
+                    "name": fn["name"],
+                    "arguments": fn["arguments"],
+                }
+            else:
+                text = _FENCE.sub("", (msg.get("content") or "").strip())
+                msg["function_call"] = {"name": name, "arguments": text}
+        return ChatCompletion.model_validate(data)
+
+    # ---------------- 接続 ----------------
+    def client(self):
+        with _LOCK:
+            client = _CLIENTS.get(self.name)
+            if client is None:
+                from openai import OpenAI
+
+                api_key = self.api_key or ("standin" if self.base_url else None)
+                client = _CLIENTS[self.name] = OpenAI(
+                    api_key=api_key, base_url=self.base_url
+                )
+            return client
+
+    def scheduler(self) -> FairScheduler:
+        if self.max_concurrency <= 0:
+            return get_scheduler()
+        with _LOCK:
+            sched = _SCHEDULERS.get(self.name)
+            if sched is None:
+                base = get_scheduler()
+                sched = _SCHEDULERS[self.name] = FairScheduler(
+                    max_concurrency=self.max_concurrency,
+                    per_tenant=min(base.per_tenant, self.max_concurrency),
+                    per_session=min(base.per_session, self.max_concurrency),
+                    weights=base.weights,
+                )
+            return sched
+
+
+def _target_function(
+    functions: List[Dict[str, Any]], function_call: Any
+) -> Dict[str, Any]:
+    name = function_call.get("name") if isinstance(function_call, dict) else None
+    return next((f for f in functions if f.get("name") == name), functions[0])
+
+
+def _with_json_instruction(
+    messages: List[Dict[str, Any]], fn: Dict[str, Any]
+) -> List[Dict[str, Any]]:
+    """関数呼び出しの代わりに、JSON スキーマを末尾に付けて JSON だけで答えさせる。"""
+    schema = json.dumps(fn.get("parameters", {}), ensure_ascii=False)
+    instruction = (
+        "\n\n出力は次の JSON スキーマに従う JSON オブジェクトのみとし、"
+        "説明文やコードブロックは付けないこと。\n"
+        f"【出力JSONスキーマ: {fn.get('name', '')}】\n{schema}"
+    )
+    out = [dict(m) for m in messages]
+    last = next((m for m in reversed(out) if m.get("role") == "user"), None)
+    if last is None:
+        out.append({"role": "user", "content": instruction.lstrip()})
+    else:
+        last["content"] = (last.get("content") or "") + instruction
+    return out
+
+
+_LOCK = threading.Lock()
+_CLIENTS: Dict[str, Any] = {}
+_SCHEDULERS: Dict[str, FairScheduler] = {}
+_PROVIDERS: Dict[str, Provider] | None = None
+_STEP_PROVIDERS: Dict[str, str] = {}
+
+
+def parse_providers(spec: str | None) -> Dict[str, Provider]:
+    base_url = os.getenv("OPENAI_BASE_URL") or None
+    providers = {
+        DEFAULT_PROVIDER: Provider(
+            DEFAULT_PROVIDER, base_url, os.getenv("OPENAI_API_KEY") or None
+        )
+    }
+    for name, conf in json.loads(spec or "{}").items():
+        conf = dict(conf)
+        key_env = conf.pop("api_key_env", None)
+        if key_env:
+            conf["api_key"] = os.getenv(key_env)
+        providers[name] = Provider(name, **conf)
+    return providers
+
+
+def parse_step_providers(spec: str | None) -> Dict[str, str]:
+    out = {}
+    for item in (spec or "").split(","):
+        if "=" in item:
+            step, name = item.split("=", 1)
+            out[step.strip()] = name.strip()
+    return out
+
+
+def get_providers() -> Dict[str, Provider]:
+    global _PROVIDERS, _STEP_PROVIDERS
+    with _LOCK:
+        if _PROVIDERS is None:
+            _PROVIDERS = parse_providers(os.getenv("AI_DOCK_PROVIDERS"))
+            _STEP_PROVIDERS = parse_step_providers(os.getenv("AI_DOCK_STEP_PROVIDERS"))
+            unknown = set(_STEP_PROVIDERS.values()) - set(_PROVIDERS)
+            if unknown:
+                raise ValueError(
+                    f"AI_DOCK_STEP_PROVIDERS に未定義のプロバイダー: {sorted(unknown)}"
+                )
+        return _PROVIDERS
+
+
+def resolve(step: str, model: str) -> Tuple[Provider, str]:
+    """
+    (プロバイダー, 送るモデル名)。"プロバイダー名:モデル名" ならそのプロバイダーへ
+    そのモデル名で、それ以外はステップのプロバイダーへ（model 指定があれば置き換えて）送る。
+    """
+    providers = get_providers()
+    name, sep, rest = model.partition(":")
+    if sep and name in providers:
+        return providers[name], rest
+    provider = providers[_STEP_PROVIDERS.get(step, DEFAULT_PROVIDER)]
+    return provider, provider.model or model
+
+
+def is_api_error(exc: BaseException) -> bool:
+    """接続先から返ったエラー（openai SDK の APIError）か。"""
+    from openai import APIError
+
+    return isinstance(exc, APIError)
@@ -0,0 +1,646 @@
+# -*- coding: utf-8 -*-
+# ======================================================================
+# modules/llm_standin.py ― OpenAI互換のローカル・スタンドインサーバー
+# ======================================================================
+"""
+有料APIを使わずに ai_engine のベンチマーク・負荷試験を行うための
+``/v1/chat/completions`` 互換サーバー（標準ライブラリのみで動作）。
+
+- 通常の応答／function call（make_questions・make_actions・make_diagnosis ほか任意のスキーマ）
+- tools / tool_choice 形式にも対応
+- 関数定義の代わりにプロンプト末尾の JSON スキーマ（modules.llm_providers の
+  function_calling="none"）で指示された場合は、JSON 本文で答える
+- stream=True のSSE配信（content・function_call.arguments の逐次送信）
+- 応答遅延の分布、生成速度（tokens/秒）、500エラー・429の注入
+- 壊れた関数呼び出しの引数の注入（途中で切れる・末尾のカンマ・全角引用符。
+  modules.structured_output の修復の確認用）
+- プロバイダー側のプロンプトキャッシュの模擬（先頭の共通部分を usage の
+  prompt_tokens_details.cached_tokens に計上し、--prefill-tokens-per-sec 指定時は
+  キャッシュされなかった入力分だけ最初のトークンまでの時間を延ばす）
+
+起動:
+    python -m modules.llm_standin --port 8011 --latency lognormal:-0.7,0.5 \\
+        --tokens-per-sec 80 --error-rate 0.01 --rate-limit-rate 0.02
+
+ai_engine 側は環境変数で向き先を切り替える:
+    OPENAI_BASE_URL=http://127.0.0.1:8011/v1 OPENAI_API_KEY=standin
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+# ----------------------------------------------------------------------
+# 設定
+# ----------------------------------------------------------------------
+_CATEGORIES = ["組織・人事", "財務", "マーケティング", "IT・DX", "オペレーション"]
+_ASPECT_RE = re.compile(r"「(.+?)（(.+?)）」")
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """
+    遅延分布の指定を秒数を返す関数に変換する。
+        fixed:0.5 / uniform:0.2,1.5 / normal:0.8,0.2 / lognormal:-0.7,0.5 / exp:0.8
+    """
+    kind, _, args = spec.partition(":")
+    vals = [float(v) for v in args.split(",") if v]
+    if kind == "fixed":
+        return lambda r: vals[0]
+    if kind == "uniform":
+        return lambda r: r.uniform(vals[0], vals[1])
+    if kind == "normal":
+        return lambda r: max(0.0, r.gauss(vals[0], vals[1]))
+    if kind == "lognormal":
+        return lambda r: r.lognormvariate(vals[0], vals[1])
+    if kind == "exp":
+        return lambda r: r.expovariate(1 / vals[0])
+    raise ValueError(f"未対応の遅延分布: {spec}")
+
+
+class PromptCache:
+    """
+    プロバイダー側のプロンプトキャッシュの模擬（モデルごと）。
+    入力が min_tokens 以上のとき、以前の入力と先頭から一致する部分を
+    block_tokens 単位でキャッシュ済みとみなす（OpenAI の prompt caching と同じ考え方）。
+    """
+
+    def __init__(
+        self, min_tokens: int = 1024, block_tokens: int = 128, max_entries: int = 50000
+    ) -> None:
+        self.min_tokens = min_tokens
+        self.block_tokens = block_tokens
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._prefixes: "OrderedDict[Tuple[str, str], None]" = OrderedDict()
+
+    def _boundaries(self, text: str) -> List[Tuple[int, int]]:
+        """(文字位置, その位置までのトークン数) を min_tokens から block_tokens ごとに。"""
+        out = []
+        target, tokens = self.min_tokens, 0.0
+        for i, ch in enumerate(text, 1):
+            tokens += 0.25 if ord(ch) < 128 else 1.0  # count_tokens と同じ見積もり
+            if tokens >= target:
+                out.append((i, target))
+                target += self.block_tokens
+        return out
+
+    def lookup(self, model: str, text: str) -> int:
+        """キャッシュ済みのトークン数を返し、今回の入力の先頭部分を登録する。"""
+        h = hashlib.sha256(model.encode("utf-8"))
+        keys, pos = [], 0
+        for end, tokens in self._boundaries(text):
+            h.update(text[pos:end].encode("utf-8"))
+            pos = end
+            keys.append(((model, h.copy().hexdigest()), tokens))
+        cached = 0
+        with self._lock:
+            for key, tokens in keys:
+                if key not in self._prefixes:
+                    break
+                cached = tokens
+            for key, _ in keys:
+                self._prefixes[key] = None
+                self._prefixes.move_to_end(key)
+            while len(self._prefixes) > self.max_entries:
+                self._prefixes.popitem(last=False)
+        return cached
+
+
+class StandinConfig:
+    def __init__(
+        self,
+        *,
+        latency: str = "fixed:0.2",
+        tokens_per_sec: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        retry_after: float = 1.0,
+        max_concurrency: int = 0,
+        prefill_tokens_per_sec: float = 0.0,
+        prompt_cache: bool = True,
+        malformed_rate: float = 0.0,
+        seed: int | None = None,
+    ) -> None:
+        self.latency_spec = latency
+        self.latency = parse_latency(latency)  # 最初のトークンまでの時間（秒）
+        self.tokens_per_sec = tokens_per_sec  # 0 なら生成時間なし
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.max_concurrency = max_concurrency  # 0 なら無制限。超過分は 429
+        self.prefill_tokens_per_sec = prefill_tokens_per_sec  # 0 なら入力の処理時間なし
+        self.prompt_cache = PromptCache() if prompt_cache else None
+        self.malformed_rate = malformed_rate  # 関数呼び出しの引数を壊す割合
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+
+    def draw(self, fn: Callable[[random.Random], Any]) -> Any:
+        with self.rng_lock:
+            return fn(self.rng)
+
+
+# ----------------------------------------------------------------------
+# 応答の生成
+# ----------------------------------------------------------------------
+def count_tokens(text: str) -> int:
+    """ざっくりしたトークン数（ASCIIは4文字で1、それ以外は1文字で1）。"""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return max(1, ascii_chars // 4 + (len(text) - ascii_chars))
+
+
+def _make_questions(rng: random.Random) -> Dict[str, Any]:
+    return {
+        "questions": [
+            {
+                "category": cat,
+                "question": f"{cat}について、現状の主要KPIと担当者は明確ですか？（{n}）",
+                "rationale": "課題の真因を数値で確認するため",
+            }
+            for cat in _CATEGORIES
+            for n in (1, 2)
+        ]
+    }
+
+
+_ACTION_SCORES = [
+    "V",
+    "R",
+    "I",
+    "O",
+    "市場成長性",
+    "実行難易度",
+    "投資効率",
+    "顧客評価",
+    "リスク",
+]
+
+
+def _make_actions(rng: random.Random) -> Dict[str, Any]:
+    actions = []
+    for n in range(3):
+        a: Dict[str, Any] = {
+            "title": ("【🚩最優先アクション】" if n == 0 else "")
+            + f"改善施策サンプル{n + 1}",
+            "content": "現場で今すぐ着手できる具体策のサンプルです。",
+            "evidence": "中小企業白書 https://www.chusho.meti.go.jp",
+            "risk": "対応が遅れると粗利率がさらに低下する",
+            "kpi": "粗利率 +3pt / 6か月",
+        }
+        for k in _ACTION_SCORES:
+            a[k] = rng.randint(5, 9)
+            a[f"root_{k}"] = "サンプル根拠"
+        a["total"] = sum(a[k] for k in _ACTION_SCORES)
+        a["rank"] = "A" if a["total"] >= 63 else "B"
+        a["is_best"] = n == 0
+        actions.append(a)
+    return {"actions": actions}
+
+
+def _make_diagnosis(rng: random.Random) -> Dict[str, Any]:
+    swot = "\n".join(
+        f"### {label}\n- サンプル{label}の要点（根拠：決算数値と回答より）"
+        for label in ("S（強み）", "W（弱み）", "O（機会）", "T（脅威）")
+    )
+    root_cause = (
+        "# 現在の問題点\n- 粗利率の低下\n"
+        "# 問題点が起きている原因\n- 仕入価格の上昇を価格に転嫁できていない\n"
+        "# 原因が起きている真因\n- 原価と値決めを管理する仕組みがない"
+    )
+    return {"swot": swot, "root_cause": root_cause, **_make_actions(rng)}
+
+
+_KNOWN_FUNCTIONS: Dict[str, Callable[[random.Random], Dict[str, Any]]] = {
+    "make_questions": _make_questions,
+    "make_actions": _make_actions,
+    "make_diagnosis": _make_diagnosis,
+}
+
+
+def sample_from_schema(schema: Dict[str, Any], rng: random.Random) -> Any:
+    """JSON Schema から型どおりのダミー値を作る（未知の関数用）。"""
+    t = schema.get("type")
+    if t == "object":
+        props = schema.get("properties", {})
+        return {k: sample_from_schema(v, rng) for k, v in props.items()}
+    if t == "array":
+        return [sample_from_schema(schema.get("items", {}), rng) for _ in range(3)]
+    if t == "integer":
+        return rng.randint(1, 10)
+    if t == "number":
+        return round(rng.uniform(0, 10), 2)
+    if t == "boolean":
+        return False
+    return "サンプル"
+
+
+def _plain_text(prompt: str, max_tokens: int) -> str:
+    m = _ASPECT_RE.search(prompt)
+    if m:
+        ja, en = m.group(1), m.group(2)
+        return (
+            f"## {ja} ({en})\n"
+            f"- 要約: {ja}の観点では、需要の季節変動と人手不足が収益に直結している。"
+            "繁閑に合わせた価格・人員配置の見直しと、数値での定点観測が有効。\n"
+            "- 出典: 中小企業庁 https://www.chusho.meti.go.jp, 日本経済新聞 https://www.nikkei.com"
+        )
+    body = (
+        "これはスタンドインサーバーの応答です。経営課題に対する要点と根拠を示します。"
+    )
+    n = max(1, min(max_tokens, 400) // count_tokens(body))
+    return "\n".join(f"- {body}" for _ in range(n))
+
+
+def malform(arguments: str, rng: random.Random) -> str:
+    """モデルの出力によくある崩れを1つ入れる。"""
+    kind = rng.choice(["truncate", "trailing_comma", "smart_quotes"])
+    if kind == "truncate":
+        return arguments[: int(len(arguments) * rng.uniform(0.7, 0.97))]
+    if kind == "trailing_comma":
+        return re.sub(r"([}\]])(\s*[}\]])", r"\1,\2", arguments, count=1)
+    return re.sub(r'"(\w+)":', r"“\1”:", arguments)
+
+
+_JSON_SCHEMA_MARKER = re.compile(r"【出力JSONスキーマ: (\w+)】\n(\{.*\})\s*$", re.S)
+
+
+def build_completion(
+    req: Dict[str, Any], cfg: StandinConfig
+) -> Tuple[str, Dict[str, Any]]:
+    """(種別, 内容) を返す。種別は content / function_call / tool_call。"""
+    functions = req.get("functions") or []
+    tools = req.get("tools") or []
+    fc = req.get("function_call")
+    tc = req.get("tool_choice")
+    if tools and not functions:
+        functions = [
+            t.get("function", {}) for t in tools if t.get("type") == "function"
+        ]
+        if isinstance(tc, dict):
+            fc = tc.get("function")
+
+    if functions and fc not in (None, "none"):
+        name = fc.get("name") if isinstance(fc, dict) else functions[0].get("name")
+        fn = next((f for f in functions if f.get("name") == name), functions[0])
+        gen = _KNOWN_FUNCTIONS.get(fn.get("name", ""))
+        args = (
+            cfg.draw(gen)
+            if gen
+            else cfg.draw(lambda r: sample_from_schema(fn.get("parameters", {}), r))
+        )
+        kind = "tool_call" if tools else "function_call"
+        arguments = json.dumps(args, ensure_ascii=False)
+        if cfg.malformed_rate and cfg.draw(lambda r: r.random()) < cfg.malformed_rate:
+            arguments = cfg.draw(lambda r: malform(arguments, r))
+        return kind, {"name": fn.get("name"), "arguments": arguments}
+
+    prompt = "\n".join(
+        m.get("content") or ""
+        for m in req.get("messages", [])
+        if m.get("role") == "user"
+    )
+    m = _JSON_SCHEMA_MARKER.search(prompt)
+    if m:
+        # 関数呼び出しのない接続先向けに JSON スキーマをプロンプトで渡された場合
+        gen = _KNOWN_FUNCTIONS.get(m.group(1))
+        schema = json.loads(m.group(2))
+        args = cfg.draw(gen or (lambda r: sample_from_schema(schema, r)))
+        return "content", {"content": json.dumps(args, ensure_ascii=False)}
+    max_tokens = req.get("max_completion_tokens") or req.get("max_tokens") or 400
+    return "content", {"content": _plain_text(prompt, max_tokens)}
+
+
+def prompt_text(req: Dict[str, Any]) -> str:
+    """入力として数える部分（関数定義 → メッセージの順。キャッシュの先頭一致もこの順）。"""
+    tools = req.get("tools") or req.get("functions")
+    head = json.dumps(tools, ensure_ascii=False, sort_keys=True) if tools else ""
+    return head + "".join(
+        f"{m.get('role')}:{m.get('content') or ''}" for m in req.get("messages", [])
+    )
+
+
+def _usage(
+    req: Dict[str, Any], completion_text: str, cached_tokens: int = 0
+) -> Dict[str, Any]:
+    prompt_tokens = count_tokens(prompt_text(req))
+    completion_tokens = count_tokens(completion_text)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": min(cached_tokens, prompt_tokens)},
+    }
+
+
+def _message(kind: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    if kind == "content":
+        return {"role": "assistant", "content": payload["content"]}
+    if kind == "function_call":
+        return {"role": "assistant", "content": None, "function_call": payload}
+    return {
+        "role": "assistant",
+        "content": None,
+        "tool_calls": [
+            {
+                "id": f"call_{uuid.uuid4().hex[:12]}",
+                "type": "function",
+                "function": payload,
+            }
+        ],
+    }
+
+
+def _pieces(text: str, size: int = 8) -> Iterator[str]:
+    for i in range(0, len(text), size):
+        yield text[i : i + size]
+
+
+# ----------------------------------------------------------------------
+# HTTP サーバー
+# ----------------------------------------------------------------------
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "AIDockStandin/1.0"
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def cfg(self) -> StandinConfig:
+        return self.server.cfg  # type: ignore[attr-defined]
+
+    def log_message(self, fmt: str, *args: Any) -> None:  # 標準エラーを汚さない
+        pass
+
+    def _json(
+        self, status: int, body: Dict[str, Any], headers: Dict[str, str] | None = None
+    ) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status: int, message: str, etype: str) -> None:
+        headers = {"Retry-After": str(self.cfg.retry_after)} if status == 429 else None
+        self._json(status, {"error": {"message": message, "type": etype}}, headers)
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/").endswith("/models"):
+            models = ["o3-mini", "gpt-4.1", "gpt-4.1-mini", "gpt-4o-mini"]
+            self._json(
+                200,
+                {
+                    "object": "list",
+                    "data": [{"id": m, "object": "model"} for m in models],
+                },
+            )
+        elif self.path.rstrip("/").endswith("/health"):
+            self._json(200, {"status": "ok"})
+        else:
+            self._error(404, "not found", "invalid_request_error")
+
+    def do_POST(self) -> None:
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._error(404, "not found", "invalid_request_error")
+            return
+        length = int(self.headers.get("Content-Length", "0"))
+        try:
+            req = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._error(400, "invalid JSON body", "invalid_request_error")
+            return
+
+        srv = self.server
+        with srv.active_lock:  # type: ignore[attr-defined]
+            srv.active += 1  # type: ignore[attr-defined]
+            over = self.cfg.max_concurrency and srv.active > self.cfg.max_concurrency  # type: ignore[attr-defined]
+        try:
+            roll = self.cfg.draw(lambda r: r.random())
+            if over or roll < self.cfg.rate_limit_rate:
+                self._error(429, "Rate limit reached (standin)", "rate_limit_exceeded")
+                return
+            cached = self._prefill(req)
+            time.sleep(self.cfg.draw(self.cfg.latency))
+            if roll < self.cfg.rate_limit_rate + self.cfg.error_rate:
+                self._error(500, "Injected server error (standin)", "server_error")
+                return
+            kind, payload = build_completion(req, self.cfg)
+            if req.get("stream"):
+                self._stream(req, kind, payload, cached)
+            else:
+                self._complete(req, kind, payload, cached)
+        finally:
+            with srv.active_lock:  # type: ignore[attr-defined]
+                srv.active -= 1  # type: ignore[attr-defined]
+
+    def _generation_delay(self, tokens: int) -> float:
+        return tokens / self.cfg.tokens_per_sec if self.cfg.tokens_per_sec > 0 else 0.0
+
+    def _prefill(self, req: Dict[str, Any]) -> int:
+        """プロンプトキャッシュを引き、キャッシュされなかった入力の処理時間だけ待つ。"""
+        text = prompt_text(req)
+        cache = self.cfg.prompt_cache
+        cached = cache.lookup(req.get("model", ""), text) if cache else 0
+        if self.cfg.prefill_tokens_per_sec > 0:
+            uncached = max(0, count_tokens(text) - cached)
+            time.sleep(uncached / self.cfg.prefill_tokens_per_sec)
+        return cached
+
+    def _complete(
+        self, req: Dict[str, Any], kind: str, payload: Dict[str, Any], cached: int = 0
+    ) -> None:
+        text = payload.get("content") or payload.get("arguments") or ""
+        usage = _usage(req, text, cached)
+        time.sleep(self._generation_delay(usage["completion_tokens"]))
+        finish = {
+            "content": "stop",
+            "function_call": "function_call",
+            "tool_call": "tool_calls",
+        }[kind]
+        self._json(
+            200,
+            {
+                "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": req.get("model", "standin"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": _message(kind, payload),
+                        "finish_reason": finish,
+                    }
+                ],
+                "usage": usage,
+            },
+        )
+
+    def _stream(
+        self, req: Dict[str, Any], kind: str, payload: Dict[str, Any], cached: int = 0
+    ) -> None:
+        cid = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        text = payload.get("content") or payload.get("arguments") or ""
+        usage = _usage(req, text, cached)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def send(
+            delta: Dict[str, Any],
+            finish: str | None = None,
+            extra: Dict[str, Any] | None = None,
+        ) -> None:
+            chunk = {
+                "id": cid,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": req.get("model", "standin"),
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+            }
+            chunk.update(extra or {})
+            self.wfile.write(
+                f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8")
+            )
+            self.wfile.flush()
+
+        try:
+            if kind == "content":
+                send({"role": "assistant", "content": ""})
+            elif kind == "function_call":
+                send(
+                    {
+                        "role": "assistant",
+                        "function_call": {"name": payload["name"], "arguments": ""},
+                    }
+                )
+            else:
+                send(
+                    {
+                        "role": "assistant",
+                        "tool_calls": [
+                            {
+                                "index": 0,
+                                "id": f"call_{uuid.uuid4().hex[:12]}",
+                                "type": "function",
+                                "function": {"name": payload["name"], "arguments": ""},
+                            }
+                        ],
+                    }
+                )
+            for piece in _pieces(text):
+                time.sleep(self._generation_delay(count_tokens(piece)))
+                if kind == "content":
+                    send({"content": piece})
+                elif kind == "function_call":
+                    send({"function_call": {"arguments": piece}})
+                else:
+                    send(
+                        {"tool_calls": [{"index": 0, "function": {"arguments": piece}}]}
+                    )
+            finish = {
+                "content": "stop",
+                "function_call": "function_call",
+                "tool_call": "tool_calls",
+            }[kind]
+            send({}, finish)
+            if (req.get("stream_options") or {}).get("include_usage"):
+                self.wfile.write(
+                    f"data: {json.dumps({'id': cid, 'object': 'chat.completion.chunk', 'choices': [], 'usage': usage})}\n\n".encode()
+                )
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # クライアント側のキャンセル
+
+
+def make_server(
+    host: str = "127.0.0.1", port: int = 0, cfg: StandinConfig | None = None
+) -> ThreadingHTTPServer:
+    srv = ThreadingHTTPServer((host, port), _Handler)
+    srv.daemon_threads = True
+    srv.cfg = cfg or StandinConfig()  # type: ignore[attr-defined]
+    srv.active = 0  # type: ignore[attr-defined]
+    srv.active_lock = threading.Lock()  # type: ignore[attr-defined]
+    return srv
+
+
+def start_in_thread(
+    cfg: StandinConfig | None = None, host: str = "127.0.0.1", port: int = 0
+) -> Tuple[ThreadingHTTPServer, str]:
+    """バックグラウンドで起動し (server, base_url) を返す。負荷試験・ベンチ用。"""
+    srv = make_server(host, port, cfg)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv, f"http://{host}:{srv.server_address[1]}/v1"
+
+
+def _main(argv: List[str] | None = None) -> int:
+    import argparse
+
+    p = argparse.ArgumentParser(description="OpenAI互換スタンドインサーバー")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8011)
+    p.add_argument(
+        "--latency",
+        default="fixed:0.2",
+        help="fixed:s / uniform:a,b / normal:m,sd / lognormal:mu,sigma / exp:mean",
+    )
+    p.add_argument("--tokens-per-sec", type=float, default=0.0)
+    p.add_argument("--error-rate", type=float, default=0.0)
+    p.add_argument("--rate-limit-rate", type=float, default=0.0)
+    p.add_argument("--retry-after", type=float, default=1.0)
+    p.add_argument("--max-concurrency", type=int, default=0)
+    p.add_argument(
+        "--prefill-tokens-per-sec",
+        type=float,
+        default=0.0,
+        help="キャッシュされなかった入力トークンの処理速度（0 で処理時間なし）",
+    )
+    p.add_argument(
+        "--no-prompt-cache",
+        action="store_true",
+        help="プロンプトキャッシュの模擬を無効化",
+    )
+    p.add_argument(
+        "--malformed-rate",
+        type=float,
+        default=0.0,
+        help="関数呼び出しの引数を壊して返す割合（途中切れ・末尾カンマ・全角引用符）",
+    )
+    p.add_argument("--seed", type=int)
+    a = p.parse_args(argv)
+
+    cfg = StandinConfig(
+        latency=a.latency,
+        tokens_per_sec=a.tokens_per_sec,
+        error_rate=a.error_rate,
+        rate_limit_rate=a.rate_limit_rate,
+        retry_after=a.retry_after,
+        max_concurrency=a.max_concurrency,
+        prefill_tokens_per_sec=a.prefill_tokens_per_sec,
+        prompt_cache=not a.no_prompt_cache,
+        malformed_rate=a.malformed_rate,
+        seed=a.seed,
+    )
+    srv = make_server(a.host, a.port, cfg)
+    print(f"standin: http://{a.host}:{srv.server_address[1]}/v1  (latency={a.latency})")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(_main())
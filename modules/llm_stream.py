@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# ======================================================================
+# modules/llm_stream.py ― ストリーミング応答の組み立て（キャンセル対応）
+# ======================================================================
+"""
+chat.completions のストリーミング応答（chunk の列）を、通常の応答と同じ形の
+dict に組み立てる。途中で CancelToken がキャンセルされたらストリームを閉じて
+Cancelled を送出する（接続を切るので上流の生成も止まる）。
+
+非ストリーミングの呼び出しは応答が返るまで中断できないため、
+キャンセルしたい呼び出しはストリーミングで送ってここで組み立てる。
+接続（応答ヘッダーが返るまで）や非ストリーミングの応答の待ちは call_cancellable で
+打ち切れる（上流の処理は止まらないが、呼び出し元はすぐに戻る）。
+"""
+
+from __future__ import annotations
+
+import threading
+from typing import Any, Callable, Dict
+
+from modules.cancellation import Cancelled, CancelToken
+
+
+def call_cancellable(create: Callable[[], Any], *, token: CancelToken) -> Any:
+    """
+    create()（ストリームを開く／応答を待つ呼び出し）を別スレッドで待ち、token が
+    キャンセルされたら待たずに Cancelled を送出する。置き去りにしたストリームは、
+    開いた時点で閉じる。
+    """
+    lock = threading.Lock()
+    box: Dict[str, Any] = {}
+    ready = threading.Event()
+
+    def run() -> None:
+        try:
+            stream = create()
+        except BaseException as e:
+            box["error"] = e
+        else:
+            with lock:
+                box["stream"] = stream
+                abandoned = box.get("abandoned", False)
+            if abandoned and hasattr(stream, "close"):
+                stream.close()
+        ready.set()
+
+    threading.Thread(target=run, daemon=True, name="llm-call").start()
+    unregister = token.on_cancel(ready.set)
+    try:
+        ready.wait()
+    finally:
+        unregister()
+    with lock:
+        if "stream" not in box and "error" not in box:
+            box["abandoned"] = True
+            raise Cancelled(token.reason)
+    if "error" in box:
+        if token.cancelled:
+            raise Cancelled(token.reason)
+        raise box["error"]
+    return box["stream"]
+
+
+def _as_dict(obj: Any) -> Dict[str, Any]:
+    if isinstance(obj, dict):
+        return obj
+    return obj.model_dump(exclude_none=True)
+
+
+def collect(
+    stream: Any,
+    *,
+    token: CancelToken | None = None,
+    on_delta: Callable[[Dict[str, Any]], None] | None = None,
+) -> Dict[str, Any]:
+    """ストリームを最後まで読み、ChatCompletion 相当の dict を返す。"""
+    unregister = token.on_cancel(stream.close) if token is not None else None
+    out: Dict[str, Any] = {"object": "chat.completion", "choices": []}
+    choices: Dict[int, Dict[str, Any]] = {}
+    try:
+        for chunk in stream:
+            if token is not None and token.cancelled:
+                break
+            c = _as_dict(chunk)
+            for key in ("id", "created", "model", "system_fingerprint"):
+                if c.get(key) is not None:
+                    out[key] = c[key]
+            if c.get("usage"):
+                out["usage"] = c["usage"]
+            for ch in c.get("choices") or []:
+                _merge_choice(choices, ch)
+                if on_delta is not None:
+                    on_delta(ch.get("delta") or {})
+    except Exception:
+        if token is not None and token.cancelled:
+            raise Cancelled(token.reason)
+        raise
+    finally:
+        if unregister is not None:
+            unregister()
+    if token is not None and token.cancelled:
+        stream.close()
+        raise Cancelled(token.reason)
+    out["choices"] = [choices[i] for i in sorted(choices)]
+    return out
+
+
+def _merge_choice(choices: Dict[int, Dict[str, Any]], ch: Dict[str, Any]) -> None:
+    idx = ch.get("index", 0)
+    cur = choices.setdefault(
+        idx,
+        {"index": idx, "message": {"role": "assistant"}, "finish_reason": None},
+    )
+    if ch.get("finish_reason"):
+        cur["finish_reason"] = ch["finish_reason"]
+    msg, delta = cur["message"], ch.get("delta") or {}
+    if delta.get("content") is not None:
+        msg["content"] = (msg.get("content") or "") + delta["content"]
+    fc = delta.get("function_call")
+    if fc:
+        m = msg.setdefault("function_call", {"name": "", "arguments": ""})
+        m["name"] += fc.get("name") or ""
+        m["arguments"] += fc.get("arguments") or ""
+    for tc in delta.get("tool_calls") or []:
+        calls = msg.setdefault("tool_calls", [])
+        i = tc.get("index", 0)
+        while len(calls) <= i:
+            calls.append(
+                {
+                    "id": "",
+                    "type": "function",
+                    "function": {"name": "", "arguments": ""},
+                }
+            )
+        call = calls[i]
+        call["id"] = tc.get("id") or call["id"]
+        f = tc.get("function") or {}
+        call["function"]["name"] += f.get("name") or ""
+        call["function"]["arguments"] += f.get("arguments") or ""
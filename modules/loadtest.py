@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+# ======================================================================
+# modules/loadtest.py ― 同時診断セッションの負荷試験ハーネス
+# ======================================================================
+"""
+N人の仮想ユーザーが
+    ホーム.py → pages/0_基本情報入力.py → pages/2_AI_経営診断.py（Step2〜6）
+を Streamlit の AppTest で操作し、同時実行数を段階的に上げながら
+ステップ別の p50/p95/p99・スループット・CPU・RSS を計測する。
+
+LLM はローカルのスタンドインサーバー（modules.llm_standin）を自動起動して使う。
+--cassette を指定すると、録画済みのカセット（modules.llm_cassette）から再生する。
+
+    python -m modules.loadtest --ramp 1,2,4,8 --users-per-level 8 \\
+        --latency lognormal:-0.7,0.4 --tokens-per-sec 200
+"""
+
+from __future__ import annotations
+
+import os
+import resource
+import threading
+import time
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Sequence
+
+from modules.metrics import summarize
+
+_ROOT = Path(__file__).resolve().parent.parent
+HOME = str(_ROOT / "ホーム.py")
+BASIC_INFO = "pages/0_基本情報入力.py"
+DIAGNOSIS = "pages/2_AI_経営診断.py"
+
+STEPS = [
+    "home",
+    "basic_info",
+    "step2_external",
+    "step3_questions",
+    "step4_swot",
+    "step5_root_cause",
+    "step6_actions",
+]
+
+SAMPLE_INPUT = {
+    "会社名・屋号": "負荷試験株式会社",
+    "業種（できるだけ詳しく）": "自動車整備業",
+    "地域": "東京都新宿区",
+    "主な商品・サービス": "自動車の修理・販売",
+    "主な顧客層": "地域の一般消費者",
+    "年間売上高（おおよそ）": "10000000",
+    "粗利率（おおよそ）": "30",
+    "最終利益（税引後・おおよそ）": "1000000",
+    "借入金額（だいたい）": "5000000",
+}
+SAMPLE_PROBLEM = "売上の季節変動が大きく、利益率が安定しない"
+
+
+def _rss_kb(pid: int | str = "self") -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def _child_pids() -> List[int]:
+    me = os.getpid()
+    pids = []
+    for name in os.listdir("/proc") if os.path.isdir("/proc") else []:
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == me:
+            pids.append(int(name))
+    return pids
+
+
+def _total_rss_mb() -> float:
+    """自プロセス＋ワーカープロセスの RSS 合計（MB）。"""
+    if not os.path.isdir("/proc"):
+        ru = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return (ru + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+    return (_rss_kb() + sum(_rss_kb(p) for p in _child_pids())) / 1024
+
+
+class _Sampler(threading.Thread):
+    """計測中の RSS 合計を一定間隔でサンプリングする。"""
+
+    def __init__(self, interval: float = 0.5) -> None:
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak_rss = _total_rss_mb()
+        self._halt = threading.Event()
+
+    def run(self) -> None:
+        while not self._halt.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, _total_rss_mb())
+
+    def stop(self) -> None:
+        self._halt.set()
+        self.join()
+
+
+# ----------------------------------------------------------------------
+# 仮想ユーザー（ワーカープロセス内で実行）
+# ----------------------------------------------------------------------
+# AppTest は実行のたびにプロセス共通の Runtime を差し替えるためスレッド間で
+# 同時に動かせない。同時実行数ぶんのワーカープロセスで1ユーザーずつ流す。
+_patched = False
+
+
+def _isolate_apptest_sessions() -> None:
+    """AppTest は全インスタンスが同じ session_id を使うため、
+    セッションストアに前のユーザーの値が残らないよう ID を振り直す。"""
+    global _patched
+    if _patched:
+        return
+    from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+
+    orig_init = LocalScriptRunner.__init__
+
+    def __init__(self, script_path, session_state, *args, **kwargs):
+        orig_init(self, script_path, session_state, *args, **kwargs)
+        self._session_id = f"loadtest-{os.getpid()}-{id(session_state):x}"
+
+    LocalScriptRunner.__init__ = __init__
+    _patched = True
+
+
+def _warmup(delay: float) -> int:
+    """ワーカーの起動と import を計測前に済ませておく。"""
+    import ai_engine  # noqa: F401
+    import config  # noqa: F401
+    from streamlit.testing.v1 import AppTest  # noqa: F401
+
+    _isolate_apptest_sessions()
+    time.sleep(delay)
+    return os.getpid()
+
+
+def _check(at: Any, step: str) -> None:
+    if at.exception:
+        raise RuntimeError(f"{step}: {at.exception[0].message}")
+
+
+def _wait_jobs(at: Any, timeout: float, poll: float = 0.1) -> None:
+    """バックグラウンドジョブ（modules.jobs）が終わるまで画面を再実行する。"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            pending = at.session_state["pending_jobs"]
+        except KeyError:
+            pending = None
+        if not pending:
+            return
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"ジョブが終わりません: {sorted(pending)}")
+        time.sleep(poll)
+        at.run(timeout=timeout)
+
+
+def _click(at: Any, key: str, timeout: float) -> None:
+    at.button(key=key).click().run(timeout=timeout)
+    _wait_jobs(at, timeout)
+
+
+def _run_step(at: Any, key: str, timeout: float) -> None:
+    """結果がまだ無ければ「▶ AI実行」を押す（先読み済みなら押さずに表示だけ）。"""
+    # 大きな結果はセッションストアへ退避されるので、画面の表示で判定する
+    if any("AI実行ボタンを押してください" in m.value for m in at.markdown):
+        _click(at, key, timeout)
+    else:
+        _wait_jobs(at, timeout)
+
+
+def _next_step(at: Any, timeout: float) -> None:
+    next(b for b in at.button if b.label == "次へ ▶").click().run(timeout=timeout)
+    _wait_jobs(at, timeout)
+
+
+def run_user(timeout: float = 300) -> Dict[str, float]:
+    """1ユーザー分の診断を最後まで通し、ステップ別の所要時間（秒）を返す。"""
+    from streamlit.testing.v1 import AppTest
+
+    _isolate_apptest_sessions()
+    timings: Dict[str, float] = {}
+
+    def timed(step: str, fn: Callable[[], None]) -> None:
+        t0 = time.perf_counter()
+        fn()
+        timings[step] = time.perf_counter() - t0
+        _check(at, step)
+
+    at = AppTest.from_file(HOME, default_timeout=timeout)
+    timed("home", lambda: at.run())
+
+    def basic_info() -> None:
+        at.switch_page(BASIC_INFO).run()
+        for ti in at.text_input:
+            for k, v in SAMPLE_INPUT.items():
+                if ti.key == f"input_{k}":
+                    ti.set_value(v)
+        at.text_area(key="input_経営の問題点").set_value(SAMPLE_PROBLEM)
+        next(b for b in at.button if b.label == "保存").click().run()
+
+    timed("basic_info", basic_info)
+
+    def external() -> None:
+        at.session_state["step"] = 2
+        at.switch_page(DIAGNOSIS).run()
+        _click(at, "run_extenv", timeout)
+
+    timed("step2_external", external)
+    # Step3 は表示時に質問を自動生成
+    timed("step3_questions", lambda: _next_step(at, timeout))
+
+    def answer() -> None:
+        for ta in at.text_area:
+            if ta.key and ta.key.startswith("qq_"):
+                ta.set_value("現場の担当者は2名で、月次で数値を確認している")
+        next(b for b in at.button if "回答を保存" in b.label).click().run()
+
+    timed("step3_answer", answer)
+    _next_step(at, timeout)
+    timed("step4_swot", lambda: _run_step(at, "run_swot", timeout))
+    _next_step(at, timeout)
+    timed("step5_root_cause", lambda: _run_step(at, "run_rootcause", timeout))
+    _next_step(at, timeout)
+    timed("step6_actions", lambda: _run_step(at, "run_action", timeout))
+    if not at.expander:
+        raise RuntimeError("step6_actions: 改善アクションの評価が表示されていません")
+    timings["total"] = sum(timings.values())
+    return timings
+
+
+# ----------------------------------------------------------------------
+# ランプアップ
+# ----------------------------------------------------------------------
+def run_level(concurrency: int, users: int, timeout: float = 300) -> Dict[str, Any]:
+    results: List[Dict[str, float]] = []
+    errors: List[str] = []
+
+    sampler = _Sampler()
+    sampler.start()
+    ctx = multiprocessing.get_context("spawn")
+    cpu0 = os.times()
+    with ProcessPoolExecutor(max_workers=concurrency, mp_context=ctx) as pool:
+        list(pool.map(_warmup, [0.5] * concurrency))
+        t0 = time.perf_counter()
+        futures = [pool.submit(run_user, timeout) for _ in range(users)]
+        for fut in as_completed(futures):
+            try:
+                results.append(fut.result())
+            except Exception as e:  # 1ユーザーの失敗で全体を止めない
+                errors.append(str(e))
+        elapsed = time.perf_counter() - t0
+    cpu1 = os.times()  # ワーカー終了後なので子プロセス分も含まれる
+    sampler.stop()
+
+    cpu_sec = sum(cpu1[i] - cpu0[i] for i in range(4))
+    step_names = STEPS + ["step3_answer", "total"]
+    return {
+        "concurrency": concurrency,
+        "users": users,
+        "completed": len(results),
+        "errors": errors,
+        "elapsed_sec": elapsed,
+        "throughput_per_min": len(results) / elapsed * 60 if elapsed else 0.0,
+        # ウォームアップ分を含むプロセス全体の CPU 時間 ÷ 計測区間
+        "cpu_percent": cpu_sec / elapsed * 100 if elapsed else 0.0,
+        "peak_rss_mb": sampler.peak_rss,
+        "steps": {s: summarize([r[s] for r in results if s in r]) for s in step_names},
+    }
+
+
+def ramp(
+    levels: Sequence[int], users_per_level: int, timeout: float = 300
+) -> List[Dict[str, Any]]:
+    return [run_level(c, max(users_per_level, c), timeout) for c in levels]
+
+
+def format_report(rows: List[Dict[str, Any]]) -> str:
+    out = []
+    for r in rows:
+        out.append(
+            f"== 同時実行 {r['concurrency']} / {r['completed']}/{r['users']}件完了"
+            f" / {r['throughput_per_min']:.1f}件/分 / CPU {r['cpu_percent']:.0f}%"
+            f" / RSS {r['peak_rss_mb']:.0f}MB"
+        )
+        out.append(f"   {'step':<18}{'p50':>8}{'p95':>8}{'p99':>8}  (秒)")
+        for name, s in r["steps"].items():
+            if s["count"]:
+                out.append(
+                    f"   {name:<18}{s['p50']:>8.2f}{s['p95']:>8.2f}{s['p99']:>8.2f}"
+                )
+        for e in r["errors"][:3]:
+            out.append(f"   ⚠ {e}")
+    return "\n".join(out)
+
+
+def _main(argv: Sequence[str] | None = None) -> int:
+    import argparse
+
+    from modules.llm_standin import StandinConfig, start_in_thread
+
+    p = argparse.ArgumentParser(description="同時診断セッションの負荷試験")
+    p.add_argument("--ramp", default="1,2,4,8", help="同時実行数（カンマ区切り）")
+    p.add_argument("--users-per-level", type=int, default=8)
+    p.add_argument("--timeout", type=float, default=300)
+    p.add_argument("--base-url", help="既存のスタンドイン/互換サーバーを使う場合")
+    p.add_argument("--latency", default="lognormal:-0.7,0.4")
+    p.add_argument("--tokens-per-sec", type=float, default=200)
+    p.add_argument(
+        "--prefill-tokens-per-sec",
+        type=float,
+        default=0.0,
+        help="スタンドインの入力処理速度（プロンプトキャッシュの効果を見るとき）",
+    )
+    p.add_argument("--error-rate", type=float, default=0.0)
+    p.add_argument(
+        "--malformed-rate",
+        type=float,
+        default=0.0,
+        help="スタンドインが関数呼び出しの引数を壊して返す割合",
+    )
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--json", help="結果を JSON で書き出すパス")
+    p.add_argument(
+        "--cassette", help="LLM 応答をこのカセットから再生（modules.llm_cassette）"
+    )
+    p.add_argument(
+        "--replay-speed", type=float, default=1.0, help="0 = 待ちなし, 1 = 記録時の速さ"
+    )
+    a = p.parse_args(argv)
+
+    if a.cassette:
+        # ワーカープロセスは環境変数を引き継ぐ
+        os.environ["AI_DOCK_LLM_CASSETTE"] = a.cassette
+        os.environ["AI_DOCK_LLM_CASSETTE_MODE"] = "replay"
+        os.environ["AI_DOCK_LLM_REPLAY_SPEED"] = str(a.replay_speed)
+    elif a.base_url:
+        os.environ["OPENAI_BASE_URL"] = a.base_url
+    else:
+        _, url = start_in_thread(
+            StandinConfig(
+                latency=a.latency,
+                tokens_per_sec=a.tokens_per_sec,
+                prefill_tokens_per_sec=a.prefill_tokens_per_sec,
+                error_rate=a.error_rate,
+                malformed_rate=a.malformed_rate,
+                seed=a.seed,
+            )
+        )
+        os.environ["OPENAI_BASE_URL"] = url
+        os.environ["OPENAI_API_KEY"] = "standin"
+
+    # `python -m` 実行時も、ワーカーへは modules.loadtest の関数として渡す
+    from modules import loadtest
+
+    levels = [int(x) for x in a.ramp.split(",") if x]
+    rows = loadtest.ramp(levels, a.users_per_level, a.timeout)
+    print(format_report(rows))
+    if a.json:
+        with open(a.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(_main())
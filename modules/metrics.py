@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+# ======================================================================
+# modules/metrics.py ― プロセス内の簡易メトリクス（カウンタ／ヒストグラム）
+# ======================================================================
+"""
+負荷試験や LLM 呼び出し周りの計測値をまとめるための、依存なしの小さな集計器。
+
+    from modules.metrics import metrics
+    metrics.counter("llm.calls").inc()
+    metrics.histogram("llm.latency_sec").observe(1.23)
+    metrics.snapshot()   # {"counters": {...}, "histograms": {...}}
+"""
+
+from __future__ import annotations
+
+import math
+import threading
+from collections import deque
+from typing import Dict, Iterable, List, Sequence
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """線形補間によるパーセンタイル（q は 0〜100）。空なら nan。"""
+    if not values:
+        return math.nan
+    xs = sorted(values)
+    if len(xs) == 1:
+        return float(xs[0])
+    pos = (len(xs) - 1) * q / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(xs) - 1)
+    return float(xs[lo] + (xs[hi] - xs[lo]) * (pos - lo))
+
+
+def summarize(values: Sequence[float]) -> Dict[str, float]:
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else math.nan,
+    }
+
+
+class Counter:
+    def __init__(self) -> None:
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, n: float = 1) -> None:
+        with self._lock:
+            self._value += n
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+
+class Histogram:
+    """
+    直近 max_samples 件の値をリングバッファで保持し、パーセンタイルを返す
+    （古い値から捨てるので、ヘッジの待ち時間や待ち行列の ETA が最近の所要時間に追従する）。
+    count / sum は起動以降の全件。
+    """
+
+    def __init__(self, max_samples: int = 2048) -> None:
+        self.max_samples = max_samples
+        self._samples: "deque[float]" = deque(maxlen=max_samples)
+        self._count = 0
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self._count += 1
+            self._sum += value
+            self._samples.append(value)
+
+    def values(self) -> List[float]:
+        with self._lock:
+            return list(self._samples)
+
+    def percentile(self, q: float) -> float:
+        return percentile(self.values(), q)
+
+    def snapshot(self) -> Dict[str, float]:
+        s = summarize(self.values())
+        s["count"] = self._count
+        s["sum"] = self._sum
+        return s
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._counters: Dict[str, Counter] = {}
+        self._histograms: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str) -> Counter:
+        with self._lock:
+            return self._counters.setdefault(name, Counter())
+
+    def histogram(self, name: str) -> Histogram:
+        with self._lock:
+            return self._histograms.setdefault(name, Histogram())
+
+    def snapshot(self, prefixes: Iterable[str] = ()) -> Dict[str, Dict]:
+        prefixes = tuple(prefixes)
+
+        def keep(name: str) -> bool:
+            return not prefixes or name.startswith(prefixes)
+
+        with self._lock:
+            counters = dict(self._counters)
+            hists = dict(self._histograms)
+        return {
+            "counters": {k: c.value for k, c in sorted(counters.items()) if keep(k)},
+            "histograms": {
+                k: h.snapshot() for k, h in sorted(hists.items()) if keep(k)
+            },
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+# プロセス共通のレジストリ
+metrics = Registry()
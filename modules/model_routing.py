@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+# ======================================================================
+# modules/model_routing.py ― ステップ別のモデル選択と、レイテンシSLO超過時の切り替え
+# ======================================================================
+"""
+ステップ（external / questions / swot ...）と入力の大きさから、使うモデルの候補列
+（先頭が第一候補）と SLO（秒）を決める。ai_engine._chat_completion は第一候補で
+送り、SLO を超えても終わらない・エラーになった場合は打ち切って次の（速い）モデルへ
+切り替える。最後の候補には SLO をかけない。切り替え先にも、そのステップの
+サンプリング設定（temperature。推論モデルには送らない）をかけ直す。
+
+- 質問生成のような軽いステップは推論モデルを使わない
+- 入力が min_prompt_tokens 以上のときだけ使う経路を定義できる（長い入力は別モデルへ）
+- 表にないステップは、呼び出し元が指定したモデルをそのまま使う
+- "local:qwen2.5-32b" のように書いた候補は、そのプロバイダーへ送る（modules.llm_providers）
+- 判断と結果（モデル・所要時間・SLO超過／エラー）は1件ずつ JSON Lines に記録でき、
+  summary で集計して SLO・モデルの調整に使う
+
+設定（環境変数）:
+    AI_DOCK_MODEL_ROUTING   1 で有効（既定 無効：呼び出し元のモデルをそのまま使う）
+    AI_DOCK_MODEL_ROUTES    ステップ別の経路の上書き（JSON。temperature 省略時は 0）
+                            {"swot": [{"models": ["o3-mini", "gpt-4.1"], "slo_sec": 60},
+                                      {"models": ["gpt-4.1"], "min_prompt_tokens": 12000}]}
+    AI_DOCK_ROUTING_LOG     判断ログ（JSON Lines）の出力先（未設定なら記録しない）
+
+メトリクス:
+    llm.route.<step>.<model>      そのモデルで送った回数
+    llm.route.fallback.<step>     次の候補へ切り替えた回数
+    llm.route.slo_exceeded.<step> / llm.route.error.<step>  切り替えの理由別
+
+    python -m modules.model_routing summary routing.jsonl
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+from modules.metrics import metrics, summarize
+
+
+@dataclass(frozen=True)
+class Route:
+    models: Tuple[str, ...]  # 先頭が第一候補。後ろほど速いモデル
+    slo_sec: float | None = None  # 最後の候補以外に適用する SLO
+    min_prompt_tokens: int = 0  # 入力がこのトークン数以上のときに使う経路
+    temperature: float | None = 0.0  # 呼び出し元が指定しなかったときの temperature
+
+    def request(self, params: Dict[str, Any], model: str) -> Dict[str, Any]:
+        """候補 model へ送るパラメータ（ステップのサンプリング設定をかけ直す）。"""
+        out = dict(params, model=model)
+        if self.temperature is not None:
+            # o系を第一候補にした呼び出しは temperature を持たないため、切り替え先で補う
+            out.setdefault("temperature", self.temperature)
+        return out
+
+
+DEFAULT_ROUTES: Dict[str, Tuple[Route, ...]] = {
+    "external": (Route(("gpt-4.1", "gpt-4.1-mini"), 40),),
+    "questions": (Route(("gpt-4.1-mini", "gpt-4o-mini"), 30),),
+    "digest": (Route(("gpt-4.1-mini", "gpt-4o-mini"), 30),),
+    "swot": (
+        Route(("o3-mini", "gpt-4.1"), 90),
+        Route(("gpt-4.1", "gpt-4.1-mini"), 60, min_prompt_tokens=12000),
+    ),
+    "root_cause": (
+        Route(("o3-mini", "gpt-4.1"), 90),
+        Route(("gpt-4.1", "gpt-4.1-mini"), 60, min_prompt_tokens=12000),
+    ),
+    "actions": (Route(("o3-mini", "gpt-4.1"), 120),),
+    "fused": (Route(("o3-mini", "gpt-4.1"), 180),),
+}
+
+
+def estimate_tokens(messages: Iterable[Dict[str, Any]]) -> int:
+    """ざっくりした入力トークン数（ASCIIは4文字で1、それ以外は1文字で1）。"""
+    text = "".join(m.get("content") or "" for m in messages)
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return ascii_chars // 4 + (len(text) - ascii_chars)
+
+
+def parse_routes(spec: str | None) -> Dict[str, Tuple[Route, ...]]:
+    routes = dict(DEFAULT_ROUTES)
+    for step, items in json.loads(spec or "{}").items():
+        routes[step] = tuple(
+            Route(
+                tuple(item["models"]),
+                item.get("slo_sec"),
+                int(item.get("min_prompt_tokens", 0)),
+                item.get("temperature", 0.0),
+            )
+            for item in items
+        )
+    return routes
+
+
+class ModelRouter:
+    def __init__(
+        self,
+        routes: Dict[str, Tuple[Route, ...]] | None = None,
+        log_path: str | None = None,
+    ) -> None:
+        self.routes = dict(DEFAULT_ROUTES if routes is None else routes)
+        self.log_path = log_path
+        self._log_lock = threading.Lock()
+
+    def route(self, step: str, prompt_tokens: int) -> Route | None:
+        """入力の大きさに合う経路（min_prompt_tokens が最も大きいもの）。表になければ None。"""
+        fits = [
+            r for r in self.routes.get(step, ()) if prompt_tokens >= r.min_prompt_tokens
+        ]
+        return max(fits, key=lambda r: r.min_prompt_tokens) if fits else None
+
+    def record(
+        self,
+        step: str,
+        model: str,
+        *,
+        attempt: int,
+        outcome: str,
+        elapsed_sec: float,
+        prompt_tokens: int,
+        route: Route,
+        error: str = "",
+    ) -> None:
+        """1回の送信の結果。outcome は ok / slo_exceeded / error / cancelled。"""
+        metrics.counter(f"llm.route.{step}.{model}").inc()
+        if outcome in ("slo_exceeded", "error") and attempt < len(route.models) - 1:
+            metrics.counter(f"llm.route.fallback.{step}").inc()
+            metrics.counter(f"llm.route.{outcome}.{step}").inc()
+        if not self.log_path:
+            return
+        line = json.dumps(
+            {
+                "ts": time.time(),
+                "step": step,
+                "model": model,
+                "attempt": attempt,
+                "outcome": outcome,
+                "elapsed_sec": round(elapsed_sec, 3),
+                "slo_sec": route.slo_sec,
+                "prompt_tokens": prompt_tokens,
+                "min_prompt_tokens": route.min_prompt_tokens,
+                "error": error[:200],
+            },
+            ensure_ascii=False,
+        )
+        with self._log_lock, open(self.log_path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+_ROUTER: ModelRouter | None = None
+_ROUTER_LOCK = threading.Lock()
+
+
+def get_router() -> ModelRouter | None:
+    """AI_DOCK_MODEL_ROUTING=1 でなければ None。"""
+    global _ROUTER
+    if os.getenv("AI_DOCK_MODEL_ROUTING", "0") != "1":
+        return None
+    with _ROUTER_LOCK:
+        if _ROUTER is None:
+            _ROUTER = ModelRouter(
+                parse_routes(os.getenv("AI_DOCK_MODEL_ROUTES")),
+                os.getenv("AI_DOCK_ROUTING_LOG") or None,
+            )
+        return _ROUTER
+
+
+# ----------------------------------------------------------------------
+# 集計
+# ----------------------------------------------------------------------
+def summarize_log(path: str) -> Dict[Tuple[str, str], Dict[str, Any]]:
+    """(ステップ, モデル) ごとの件数・結果・成功時の所要時間。"""
+    groups: Dict[Tuple[str, str], List[Dict[str, Any]]] = defaultdict(list)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                rec = json.loads(line)
+                groups[(rec["step"], rec["model"])].append(rec)
+    out = {}
+    for key, recs in sorted(groups.items()):
+        s = summarize([r["elapsed_sec"] for r in recs if r["outcome"] == "ok"])
+        s["sent"] = len(recs)
+        for outcome in ("ok", "slo_exceeded", "error", "cancelled"):
+            s[outcome] = sum(1 for r in recs if r["outcome"] == outcome)
+        out[key] = s
+    return out
+
+
+def _main(argv: Sequence[str] | None = None) -> int:
+    import argparse
+
+    p = argparse.ArgumentParser(description="モデル選択ログの集計")
+    p.add_argument("command", choices=["summary"])
+    p.add_argument("path")
+    a = p.parse_args(argv)
+
+    print(
+        f"{'step':<12}{'model':<16}{'送信':>6}{'成功':>6}{'SLO超過':>8}{'エラー':>7}"
+        f"{'p50':>8}{'p95':>8}"
+    )
+    for (step, model), s in summarize_log(a.path).items():
+        print(
+            f"{step:<12}{model:<16}{s['sent']:>6}{s['ok']:>6}{s['slo_exceeded']:>8}"
+            f"{s['error']:>7}{s['p50']:>8.2f}{s['p95']:>8.2f}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(_main())
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+# ======================================================================
+# modules/pipeline.py ― 診断ステップの依存関係（DAG）と先読み実行の判定
+# ======================================================================
+"""
+AI経営診断の各ステップ（Step2〜6）が、どのセッション値を入力にしてどの値を
+出力するかを定義し、次の判定を行う（実行そのものは modules.jobs のワーカー）。
+
+- fingerprint()  入力（基本情報＋依存する値）のハッシュ。ジョブ登録時と結果の
+                 反映時で異なれば、入力が変わったので結果は使わない
+- is_fresh()     出力が今の入力から作られたものか
+- prefetchable() 上流がそろって最新になったので、ユーザーのクリックを待たずに
+                 裏で先に実行してよいステップ
+
+    external ──┬─> questions ──(回答)──> swot ──> root_cause ──> actions
+               └─────────────────────────┘
+
+一括実行モード（fused）では swot・root_cause・actions を1回の AI 呼び出しで作り、
+3つの出力をそれぞれのステップの結果として記録する。
+
+設定（環境変数）:
+    AI_DOCK_PREFETCH     1 で先読み実行を有効化（既定 無効）。先読みは利用者が押して
+                         いない AI 実行（o3-mini 等）の費用がかかる。先読みの改善アクション
+                         は、Step6 で表示されるまで履歴保存・診断完了の扱いにしない
+    AI_DOCK_FUSED_MODE   1 で一括実行モードを既定にする（画面で切り替え可、既定 無効）
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, List, Mapping, Tuple
+
+
+@dataclass(frozen=True)
+class StepSpec:
+    func_name: str  # ai_engine の関数名
+    output_key: str  # 結果を入れるセッションキー
+    # 入力にするセッションキー（基本情報 user_input は常に入力）
+    inputs: Tuple[str, ...]
+
+
+STEPS: Dict[str, StepSpec] = {
+    "external": StepSpec(
+        "show_external_environment_analysis_ai", "external_output", ()
+    ),
+    "questions": StepSpec(
+        "deep_dive_questions_ai", "deep_dive_questions", ("external_output",)
+    ),
+    "swot": StepSpec(
+        "show_swot_section_ai",
+        "swot_output",
+        ("external_output", "deep_dive_questions", "deep_dive_answers"),
+    ),
+    "root_cause": StepSpec(
+        "root_cause_analysis_ai",
+        "root_cause_output",
+        ("external_output", "deep_dive_questions", "deep_dive_answers", "swot_output"),
+    ),
+    "actions": StepSpec(
+        "action_with_eval_ai",
+        "action_result",
+        (
+            "external_output",
+            "deep_dive_questions",
+            "deep_dive_answers",
+            "swot_output",
+            "root_cause_output",
+        ),
+    ),
+    # 一括実行モード：入力は swot と同じ、出力は FUSED_STEPS の3つ
+    "fused": StepSpec(
+        "diagnose_fused_ai",
+        "fused_result",
+        ("external_output", "deep_dive_questions", "deep_dive_answers"),
+    ),
+}
+# ジョブに渡す入力キー（全ステップの入力の和）
+INPUT_KEYS: Tuple[str, ...] = tuple(
+    dict.fromkeys(k for spec in STEPS.values() for k in spec.inputs)
+)
+# 先読みしてよいステップ（外部環境・質問はユーザーの操作を起点にする）
+PREFETCH_STEPS: Tuple[str, ...] = ("swot", "root_cause", "actions")
+# 一括実行モードの1回の結果に含まれるステップ（上流から順に）
+FUSED_STEPS: Tuple[str, ...] = ("swot", "root_cause", "actions")
+
+_OUTPUT_TO_STEP = {spec.output_key: kind for kind, spec in STEPS.items()}
+
+
+def prefetch_enabled() -> bool:
+    return os.getenv("AI_DOCK_PREFETCH", "0") == "1"
+
+
+def fused_default() -> bool:
+    return os.getenv("AI_DOCK_FUSED_MODE", "0") == "1"
+
+
+def _filled(value: Any) -> bool:
+    if isinstance(value, dict):
+        return any(value.values())
+    return bool(value)
+
+
+def fingerprint(kind: str, state: Mapping[str, Any]) -> str:
+    spec = STEPS[kind]
+    payload = {k: state.get(k) for k in ("user_input", *spec.inputs)}
+    blob = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()[:16]
+
+
+def upstream(kind: str) -> List[str]:
+    """kind の入力を出力するステップ。"""
+    return [_OUTPUT_TO_STEP[k] for k in STEPS[kind].inputs if k in _OUTPUT_TO_STEP]
+
+
+def is_fresh(
+    kind: str, state: Mapping[str, Any], output_fps: Mapping[str, str]
+) -> bool:
+    """出力があり、今の入力から作られたものなら True（記録がない出力は最新とみなす）。"""
+    if kind == "fused":
+        return all(is_fresh(k, state, output_fps) for k in FUSED_STEPS)
+    if not _filled(state.get(STEPS[kind].output_key)):
+        return False
+    recorded = output_fps.get(kind)
+    return recorded is None or recorded == fingerprint(kind, state)
+
+
+def inputs_ready(
+    kind: str, state: Mapping[str, Any], output_fps: Mapping[str, str]
+) -> bool:
+    """入力がすべてそろい、上流ステップの出力がどれも最新なら True。"""
+    spec = STEPS[kind]
+    if not all(_filled(state.get(k)) for k in spec.inputs):
+        return False
+    return all(is_fresh(up, state, output_fps) for up in upstream(kind))
+
+
+def prefetchable(
+    state: Mapping[str, Any],
+    output_fps: Mapping[str, str],
+    running: Mapping[str, str],
+    *,
+    fused: bool = False,
+) -> List[str]:
+    """
+    先読みで開始すべきステップ。running は実行中ジョブの 種別 → 入力フィンガープリント。
+    入力が同じジョブが実行中のものは除く（入力が変わった実行中ジョブは含める）。
+    fused=True（一括実行モード）では PREFETCH_STEPS の代わりに fused を対象にする。
+    """
+    if not prefetch_enabled():
+        return []
+    kinds = []
+    for kind in ("fused",) if fused else PREFETCH_STEPS:
+        if is_fresh(kind, state, output_fps) or not inputs_ready(
+            kind, state, output_fps
+        ):
+            continue
+        if running.get(kind) == fingerprint(kind, state):
+            continue
+        kinds.append(kind)
+    return kinds
@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+# ======================================================================
+# modules/report_archive.py ― 診断レポートのアーカイブ＆ストリーミング出力
+# ======================================================================
+"""
+診断結果を SQLite に蓄積し、CSV / Parquet へチャンク単位で書き出す。
+
+- アーカイブは環境変数 ``AI_DOCK_ARCHIVE_DB`` にDBパスが設定された場合のみ有効
+  （未設定時はこれまで通りサーバー側に何も保存しない）。
+- エクスポートは ``cursor.fetchmany`` で少しずつ読み出して書き出すため、
+  件数が増えてもメモリ使用量は一定。
+- 期間・業種・地域・会社名のフィルタは SQL の WHERE 句で処理する。
+
+画面（レポート履歴ページ）からのダウンロードは download_button がファイル全体を
+メモリに載せるため、件数が多い一括出力はメモリ一定の CLI を使う。
+
+CLI:
+    python -m modules.report_archive --format parquet --date-from 2025-01-01 -o out.parquet
+"""
+
+from __future__ import annotations
+
+import csv
+import importlib.util
+import io
+import json
+import os
+import sqlite3
+from contextlib import closing
+from datetime import date, datetime
+from typing import Any, BinaryIO, Dict, Iterator, List, Sequence, Tuple
+
+_DB_ENV = "AI_DOCK_ARCHIVE_DB"
+DEFAULT_CHUNK_SIZE = 1000
+
+# アクション評価の各軸 → アーカイブ列名
+_SCORE_FIELDS: List[Tuple[str, str]] = [
+    ("V", "score_v"),
+    ("R", "score_r"),
+    ("I", "score_i"),
+    ("O", "score_o"),
+    ("市場成長性", "score_market"),
+    ("実行難易度", "score_difficulty"),
+    ("投資効率", "score_roi"),
+    ("顧客評価", "score_customer"),
+    ("リスク", "score_risk"),
+]
+
+# (列名, SQLite型, Parquet型) ― Parquet型は pyarrow の型名
+_COLUMNS: List[Tuple[str, str, str]] = [
+    ("id", "INTEGER PRIMARY KEY AUTOINCREMENT", "int64"),
+    ("created_at", "TEXT NOT NULL", "timestamp"),
+    ("company", "TEXT", "string"),
+    ("industry", "TEXT", "string"),
+    ("region", "TEXT", "string"),
+    ("annual_sales", "INTEGER", "int64"),
+    ("gross_margin", "REAL", "float64"),
+    ("net_profit", "INTEGER", "int64"),
+    ("debt", "INTEGER", "int64"),
+    ("action_count", "INTEGER", "int32"),
+    ("best_action", "TEXT", "string"),
+    ("best_total", "INTEGER", "int32"),
+    ("best_rank", "TEXT", "string"),
+    ("avg_total", "REAL", "float64"),
+    *[(col, "INTEGER", "int32") for _, col in _SCORE_FIELDS],
+    # 以下は長文。エクスポート時は include_text=True の場合のみ出力
+    ("problem", "TEXT", "string"),
+    ("external_output", "TEXT", "string"),
+    ("swot_output", "TEXT", "string"),
+    ("root_cause_output", "TEXT", "string"),
+    ("actions_json", "TEXT", "string"),
+]
+_TEXT_COLUMNS = {
+    "problem",
+    "external_output",
+    "swot_output",
+    "root_cause_output",
+    "actions_json",
+}
+
+
+# ----------------------------------------------------------------------
+# 接続
+# ----------------------------------------------------------------------
+def archive_path() -> str | None:
+    return os.getenv(_DB_ENV) or None
+
+
+def is_enabled() -> bool:
+    return archive_path() is not None
+
+
+def _connect(path: str | None = None) -> sqlite3.Connection:
+    path = path or archive_path()
+    if not path:
+        raise RuntimeError(
+            f"アーカイブが無効です（環境変数 {_DB_ENV} を設定してください）"
+        )
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    cols = ",\n".join(f"{name} {sql_type}" for name, sql_type, _ in _COLUMNS)
+    conn.execute(f"CREATE TABLE IF NOT EXISTS reports (\n{cols}\n)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_reports_created ON reports(created_at)")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS ix_reports_ind_reg ON reports(industry, region)"
+    )
+    return conn
+
+
+# ----------------------------------------------------------------------
+# 書き込み
+# ----------------------------------------------------------------------
+def _to_int(v: Any) -> int | None:
+    try:
+        return int(str(v).replace(",", "").strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_float(v: Any) -> float | None:
+    try:
+        return float(str(v).replace("%", "").strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def archive_report(
+    user_input: Dict[str, Any],
+    *,
+    external_output: str = "",
+    swot_output: str = "",
+    root_cause_output: str = "",
+    action_result: Dict[str, Any] | None = None,
+    path: str | None = None,
+) -> int | None:
+    """診断1件を保存して行IDを返す。アーカイブ無効時は何もせず None。"""
+    if not (path or is_enabled()):
+        return None
+
+    evals = (action_result or {}).get("evaluations", []) or []
+    best = next((a for a in evals if a.get("is_best")), evals[0] if evals else {})
+    totals = [t for t in (_to_int(a.get("total")) for a in evals) if t is not None]
+
+    row: Dict[str, Any] = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "company": user_input.get("会社名・屋号", ""),
+        "industry": user_input.get("業種（できるだけ詳しく）", ""),
+        "region": user_input.get("地域", ""),
+        "annual_sales": _to_int(user_input.get("年間売上高（おおよそ）")),
+        "gross_margin": _to_float(user_input.get("粗利率（おおよそ）")),
+        "net_profit": _to_int(user_input.get("最終利益（税引後・おおよそ）")),
+        "debt": _to_int(user_input.get("借入金額（だいたい）")),
+        "action_count": len(evals),
+        "best_action": best.get("title", ""),
+        "best_total": _to_int(best.get("total")),
+        "best_rank": best.get("rank", ""),
+        "avg_total": round(sum(totals) / len(totals), 2) if totals else None,
+        "problem": user_input.get("経営の問題点", ""),
+        "external_output": external_output or "",
+        "swot_output": swot_output or "",
+        "root_cause_output": root_cause_output or "",
+        "actions_json": json.dumps(evals, ensure_ascii=False),
+    }
+    for key, col in _SCORE_FIELDS:
+        row[col] = _to_int(best.get(key))
+
+    names = list(row)
+    sql = (
+        f"INSERT INTO reports ({', '.join(names)}) "
+        f"VALUES ({', '.join('?' for _ in names)})"
+    )
+    with closing(_connect(path)) as conn, conn:
+        cur = conn.execute(sql, [row[n] for n in names])
+        return cur.lastrowid
+
+
+# ----------------------------------------------------------------------
+# 読み出し（フィルタは WHERE 句へ）
+# ----------------------------------------------------------------------
+def _where(
+    *,
+    date_from: date | str | None = None,
+    date_to: date | str | None = None,
+    industry: str | None = None,
+    region: str | None = None,
+    company: str | None = None,
+) -> Tuple[str, List[Any]]:
+    clauses: List[str] = []
+    params: List[Any] = []
+    if date_from:
+        clauses.append("created_at >= ?")
+        params.append(str(date_from))
+    if date_to:
+        # 終了日は当日を含める
+        clauses.append("created_at < date(?, '+1 day')")
+        params.append(str(date_to))
+    for col, value in (
+        ("industry", industry),
+        ("region", region),
+        ("company", company),
+    ):
+        if value:
+            clauses.append(f"{col} LIKE ?")
+            params.append(f"%{value}%")
+    return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+
+def export_columns(include_text: bool = False) -> List[str]:
+    return [c for c, _, _ in _COLUMNS if include_text or c not in _TEXT_COLUMNS]
+
+
+def iter_rows(
+    *,
+    columns: Sequence[str] | None = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    path: str | None = None,
+    **filters: Any,
+) -> Iterator[List[tuple]]:
+    """フィルタに合致する行を chunk_size 件ずつ返す。"""
+    columns = list(columns or export_columns())
+    where, params = _where(**filters)
+    sql = f"SELECT {', '.join(columns)} FROM reports{where} ORDER BY created_at, id"
+    with closing(_connect(path)) as conn:
+        cur = conn.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+
+
+def list_reports(limit: int = 50, *, path: str | None = None) -> List[Dict[str, Any]]:
+    """履歴ページ用：新しい順に最大 limit 件。"""
+    sql = (
+        "SELECT id, created_at, company, industry, region, best_action, best_total "
+        "FROM reports ORDER BY created_at DESC, id DESC LIMIT ?"
+    )
+    with closing(_connect(path)) as conn:
+        conn.row_factory = sqlite3.Row
+        return [dict(r) for r in conn.execute(sql, (limit,))]
+
+
+def count_reports(*, path: str | None = None, **filters: Any) -> int:
+    where, params = _where(**filters)
+    with closing(_connect(path)) as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM reports{where}", params).fetchone()[
+            0
+        ]
+
+
+def industry_region_counts(
+    *, path: str | None = None, **filters: Any
+) -> List[Tuple[str, str, int]]:
+    """業種×地域ごとの件数（多い順）。外部環境分析キャッシュの事前生成で使う。"""
+    where, params = _where(**filters)
+    sql = (
+        f"SELECT industry, region, COUNT(*) AS n FROM reports{where}"
+        " GROUP BY industry, region ORDER BY n DESC"
+    )
+    with closing(_connect(path)) as conn:
+        return [(r[0] or "", r[1] or "", r[2]) for r in conn.execute(sql, params)]
+
+
+# ----------------------------------------------------------------------
+# エクスポート
+# ----------------------------------------------------------------------
+def iter_csv(
+    *, include_text: bool = False, chunk_size: int = DEFAULT_CHUNK_SIZE, **filters: Any
+) -> Iterator[str]:
+    """ヘッダー行 → 各チャンクの CSV 文字列を順に返す。"""
+    columns = export_columns(include_text)
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    yield buf.getvalue()
+    for rows in iter_rows(columns=columns, chunk_size=chunk_size, **filters):
+        buf.seek(0)
+        buf.truncate()
+        writer.writerows(rows)
+        yield buf.getvalue()
+
+
+def write_csv(out: BinaryIO, **kwargs: Any) -> None:
+    """Excelで文字化けしないよう UTF-8 (BOM付き) で書き出す。"""
+    out.write("\ufeff".encode("utf-8"))
+    for chunk in iter_csv(**kwargs):
+        out.write(chunk.encode("utf-8"))
+
+
+def _arrow_schema(columns: Sequence[str]):
+    import pyarrow as pa
+
+    types = {
+        "int32": pa.int32(),
+        "int64": pa.int64(),
+        "float64": pa.float64(),
+        "string": pa.string(),
+        "timestamp": pa.timestamp("s"),
+    }
+    kinds = {name: kind for name, _, kind in _COLUMNS}
+    return pa.schema([(c, types[kinds[c]]) for c in columns])
+
+
+def write_parquet(
+    out: str | BinaryIO,
+    *,
+    include_text: bool = False,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    **filters: Any,
+) -> None:
+    """スコア列を整数型にした Parquet を、チャンクごとに row group として書き出す。"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError(
+            "Parquet出力には pyarrow が必要です（pip install pyarrow）"
+        ) from e
+
+    columns = export_columns(include_text)
+    schema = _arrow_schema(columns)
+    ts_idx = columns.index("created_at")
+    with pq.ParquetWriter(out, schema, compression="zstd") as writer:
+        for rows in iter_rows(columns=columns, chunk_size=chunk_size, **filters):
+            cols = [list(c) for c in zip(*rows)]
+            cols[ts_idx] = [datetime.fromisoformat(v) for v in cols[ts_idx]]
+            writer.write_batch(pa.record_batch(cols, schema=schema))
+
+
+EXPORT_FORMATS = {
+    "csv": (write_csv, "text/csv", "csv"),
+    "parquet": (write_parquet, "application/vnd.apache.parquet", "parquet"),
+}
+
+
+def available_formats() -> List[str]:
+    """この環境で書き出せる形式（Parquet は pyarrow がある場合のみ）。"""
+    return [
+        fmt
+        for fmt in EXPORT_FORMATS
+        if fmt != "parquet" or importlib.util.find_spec("pyarrow") is not None
+    ]
+
+
+def export(out: BinaryIO, fmt: str = "csv", **kwargs: Any) -> None:
+    writer, _, _ = EXPORT_FORMATS[fmt]
+    writer(out, **kwargs)
+
+
+# ----------------------------------------------------------------------
+# CLI（BIチーム向けの一括エクスポート）
+# ----------------------------------------------------------------------
+def _main(argv: Sequence[str] | None = None) -> int:
+    import argparse
+
+    p = argparse.ArgumentParser(description="診断レポート履歴のエクスポート")
+    p.add_argument("-o", "--output", required=True)
+    p.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="csv")
+    p.add_argument("--date-from")
+    p.add_argument("--date-to")
+    p.add_argument("--industry")
+    p.add_argument("--region")
+    p.add_argument("--company")
+    p.add_argument("--include-text", action="store_true")
+    p.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    p.add_argument("--db", help=f"DBパス（省略時は ${_DB_ENV}）")
+    a = p.parse_args(argv)
+
+    with open(a.output, "wb") as out:
+        export(
+            out,
+            a.format,
+            include_text=a.include_text,
+            chunk_size=a.chunk_size,
+            path=a.db,
+            date_from=a.date_from,
+            date_to=a.date_to,
+            industry=a.industry,
+            region=a.region,
+            company=a.company,
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(_main())
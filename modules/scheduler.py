@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+# ======================================================================
+# modules/scheduler.py ― LLM 呼び出しの公平スケジューラ
+# ======================================================================
+"""
+上流（OpenAI）への同時呼び出し数を、全体・テナント別・セッション別に制限し、
+空いた枠を次の順で割り当てる。
+
+1. 優先度：interactive（画面操作からのステップ実行）が batch より先
+2. 同じ優先度の中では重み付き公平キューイング（WFQ）
+   テナントごとに「仮想終了時刻 = max(仮想時刻, 前回の終了時刻) + 1/重み」を
+   付け、小さい順に実行する。1人が大量に投げても他のテナントの順番は
+   後ろへ押し出されない。
+
+設定（環境変数）:
+    AI_DOCK_LLM_MAX_CONCURRENCY   全体の同時実行数（既定 16）
+    AI_DOCK_LLM_PER_TENANT        テナントごとの同時実行数（既定 4）
+    AI_DOCK_LLM_PER_SESSION       セッションごとの同時実行数（既定 2）
+    AI_DOCK_TENANT_WEIGHTS        "tenantA=2,tenantB=0.5" の形式（既定の重みは 1）
+
+メトリクス（modules.metrics）:
+    llm.scheduler.queue_wait_sec               待ち時間（全体）
+    llm.scheduler.queue_wait_sec.<priority>    優先度別の待ち時間
+"""
+
+from __future__ import annotations
+
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List
+
+from modules.cancellation import CancelToken
+from modules.metrics import metrics
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BATCH = "batch"
+_PRIORITY_RANK = {PRIORITY_INTERACTIVE: 0, PRIORITY_BATCH: 1}
+DEFAULT_TENANT = "default"
+
+
+class _Ticket:
+    __slots__ = (
+        "rank",
+        "tag",
+        "seq",
+        "start_tag",
+        "session",
+        "tenant",
+        "priority",
+        "enqueued",
+        "granted",
+    )
+
+    def __init__(self, **kw: Any) -> None:
+        for k, v in kw.items():
+            setattr(self, k, v)
+        self.granted = False
+
+    def order(self) -> tuple:
+        return (self.rank, self.tag, self.seq)
+
+
+def parse_weights(spec: str | None) -> Dict[str, float]:
+    weights = {}
+    for item in (spec or "").split(","):
+        if "=" in item:
+            name, w = item.rsplit("=", 1)
+            weights[name.strip()] = float(w)
+    return weights
+
+
+class FairScheduler:
+    def __init__(
+        self,
+        *,
+        max_concurrency: int = 16,
+        per_tenant: int = 4,
+        per_session: int = 2,
+        weights: Dict[str, float] | None = None,
+    ) -> None:
+        self.max_concurrency = max_concurrency
+        self.per_tenant = per_tenant
+        self.per_session = per_session
+        self.weights = weights or {}
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._waiting: List[_Ticket] = []
+        self._vtime = 0.0
+        self._last_finish: Dict[str, float] = {}
+        self._active = 0
+        self._active_tenant: Dict[str, int] = {}
+        self._active_session: Dict[str, int] = {}
+
+    # ---------------- 公開API ----------------
+    @contextmanager
+    def slot(
+        self,
+        *,
+        session: str | None = None,
+        tenant: str | None = None,
+        priority: str = PRIORITY_INTERACTIVE,
+        token: CancelToken | None = None,
+    ):
+        """枠が空くまで待ってから中の処理を実行する。"""
+        ticket = self.acquire(
+            session=session, tenant=tenant, priority=priority, token=token
+        )
+        try:
+            yield
+        finally:
+            self.release(ticket)
+
+    def acquire(
+        self,
+        *,
+        session: str | None = None,
+        tenant: str | None = None,
+        priority: str = PRIORITY_INTERACTIVE,
+        token: CancelToken | None = None,
+    ) -> _Ticket:
+        """
+        枠を取る。token がキャンセルされたら待ち行列から外して Cancelled を送出する。
+        """
+        tenant = tenant or DEFAULT_TENANT
+        with self._cond:
+            start = max(self._vtime, self._last_finish.get(tenant, 0.0))
+            finish = start + 1.0 / self.weights.get(tenant, 1.0)
+            self._last_finish[tenant] = finish
+            ticket = _Ticket(
+                rank=_PRIORITY_RANK.get(priority, 0),
+                tag=finish,
+                seq=next(self._seq),
+                start_tag=start,
+                session=session,
+                tenant=tenant,
+                priority=priority,
+                enqueued=time.perf_counter(),
+            )
+            self._waiting.append(ticket)
+            self._dispatch()
+            unregister = token.on_cancel(self._wake) if token is not None else None
+            try:
+                while not ticket.granted:
+                    if token is not None and token.cancelled:
+                        self._waiting.remove(ticket)
+                        token.raise_if_cancelled()
+                    self._cond.wait()
+            finally:
+                if unregister is not None:
+                    unregister()
+        wait = time.perf_counter() - ticket.enqueued
+        metrics.histogram("llm.scheduler.queue_wait_sec").observe(wait)
+        metrics.histogram(f"llm.scheduler.queue_wait_sec.{priority}").observe(wait)
+        return ticket
+
+    def release(self, ticket: _Ticket) -> None:
+        with self._cond:
+            self._active -= 1
+            self._dec(self._active_tenant, ticket.tenant)
+            if ticket.session:
+                self._dec(self._active_session, ticket.session)
+            self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "active": self._active,
+                "waiting": len(self._waiting),
+                "active_by_tenant": dict(self._active_tenant),
+            }
+
+    def _wake(self) -> None:
+        with self._cond:
+            self._cond.notify_all()
+
+    # ---------------- 内部処理（self._cond を保持して呼ぶ） ----------------
+    @staticmethod
+    def _dec(counts: Dict[str, int], key: str) -> None:
+        counts[key] -= 1
+        if counts[key] <= 0:
+            del counts[key]
+
+    def _eligible(self, t: _Ticket) -> bool:
+        if self._active_tenant.get(t.tenant, 0) >= self.per_tenant:
+            return False
+        if t.session and self._active_session.get(t.session, 0) >= self.per_session:
+            return False
+        return True
+
+    def _dispatch(self) -> None:
+        granted = False
+        for t in sorted(self._waiting, key=_Ticket.order):
+            if self._active >= self.max_concurrency:
+                break
+            if not self._eligible(t):
+                continue
+            self._waiting.remove(t)
+            t.granted = granted = True
+            self._active += 1
+            self._active_tenant[t.tenant] = self._active_tenant.get(t.tenant, 0) + 1
+            if t.session:
+                self._active_session[t.session] = (
+                    self._active_session.get(t.session, 0) + 1
+                )
+            self._vtime = max(self._vtime, t.start_tag)
+        if granted:
+            self._cond.notify_all()
+        if not self._waiting and not self._active:
+            # アイドルになったら仮想時刻をリセット
+            self._vtime = 0.0
+            self._last_finish.clear()
+
+
+_SCHEDULER: FairScheduler | None = None
+_SCHEDULER_LOCK = threading.Lock()
+
+
+def get_scheduler() -> FairScheduler:
+    global _SCHEDULER
+    with _SCHEDULER_LOCK:
+        if _SCHEDULER is None:
+            _SCHEDULER = FairScheduler(
+                max_concurrency=int(os.getenv("AI_DOCK_LLM_MAX_CONCURRENCY", "16")),
+                per_tenant=int(os.getenv("AI_DOCK_LLM_PER_TENANT", "4")),
+                per_session=int(os.getenv("AI_DOCK_LLM_PER_SESSION", "2")),
+                weights=parse_weights(os.getenv("AI_DOCK_TENANT_WEIGHTS")),
+            )
+        return _SCHEDULER
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+# ======================================================================
+# modules/session_store.py ― 大きなセッション値のメモリ／ディスク退避
+# ======================================================================
+"""
+診断結果などサイズの大きいセッション値を、スクリプト実行の合間だけ
+プロセス共通のストアへ預ける。
+
+- 実行中のセッション：``restore_session_state()`` で st.session_state に戻す
+- 実行終了時：``offload_session_state()`` でストアへ預ける
+- ストアは LRU。メモリ上限を超えた分と、一定時間アクセスのないセッションは
+  ディスク（pickle）へ退避し、次のアクセス時に透過的に読み戻す。
+
+設定（環境変数）:
+    AI_DOCK_SESSION_MEMORY_MB   メモリ上に保持する合計サイズ上限（既定 256MB）
+    AI_DOCK_SESSION_IDLE_SEC    この秒数アクセスがなければディスクへ退避（既定 600秒）
+    AI_DOCK_SESSION_SPILL_DIR   退避先ディレクトリ（既定 <tmp>/ai_dock_sessions）
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List
+
+# 退避対象のキー（診断ステップの出力）
+OFFLOAD_KEYS = (
+    "external_output",
+    "deep_dive_questions",
+    "deep_dive_answers",
+    "swot_output",
+    "root_cause_output",
+    "action_result",
+    "pdf_bytes",
+)
+
+_DISK_TTL_SEC = 24 * 60 * 60  # 退避ファイルの保持期限
+
+
+def approx_size(obj: Any) -> int:
+    """文字列・bytes・list・dict を辿っておおよそのバイト数を見積もる。"""
+    if isinstance(obj, (str, bytes, bytearray)):
+        return sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(
+            approx_size(k) + approx_size(v) for k, v in obj.items()
+        )
+    if isinstance(obj, (list, tuple, set)):
+        return sys.getsizeof(obj) + sum(approx_size(v) for v in obj)
+    return sys.getsizeof(obj)
+
+
+class _Entry:
+    __slots__ = ("values", "size", "spill_path", "disk_size", "last_access")
+
+    def __init__(self) -> None:
+        self.values: Dict[str, Any] | None = None
+        self.size = 0
+        self.spill_path: str | None = None
+        self.disk_size = 0
+        self.last_access = time.time()
+
+
+class SessionStore:
+    """セッションID → 退避値 の LRU ストア（スレッドセーフ）。"""
+
+    def __init__(
+        self,
+        *,
+        max_memory_bytes: int = 256 * 1024 * 1024,
+        idle_seconds: float = 600,
+        spill_dir: str | None = None,
+    ) -> None:
+        self.max_memory_bytes = max_memory_bytes
+        self.idle_seconds = idle_seconds
+        self.spill_dir = spill_dir or os.path.join(
+            tempfile.gettempdir(), "ai_dock_sessions"
+        )
+        os.makedirs(self.spill_dir, exist_ok=True)
+        self._lock = threading.RLock()
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._memory_bytes = 0
+        self._last_sweep = 0.0
+
+    # ---------------- 公開API ----------------
+    def put(self, session_id: str, values: Dict[str, Any]) -> None:
+        """値を預ける（既存の値は置き換え）。"""
+        with self._lock:
+            self._drop(session_id)
+            if not values:
+                return
+            e = _Entry()
+            e.values = dict(values)
+            e.size = approx_size(e.values)
+            self._entries[session_id] = e
+            self._memory_bytes += e.size
+            self._evict(keep=session_id)
+
+    def take(self, session_id: str) -> Dict[str, Any]:
+        """預けた値を取り出す（ストアからは削除）。ディスク退避分は読み戻す。"""
+        with self._lock:
+            e = self._entries.get(session_id)
+            if e is None:
+                return {}
+            values = e.values
+            if values is None and e.spill_path:
+                try:
+                    with open(e.spill_path, "rb") as f:
+                        values = pickle.load(f)
+                except (OSError, pickle.UnpicklingError, EOFError):
+                    values = {}
+            self._drop(session_id)
+            return values or {}
+
+    def discard(self, session_id: str) -> None:
+        with self._lock:
+            self._drop(session_id)
+
+    def usage(self) -> List[Dict[str, Any]]:
+        """セッションごとのメモリ／ディスク使用量。"""
+        now = time.time()
+        with self._lock:
+            return [
+                {
+                    "session_id": sid,
+                    "memory_bytes": e.size if e.values is not None else 0,
+                    "disk_bytes": e.disk_size,
+                    "idle_sec": round(now - e.last_access, 1),
+                    "spilled": e.values is None,
+                }
+                for sid, e in self._entries.items()
+            ]
+
+    @property
+    def memory_bytes(self) -> int:
+        return self._memory_bytes
+
+    # ---------------- 内部処理 ----------------
+    def _drop(self, session_id: str) -> None:
+        e = self._entries.pop(session_id, None)
+        if e is None:
+            return
+        if e.values is not None:
+            self._memory_bytes -= e.size
+        if e.spill_path:
+            try:
+                os.remove(e.spill_path)
+            except OSError:
+                pass
+
+    def _spill(self, session_id: str, e: _Entry) -> None:
+        name = hashlib.sha256(session_id.encode()).hexdigest()[:32] + ".pkl"
+        path = os.path.join(self.spill_dir, name)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(e.values, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        e.spill_path = path
+        e.disk_size = os.path.getsize(path)
+        e.values = None
+        self._memory_bytes -= e.size
+
+    def _evict(self, keep: str) -> None:
+        now = time.time()
+        # 1) 一定時間アクセスのないセッションは退避
+        for sid, e in list(self._entries.items()):
+            if sid != keep and e.values is not None:
+                if now - e.last_access > self.idle_seconds:
+                    self._spill(sid, e)
+        # 2) メモリ上限を超えていれば古い順（LRU）に退避
+        for sid, e in list(self._entries.items()):
+            if self._memory_bytes <= self.max_memory_bytes:
+                break
+            if sid != keep and e.values is not None:
+                self._spill(sid, e)
+        # 3) 長期間戻ってこないセッションの退避ファイルを掃除
+        if now - self._last_sweep > 60:
+            self._last_sweep = now
+            for sid, e in list(self._entries.items()):
+                if now - e.last_access > _DISK_TTL_SEC:
+                    self._drop(sid)
+
+
+_STORE: SessionStore | None = None
+_STORE_LOCK = threading.Lock()
+
+
+def get_store() -> SessionStore:
+    global _STORE
+    with _STORE_LOCK:
+        if _STORE is None:
+            _STORE = SessionStore(
+                max_memory_bytes=int(os.getenv("AI_DOCK_SESSION_MEMORY_MB", "256"))
+                * 1024
+                * 1024,
+                idle_seconds=float(os.getenv("AI_DOCK_SESSION_IDLE_SEC", "600")),
+                spill_dir=os.getenv("AI_DOCK_SESSION_SPILL_DIR") or None,
+            )
+        return _STORE
+
+
+# ======================================================================
+# Streamlit 連携
+# ======================================================================
+def current_session_id() -> str | None:
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else None
+
+
+def current_tenant_id() -> str | None:
+    """
+    テナント（同じ利用者）の識別子。ログイン機能がないため接続元で代用する。
+    AI_DOCK_TENANT_HEADER を設定するとそのリクエストヘッダーの値を使う。
+    """
+    import streamlit as st
+
+    try:
+        headers = st.context.headers
+        name = os.getenv("AI_DOCK_TENANT_HEADER")
+        if name and headers.get(name):
+            return headers.get(name)
+        forwarded = headers.get("X-Forwarded-For")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+        return st.context.ip_address
+    except Exception:  # スクリプト実行外など
+        return None
+
+
+def restore_session_state(keys: Iterable[str] = OFFLOAD_KEYS) -> None:
+    """預けていた値を st.session_state に戻す（未設定のキーのみ）。"""
+    import streamlit as st
+
+    sid = current_session_id()
+    if sid is None:
+        return
+    for k, v in get_store().take(sid).items():
+        if k in keys and st.session_state.get(k) is None:
+            st.session_state[k] = v
+
+
+def offload_session_state(keys: Iterable[str] = OFFLOAD_KEYS) -> None:
+    """スクリプト実行の最後に呼び、大きな値をストアへ預ける。"""
+    import streamlit as st
+
+    sid = current_session_id()
+    if sid is None:
+        return
+    values = {}
+    for k in keys:
+        v = st.session_state.get(k)
+        if v is not None:
+            values[k] = v
+            del st.session_state[k]
+    if values:
+        get_store().put(sid, values)
+
+
+_scope = threading.local()
+
+
+@contextmanager
+def session_scope(keys: Iterable[str] = OFFLOAD_KEYS):
+    """st.fragment の再実行など、ページ全体を通らない実行単位で使う。
+    入れ子になった場合は一番外側でだけ復元／退避する。"""
+    depth = getattr(_scope, "depth", 0)
+    if depth == 0:
+        restore_session_state(keys)
+    _scope.depth = depth + 1
+    try:
+        yield
+    finally:
+        _scope.depth = depth
+        if depth == 0:
+            offload_session_state(keys)
+
+
+def session_memory_report(all_sessions: bool = False) -> List[Dict[str, Any]]:
+    """
+    設定ページ表示用。既定では現在のセッションの分だけ返す（all_sessions=True は
+    管理者表示用で、全セッションを返し現在のセッションに is_current を付ける）。
+    """
+    sid = current_session_id()
+    rows = get_store().usage()
+    for r in rows:
+        r["is_current"] = r["session_id"] == sid
+    return rows if all_sessions else [r for r in rows if r["is_current"]]
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# ======================================================================
+# modules/singleflight.py ― 同一リクエストの同時実行をまとめる
+# ======================================================================
+"""
+同じキーの処理が実行中なら、後から来た呼び出しは新たに実行せず
+先行する1回の結果（または例外）を待って共有する。
+
+ai_engine._chat_completion では正規化したリクエスト（llm_cassette.request_key）
+をキーにしており、二重クリックや同じセッションの複数タブから来た同一の
+LLM 呼び出しは上流へ1回しか飛ばない。
+
+相乗りした側は、自分のキャンセルトークン（modules.cancellation.current_token）を
+見ながら待つ。自分のジョブがキャンセルされたら先行する呼び出しの終了を待たずに
+Cancelled を送出する（先行する呼び出しはそのまま続く）。
+
+メトリクス（modules.metrics）:
+    llm.singleflight.leader            実際に上流へ送った回数
+    llm.singleflight.coalesced         相乗りした（送らずに済んだ）回数
+    llm.singleflight.coalesced.<step>  ステップ別の相乗り回数
+"""
+
+from __future__ import annotations
+
+import threading
+from typing import Any, Callable, Dict
+
+from modules.cancellation import current_token
+from modules.metrics import metrics
+
+_WAIT_POLL_SEC = 0.2  # 相乗り中にキャンセルを確認する間隔
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, name: str = "llm.singleflight") -> None:
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+
+    def do(self, key: str, fn: Callable[[], Any], *, label: str = "") -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+
+        if not leader:
+            metrics.counter(f"{self.name}.coalesced").inc()
+            if label:
+                metrics.counter(f"{self.name}.coalesced.{label}").inc()
+            token = current_token()
+            while not call.done.wait(None if token is None else _WAIT_POLL_SEC):
+                token.raise_if_cancelled()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        metrics.counter(f"{self.name}.leader").inc()
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+
+# LLM 呼び出し用（プロセス共通）
+llm_flight = SingleFlight()
@@ -0,0 +1,429 @@
+# -*- coding: utf-8 -*-
+# ======================================================================
+# modules/structured_output.py ― 関数呼び出しの引数（JSON）の修復とスキーマ検証
+# ======================================================================
+"""
+function_call.arguments の JSON が壊れていても、応答全体を捨てずに救うための解析。
+
+1. repair_json: よくある崩れをローカルで直して読み込む
+   - コードブロック・前後の説明文
+   - 末尾のカンマ（"a": 1,}）
+   - 区切りに使われた全角引用符（“title”: “…”）
+   - 途中で切れた出力（開いた文字列・括弧を閉じ、書きかけの要素は捨てる）
+2. SchemaValidator: JSON Schema（type / properties / required / items）を
+   あらかじめ検査関数に組み立てておき、型をそろえ（"8" → 8 など）、
+   欠けた必須項目は型の既定値（"" / 0 / false / [] / {}）で埋める
+3. 埋めた項目があれば、最後の手段としてその項目だけを聞き直す（reask）。
+   聞き直しに失敗しても既定値で埋めた結果を返す
+4. ItemStream: ストリーミング中の引数から、配列の要素を閉じた順に取り出す
+   （全体が届く前に1件ずつ表示するため）
+
+設定（環境変数）:
+    AI_DOCK_STRUCTURED_REASK   0 で聞き直しをしない（既定 する）
+
+メトリクス:
+    structured.repaired.<修復の種類>   fence / preamble / trailing_text / smart_quotes /
+                                       trailing_comma / truncated
+    structured.coerced / structured.filled   型をそろえた・既定値で埋めた項目数
+    structured.reask / structured.reask_failed / structured.unparsable
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+from typing import Any, Callable, Dict, List, Tuple
+
+from modules.cancellation import Cancelled
+from modules.metrics import metrics
+
+Path = Tuple[Any, ...]  # ("actions", 2, "root_V")
+# 聞き直し: ({"actions[2].root_V": 部分スキーマ}, 埋める前までの結果) → {"actions[2].root_V": 値}
+Reask = Callable[[Dict[str, Dict[str, Any]], Any], Dict[str, Any]]
+
+_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$")
+_OPEN_QUOTES = '"“”'
+_SMART_QUOTES = "“”"
+_CLOSERS = {"{": "}", "[": "]"}
+_NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+
+
+# ----------------------------------------------------------------------
+# JSON の修復
+# ----------------------------------------------------------------------
+def repair_json(text: str) -> Tuple[Any, List[str]]:
+    """(値, 行った修復の種類)。直せなければ ValueError。"""
+    text = (text or "").strip()
+    try:
+        return json.loads(text), []
+    except ValueError:
+        pass
+    fixes: List[str] = []
+    stripped = _FENCE.sub("", text)
+    if stripped != text:
+        fixes.append("fence")
+        text = stripped
+    start = min((i for i in (text.find("{"), text.find("[")) if i >= 0), default=-1)
+    if start < 0:
+        raise ValueError("JSON が見つかりません")
+    if start > 0:
+        fixes.append("preamble")
+        text = text[start:]
+
+    scan = _Scan(text)
+    fixes += scan.fixes
+    if scan.complete:
+        return _loads(scan.text), fixes
+    fixes.append("truncated")
+    # 書きかけの文字列・括弧を閉じる → だめなら書きかけの要素ごと捨てて閉じる
+    tail = '"' if scan.in_string else ""
+    candidates = [(scan.text + tail, scan.stack)] + [
+        (scan.text[:pos], stack) for pos, stack in reversed(scan.cuts)
+    ]
+    for head, stack in candidates:
+        try:
+            return _loads(head + "".join(_CLOSERS[c] for c in reversed(stack))), fixes
+        except ValueError:
+            continue
+    raise ValueError("途中で切れた JSON を復元できません")
+
+
+def _loads(text: str) -> Any:
+    return json.loads(text, strict=False)  # 文字列中の生の改行も受け付ける
+
+
+class _Scan:
+    """
+    文字列の内外を追いながら1度だけ走査し、全角引用符の区切りと末尾のカンマを直す。
+    途中で切れている場合に備え、要素の区切り（カンマの手前・括弧を開いた直後）の
+    位置と、その時点で開いている括弧を cuts に記録する。
+    """
+
+    def __init__(self, text: str) -> None:
+        out: List[str] = []
+        stack: List[str] = []
+        self.cuts: List[Tuple[int, Tuple[str, ...]]] = []
+        self.fixes: List[str] = []
+        quote = ""  # 文字列の中なら開いた引用符
+        escaped = False
+        end = len(text)
+        for i, ch in enumerate(text):
+            if quote:
+                if escaped:
+                    escaped = False
+                elif ch == "\\":
+                    escaped = True
+                elif ch == '"' or (quote in _SMART_QUOTES and ch in _SMART_QUOTES):
+                    quote, ch = "", '"'
+                out.append(ch)
+                continue
+            if ch in _OPEN_QUOTES:
+                if ch != '"' and "smart_quotes" not in self.fixes:
+                    self.fixes.append("smart_quotes")
+                quote, ch = ch, '"'
+            elif ch in "{[":
+                stack.append(ch)
+                out.append(ch)
+                self.cuts.append((len(out), tuple(stack)))
+                continue
+            elif ch in "}]":
+                last = len(out) - 1
+                while last >= 0 and out[last].isspace():
+                    last -= 1
+                if last >= 0 and out[last] == ",":
+                    del out[last]
+                    if "trailing_comma" not in self.fixes:
+                        self.fixes.append("trailing_comma")
+                if stack:
+                    stack.pop()
+                out.append(ch)
+                if not stack:
+                    end = i + 1
+                    break
+                continue
+            elif ch == ",":
+                self.cuts.append((len(out), tuple(stack)))
+            out.append(ch)
+        if text[end:].strip():
+            self.fixes.append("trailing_text")
+        self.text = "".join(out)
+        self.stack = tuple(stack)
+        self.in_string = bool(quote)
+        self.complete = not stack and not quote
+
+
+# ----------------------------------------------------------------------
+# スキーマ検証（組み立て済みの検査関数）
+# ----------------------------------------------------------------------
+class _Report:
+    def __init__(self) -> None:
+        self.missing: List[Tuple[Path, Dict[str, Any]]] = []
+        self.coerced = 0
+
+
+Check = Callable[[Any, Path, _Report], Any]
+
+
+def default_for(schema: Dict[str, Any]) -> Any:
+    """型の既定値（object は必須項目を既定値で埋めたもの）。"""
+    kind = schema.get("type")
+    if kind == "object":
+        props = schema.get("properties", {})
+        return {k: default_for(props.get(k, {})) for k in schema.get("required", [])}
+    return {"array": [], "string": "", "integer": 0, "number": 0, "boolean": False}.get(
+        kind
+    )
+
+
+def _compile(schema: Dict[str, Any]) -> Check:
+    kind = schema.get("type")
+    if kind == "object":
+        props = {k: _compile(s) for k, s in schema.get("properties", {}).items()}
+        required = list(schema.get("required", []))
+        subschemas = schema.get("properties", {})
+
+        def check_object(value: Any, path: Path, report: _Report) -> Any:
+            if not isinstance(value, dict):
+                report.missing.append((path, schema))
+                return default_for(schema)
+            out = dict(value)
+            for key in required:
+                if out.get(key) is None:
+                    report.missing.append((path + (key,), subschemas.get(key, {})))
+                    out[key] = default_for(subschemas.get(key, {}))
+            for key, check in props.items():
+                if key in out:
+                    out[key] = check(out[key], path + (key,), report)
+            return out
+
+        return check_object
+
+    if kind == "array":
+        item = _compile(schema.get("items", {}))
+
+        def check_array(value: Any, path: Path, report: _Report) -> Any:
+            if isinstance(value, dict):
+                report.coerced += 1  # 要素1つだけが配列に包まれずに返った
+                value = [value]
+            if not isinstance(value, list):
+                report.missing.append((path, schema))
+                return []
+            return [item(v, path + (i,), report) for i, v in enumerate(value)]
+
+        return check_array
+
+    if kind in ("integer", "number"):
+        cast = int if kind == "integer" else float
+
+        def check_number(value: Any, path: Path, report: _Report) -> Any:
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                if kind == "number" or isinstance(value, int):
+                    return value
+                if value.is_integer():
+                    report.coerced += 1  # 8.0
+                    return int(value)
+            m = _NUMBER.search(value) if isinstance(value, str) else None
+            if m:
+                report.coerced += 1  # "8" / "8点"
+                return cast(float(m.group()))
+            report.missing.append((path, schema))
+            return 0
+
+        return check_number
+
+    if kind == "boolean":
+
+        def check_boolean(value: Any, path: Path, report: _Report) -> Any:
+            if isinstance(value, bool):
+                return value
+            if isinstance(value, str) and value.strip().lower() in ("true", "false"):
+                report.coerced += 1
+                return value.strip().lower() == "true"
+            if value in (0, 1):
+                report.coerced += 1
+                return bool(value)
+            report.missing.append((path, schema))
+            return False
+
+        return check_boolean
+
+    if kind == "string":
+
+        def check_string(value: Any, path: Path, report: _Report) -> Any:
+            if isinstance(value, str):
+                return value
+            if isinstance(value, (int, float, bool)):
+                report.coerced += 1
+                return json.dumps(value) if isinstance(value, bool) else str(value)
+            report.missing.append((path, schema))
+            return ""
+
+        return check_string
+
+    return lambda value, path, report: value
+
+
+class SchemaValidator:
+    """JSON Schema をあらかじめ検査関数に組み立てたもの（呼び出しごとに解釈しない）。"""
+
+    def __init__(self, schema: Dict[str, Any]) -> None:
+        self.schema = schema
+        self._check = _compile(schema)
+        self._parts: Dict[Path, Check] = {}
+
+    def apply(self, value: Any) -> Tuple[Any, List[Tuple[Path, Dict[str, Any]]], int]:
+        """(型をそろえ既定値で埋めた値, 埋めた項目 [(パス, スキーマ)], 型をそろえた数)。"""
+        report = _Report()
+        out = self._check(value, (), report)
+        return out, report.missing, report.coerced
+
+    def check(self, path: Path, value: Any) -> Tuple[Any, bool]:
+        """path の位置の値を検査する。(値, 既定値で埋めずに済んだか)。"""
+        key = tuple(0 if isinstance(k, int) else k for k in path)
+        check = self._parts.get(key)
+        if check is None:
+            check = self._parts[key] = _compile(_subschema(self.schema, path))
+        report = _Report()
+        out = check(value, path, report)
+        return out, not report.missing
+
+
+def _subschema(schema: Dict[str, Any], path: Path) -> Dict[str, Any]:
+    for key in path:
+        schema = (
+            schema.get("items", {})
+            if isinstance(key, int)
+            else schema.get("properties", {}).get(key, {})
+        )
+    return schema
+
+
+def path_name(path: Path) -> str:
+    """("actions", 2, "root_V") → "actions[2].root_V"（聞き直しの項目名）。"""
+    out = ""
+    for key in path:
+        out += f"[{key}]" if isinstance(key, int) else (f".{key}" if out else key)
+    return out or "value"
+
+
+def _set_path(value: Any, path: Path, item: Any) -> Any:
+    if not path:
+        return item
+    target = value
+    for key in path[:-1]:
+        target = target[key]
+    target[path[-1]] = item
+    return value
+
+
+# ----------------------------------------------------------------------
+# 解析（修復 → 検証 → 聞き直し）
+# ----------------------------------------------------------------------
+def parse_structured(
+    text: str, validator: SchemaValidator, *, reask: Reask | None = None
+) -> Any:
+    """
+    関数呼び出しの引数を解析する。JSON として読めないときだけ ValueError。
+    欠けた必須項目は既定値で埋め、reask があればその項目だけを聞き直して差し替える。
+    """
+    try:
+        value, fixes = repair_json(text)
+    except ValueError:
+        metrics.counter("structured.unparsable").inc()
+        raise
+    for fix in fixes:
+        metrics.counter(f"structured.repaired.{fix}").inc()
+    value, missing, coerced = validator.apply(value)
+    metrics.counter("structured.coerced").inc(coerced)
+    metrics.counter("structured.filled").inc(len(missing))
+    if not missing or reask is None or os.getenv("AI_DOCK_STRUCTURED_REASK") == "0":
+        return value
+
+    fields = {path_name(path): (path, schema) for path, schema in missing}
+    metrics.counter("structured.reask").inc()
+    try:
+        answers = reask({k: s for k, (_, s) in fields.items()}, value)
+    except Cancelled:
+        raise
+    except Exception:
+        metrics.counter("structured.reask_failed").inc()
+        return value
+    for name, (path, _) in fields.items():
+        if name in answers:
+            item, ok = validator.check(path, answers[name])
+            if ok:
+                value = _set_path(value, path, item)
+    return value
+
+
+# ----------------------------------------------------------------------
+# ストリーミング中の逐次解析
+# ----------------------------------------------------------------------
+class ItemStream:
+    """
+    ストリームで少しずつ届く引数（JSON）から、最上位の key の配列の要素（オブジェクト）を
+    閉じた順に取り出す。{"actions": [{...}, {...}, ...]} の {...} が閉じるたびに、
+    その要素だけを修復・検証して返す（全体が届くのを待たない）。
+    """
+
+    def __init__(self, key: str, validator: SchemaValidator | None = None) -> None:
+        self.key = key
+        self.validator = validator
+        self.items: List[Any] = []
+        self._buf = ""
+        self._pos = 0
+        self._depth = 0
+        self._quote = ""
+        self._escaped = False
+        self._string_start = 0
+        self._last_string = ""
+        self._in_array = False
+        self._item_start = -1
+
+    def feed(self, chunk: str) -> List[Any]:
+        """chunk を追加し、新たに閉じた要素を返す。"""
+        self._buf += chunk
+        new: List[Any] = []
+        buf = self._buf
+        for i in range(self._pos, len(buf)):
+            ch = buf[i]
+            if self._quote:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"' or (
+                    self._quote in _SMART_QUOTES and ch in _SMART_QUOTES
+                ):
+                    self._quote = ""
+                    self._last_string = buf[self._string_start + 1 : i]
+                continue
+            if ch in _OPEN_QUOTES:
+                self._quote, self._string_start = ch, i
+            elif ch in "{[":
+                self._depth += 1
+                if ch == "[" and self._depth == 2 and self._last_string == self.key:
+                    self._in_array = True
+                elif ch == "{" and self._in_array and self._depth == 3:
+                    self._item_start = i
+            elif ch in "}]":
+                if ch == "}" and self._in_array and self._depth == 3:
+                    item = self._item(buf[self._item_start : i + 1])
+                    if item is not None:
+                        new.append(item)
+                elif ch == "]" and self._in_array and self._depth == 2:
+                    self._in_array = False
+                self._depth -= 1
+        self._pos = len(buf)
+        return new
+
+    def _item(self, text: str) -> Any:
+        try:
+            item, _ = repair_json(text)
+        except ValueError:
+            return None
+        if self.validator is not None:
+            item, _ = self.validator.check((self.key, len(self.items)), item)
+        self.items.append(item)
+        return item
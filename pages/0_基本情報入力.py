@@ -6,25 +6,52 @@
 from __future__ import annotations
 
 import streamlit as st
-from config import init_page
+from config import init_page, use_stylesheet
 from ui_components import show_subtitle, show_back_to_top
+from modules import jobs
+from modules.admission import get_admission
+from modules.session_store import (
+    current_session_id,
+    get_store,
+    offload_session_state,
+)
 
 # ======= 必ず最初 =======
 init_page(title="AI経営診断 – 基本情報入力")
 
 
 ### --- 安全リセット実装 --- ###
-def reset_all():
-    for k in [
-        "user_input",
-        "external_output",
-        "deep_dive_questions",
-        "deep_dive_answers",
-        "swot_output",
-        "root_cause_output",
-        "action_result",
-    ]:
+DIAGNOSIS_KEYS = [
+    "external_output",
+    "deep_dive_questions",
+    "deep_dive_answers",
+    "swot_output",
+    "root_cause_output",
+    "action_result",
+    "pending_jobs",
+    "job_inputs",
+    "output_fingerprints",
+    "diagnosis_done",
+    "completion_pending",
+    "pdf_bytes",
+]
+
+
+def clear_diagnosis(reason: str) -> None:
+    """前回の診断データ・ジョブの記録を消し、実行中のAIジョブを上流ごと打ち切る。"""
+    messages = [k for k in st.session_state if k.startswith("job_messages_")]
+    for k in DIAGNOSIS_KEYS + messages:
         st.session_state.pop(k, None)
+    # ストアへ預けていた前回の診断データ（退避ファイルを含む）も消す
+    get_store().discard(current_session_id())
+    jobs.get_queue().cancel_owner(current_session_id(), reason=reason)
+
+
+def reset_all():
+    st.session_state.pop("user_input", None)
+    clear_diagnosis("リセットしたため中断しました")
+    # 同時診断数の枠／順番待ちを返す
+    get_admission().leave(current_session_id())
     st.session_state["step"] = 1
     st.session_state["show_reset_confirm"] = False
     st.rerun()
@@ -44,54 +71,7 @@ with st.sidebar:
                 st.session_state["show_reset_confirm"] = False
 
 # -- デザインカスタマイズ
-st.markdown(
-    """
-<style>
-.required-label:after {
-    content: " *";
-    color: #e53935;
-    font-weight: bold;
-}
-.field-error {
-    color: #e53935;
-    font-size: 0.98em;
-    margin-top: 2px;
-    margin-bottom: 0;
-}
-.form-section {
-    margin-bottom: 1.2em;
-    padding: 1.3em 1.2em 1.2em 1.2em;
-    background: linear-gradient(100deg,#fafdff,#eaf4ff 90%);
-    border-radius: 13px;
-    box-shadow: 0 2px 9px #e2eaf3;
-    border-left: 5px solid #1976d2;
-}
-.save-btn {
-    width: 100%;
-    font-size: 1.22em !important;
-    font-weight: 700;
-    background: #1976d2 !important;
-    color: #fff !important;
-    border-radius: 11px;
-    padding: .7em 0;
-    margin-top:1em;
-    margin-bottom:.5em;
-    box-shadow: 0 2px 11px #e1ebfc;
-    border: none;
-    transition: background .19s;
-}
-.save-btn:hover { background: #16408a !important; }
-@media (max-width: 700px) {
-    .block-container {
-        max-width: 98vw !important;
-        padding-left: 0.2rem !important;
-        padding-right: 0.2rem !important;
-    }
-}
-</style>
-""",
-    unsafe_allow_html=True,
-)
+use_stylesheet("basic_info.css")
 
 if not isinstance(st.session_state.get("user_input"), dict):
     st.session_state["user_input"] = {}
@@ -260,16 +240,9 @@ if submitted:
         st.error("⚠️ 入力内容に不備があります。赤字メッセージをご確認ください。")
         st.session_state["errors"] = errors
     else:
-        # 保存時に分析・質問等の全データをリセット
-        for k in [
-            "external_output",
-            "deep_dive_questions",
-            "deep_dive_answers",
-            "swot_output",
-            "root_cause_output",
-            "action_result",
-        ]:
-            st.session_state.pop(k, None)
+        # 保存時に分析・質問等の全データをリセット（診断完了の印も消し、次の診断は
+        # 同時診断数の枠を取り直してから）
+        clear_diagnosis("基本情報を保存し直したため中断しました")
         # 数値正規化
         for k in INT_FIELDS:
             v = str(user_input[k]).strip()
@@ -286,3 +259,6 @@ if submitted:
 
 if len(ALL_FIELDS) + 1 > 8:
     show_back_to_top()
+
+# ---- 大きなセッション値をストアへ退避（次回実行時に init_page で復元） ----
+offload_session_state()
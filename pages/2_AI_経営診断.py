@@ -3,34 +3,22 @@ from __future__ import annotations
 
 import re
 import io
+import time
 from datetime import datetime
 import streamlit as st
 
-# ▼ Google Analytics（GA4）タグの埋め込み（unsafe_allow_html=Trueを必ず指定）
-st.markdown(
-    """
-<!-- Google Analytics -->
-<script async src="https://www.googletagmanager.com/gtag/js?id=G-TRBGYB90K3"></script>
-<script>
-  window.dataLayer = window.dataLayer || [];
-  function gtag(){dataLayer.push(arguments);}
-  gtag('js', new Date());
-  gtag('config', 'G-TRBGYB90K3');
-</script>
-""",
-    unsafe_allow_html=True,
-)
-
-from config import init_page
-from ui_components import init_session
-from ai_engine import (
-    show_external_environment_analysis_ai,
-    deep_dive_questions_ai,
-    show_swot_section_ai,
-    root_cause_analysis_ai,
-    action_with_eval_ai,
+from config import init_page, inject_analytics, use_stylesheet
+from ui_components import init_session, step_fragment
+from ai_engine import run_detached
+from modules import jobs, pipeline, report_archive
+from modules.admission import get_admission
+from modules.metrics import metrics
+from modules.scheduler import PRIORITY_BATCH
+from modules.session_store import (
+    current_session_id,
+    current_tenant_id,
+    offload_session_state,
 )
-from pdf_generator import create_pdf
 
 import sys, os
 
@@ -38,6 +26,8 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 # ---- ページ設定・セッション初期化 ----
 init_page(title="AI経営診断 – 外部環境分析")
+# ▼ Google Analytics（GA4）タグ
+inject_analytics()
 init_session(
     [
         "user_input",
@@ -100,92 +90,76 @@ if step > 1 and not all(user_input.get(k, "").strip() for k in required_keys):
 
 
 # --- 共通CSS ---
-st.markdown(
-    """
-<style>
-.step-progress-bar {
-    display: flex; align-items: center; justify-content: space-between;
-    margin-bottom: 2.2em; margin-top: .5em;
-}
-.step-center-area {
-    flex:1; text-align:center;
-}
-.step-num-label {
-    color:#1976d2; font-size:1.07em; font-weight:600; letter-spacing:.5px;
-}
-.step-title-label {
-    display:block; font-size:1.48em; font-weight:800; margin-top:.17em; color:#152e4d; letter-spacing:.04em;
-}
-.nav-btn {
-    background: #f1f5fa; color: #1976d2; border: none; border-radius: 13px;
-    font-size:1.05em; font-weight: 700; padding: .55em 1.6em;
-    box-shadow: 0 2px 8px #e8eaf6; cursor: pointer;
-    transition: background .18s;
-}
-.nav-btn:disabled {
-    background:#e4e9f2; color:#b2bac8; cursor:not-allowed; opacity:.6;
-}
-.beauty-card {
-    background:linear-gradient(100deg,#f7fafc,#e7f1fd 95%);
-    border-radius:17px;padding:1.3em 1.8em;margin:1.3em 0 2em 0;
-    box-shadow:0 3px 16px #e1eaf5; border-left:7px solid #1976d2;
-}
-.card-title {
-    font-size:1.24em;font-weight:700;margin-bottom:0.32em;color:#1976d2;
-}
-.card-section {
-    font-size:1.09em;line-height:2.04;margin:0.5em 0 0 1.1em;color:#24314d;
-}
-.ai-run-btn {
-    display:inline-block;background:#1976d2;color:#fff;font-size:1.13em;
-    font-weight:700;border-radius:13px;padding:0.65em 2.2em;margin:1.3em 0 1em;
-    box-shadow:0 2px 13px #b7d0ee;cursor:pointer;transition:background .2s;
-    border:none;
-}
-.ai-run-btn:hover { background:#154b97; }
-hr.beauty-hr {
-    border:none;
-    height:1px;
-    background:#aedbf5;
-    margin:1em 0;
-}
-.action-title {
-    font-size:1.13em;
-    font-weight:900;
-    color:#d32f2f;
-    margin:0.5em 0 0.3em;
-}
-</style>
-""",
-    unsafe_allow_html=True,
-)
+use_stylesheet("diagnosis.css")
 
-# --- ステップバー＆ナビゲーション：カラム方式 ---
-col_prev, col_center, col_next = st.columns([1, 5, 1])
-with col_prev:
-    if st.button("◀ 前へ", disabled=step == 1):
-        st.session_state["step"] = max(1, step - 1)
+# ---- 同時診断数の制御（上限を超えたら待ち行列で順番待ち） ----
+ADMISSION_POLL_SEC = 5
+
+
+@st.fragment(run_every=ADMISSION_POLL_SEC)
+def waiting_room() -> None:
+    ticket = get_admission().enter(current_session_id())
+    if ticket.admitted:
         st.rerun()
-with col_center:
-    st.markdown(
-        f"""
+    minutes = max(1, round(ticket.eta_sec / 60))
+    st.info(
+        f"⏳ ただいま混み合っています（診断中 {ticket.active}/{ticket.limit} 件）。\n\n"
+        f"順番待ち：**{ticket.position}番目**　目安：**約{minutes}分**"
+    )
+    st.caption("このページを開いたままお待ちください。順番が来ると自動で診断を始められます。")
+
+
+# ページを開いている間の最終アクセス更新（AI_DOCK_ADMISSION_IDLE_SEC より十分短く）
+ADMISSION_HEARTBEAT_SEC = 60
+
+
+@st.fragment(run_every=ADMISSION_HEARTBEAT_SEC)
+def admission_heartbeat() -> None:
+    """操作がなくても（質問への回答を入力中など）タブを開いている間は枠を保つ。"""
+    get_admission().touch(current_session_id())
+
+
+# 診断を最後まで終えたセッションは枠を返しているので、結果の閲覧は制限しない
+if not st.session_state.get("diagnosis_done"):
+    if not get_admission().enter(current_session_id()).admitted:
+        waiting_room()
+        offload_session_state()
+        st.stop()
+    admission_heartbeat()
+
+# --- ステップバー＆ナビゲーション：カラム方式 ---
+# ページ移動はアプリ全体の再実行（st.rerun）になる
+@st.fragment
+def show_step_bar(step: int) -> None:
+    col_prev, col_center, col_next = st.columns([1, 5, 1])
+    with col_prev:
+        if st.button("◀ 前へ", disabled=step == 1):
+            cancel_step_jobs(step, max(1, step - 1))
+            st.session_state["step"] = max(1, step - 1)
+            st.rerun()
+    with col_center:
+        st.markdown(
+            f"""
     <div style="text-align:center;">
         <span style="color:#1976d2; font-size:1.12em; font-weight:600;">Step {step} / {TOTAL_STEPS}</span><br>
         <span style="font-size:1.55em; font-weight:800; color:#152e4d;">{STEP_NAMES.get(step, '')}</span>
     </div>
     """,
-        unsafe_allow_html=True,
-    )
-with col_next:
-    if st.button("次へ ▶", disabled=step == TOTAL_STEPS):
-        st.session_state["step"] = min(TOTAL_STEPS, step + 1)
-        st.rerun()
+            unsafe_allow_html=True,
+        )
+    with col_next:
+        if st.button("次へ ▶", disabled=step == TOTAL_STEPS):
+            cancel_step_jobs(step, min(TOTAL_STEPS, step + 1))
+            st.session_state["step"] = min(TOTAL_STEPS, step + 1)
+            st.rerun()
+
 
 # ==== 外部環境分析カード ====
 from modules.utils import extract_item
 
 
-def display_external_analysis(output):
+@st.cache_data(show_spinner=False, max_entries=256)
+def external_cards_html(output: str) -> list[str]:
     viewpoints = {
         "政治・制度": "Politics",
         "経済": "Economy",
@@ -194,10 +168,11 @@ def display_external_analysis(output):
         "業界構造": "Industry Structure",
         "競合ポジション": "Competitive Positioning",
     }
+    cards = []
     for jp, en in viewpoints.items():
         summary = extract_item(jp, "要約", output)
         source = extract_item(jp, "出典", output)
-        st.markdown(
+        cards.append(
             f"""
 <div class="beauty-card">
   <div class="card-title">{jp} <span style="font-size:0.81em;color:#566b87;">({en})</span></div>
@@ -206,12 +181,18 @@ def display_external_analysis(output):
     <li><b>出典</b>: <span style="font-size:0.91em;color:#636978;">{source}</span></li>
   </ul>
 </div>
-""",
-            unsafe_allow_html=True,
+"""
         )
+    return cards
+
+
+def display_external_analysis(output):
+    for card in external_cards_html(output):
+        st.markdown(card, unsafe_allow_html=True)
 
 
 # --- Markdownの整形: h3, 水平線, アクションタイトル・見出しなどをリッチHTML化 ---
+@st.cache_data(show_spinner=False, max_entries=256)
 def format_action_output(md_text):
     # --- を水色hr風に
     md_text = re.sub(
@@ -234,6 +215,7 @@ def format_action_output(md_text):
     return md_text
 
 
+@st.cache_data(show_spinner=False, max_entries=256)
 def format_root_cause_output(md_text):
     # 見出し（真因分析タイトル）をbeauty-cardのタイトル並に
     md_text = re.sub(
@@ -273,8 +255,254 @@ def format_root_cause_output(md_text):
     return f"<div style=\"font-size:1.09em;line-height:1.8;font-family:'Noto Sans JP',sans-serif;color:#222;\">{md_text}</div>"
 
 
+# ===== バックグラウンドジョブ =====
+# 「▶ AI実行」はワーカーでAIを実行し、画面はジョブの完了をポーリングして反映する
+# ステップの関数・入力・出力は modules.pipeline に定義。上流の結果がそろったステップは
+# クリックを待たずに先読み実行し（batch 優先度）、入力が変わった結果は捨てる
+JOB_POLL_SEC = 1.5
+# ステップ番号 → そのステップで実行するジョブ（ステップを離れたらキャンセルする）
+STEP_JOBS = {2: "external", 3: "questions", 4: "swot", 5: "root_cause", 6: "actions"}
+# 一括実行モード：Step4〜6 の結果を1回のジョブ（fused）で作る。Step4〜6 の間の移動では中断しない
+FUSED_STEPS = (4, 5, 6)
+JOB_NAMES = {
+    **{kind: STEP_NAMES[s] for s, kind in STEP_JOBS.items()},
+    "fused": "SWOT分析〜改善アクション（一括）",
+}
+
+
+def fused_mode() -> bool:
+    if st.session_state.get("fused_mode") is None:
+        st.session_state["fused_mode"] = pipeline.fused_default()
+    return st.session_state["fused_mode"]
+
+
+def run_kind(kind: str) -> str:
+    """Step4〜6 のジョブ種別（一括実行モードなら fused）。"""
+    return "fused" if fused_mode() and kind in pipeline.FUSED_STEPS else kind
+
+
+def step_job(step: int) -> str | None:
+    kind = STEP_JOBS.get(step)
+    return run_kind(kind) if kind else None
+
+
+def _session_dict(key: str) -> dict:
+    if st.session_state.get(key) is None:
+        st.session_state[key] = {}
+    return st.session_state[key]
+
+
+def pending_jobs() -> dict:
+    """実行中ジョブ（種別 → ジョブID）。"""
+    return _session_dict("pending_jobs")
+
+
+def job_inputs() -> dict:
+    """実行中ジョブの入力（種別 → {"fingerprint", "speculative"}）。"""
+    return _session_dict("job_inputs")
+
+
+def output_fingerprints() -> dict:
+    """反映済みの結果がどの入力から作られたか（種別 → フィンガープリント）。"""
+    return _session_dict("output_fingerprints")
+
+
+def start_job(kind: str, *, speculative: bool = False) -> None:
+    fingerprint = pipeline.fingerprint(kind, st.session_state)
+    if kind in pending_jobs():
+        # 同じ入力で実行中なら登録しない（二重クリック・先読み済み）
+        if job_inputs().get(kind, {}).get("fingerprint") == fingerprint:
+            return
+        jobs.get_queue().cancel(
+            pending_jobs().pop(kind), "入力が変わったため中断しました"
+        )
+    session_id = current_session_id()
+    # 診断完了後の再実行も、同時診断数の枠を取り直してから（診断中に戻す）
+    st.session_state.pop("diagnosis_done", None)
+    if not get_admission().enter(session_id).admitted:
+        if not speculative:
+            st.session_state[f"job_messages_{kind}"] = [
+                (
+                    "warning",
+                    "⏳ ただいま混み合っています。順番が来てから実行してください。",
+                )
+            ]
+        return
+    snapshot = {
+        k: st.session_state[k]
+        for k in pipeline.INPUT_KEYS
+        if st.session_state.get(k) is not None
+    }
+    identity = {"session": session_id, "tenant": current_tenant_id()}
+    if speculative:
+        identity["priority"] = PRIORITY_BATCH
+        metrics.counter("diagnosis.prefetch.started").inc()
+    pending_jobs()[kind] = jobs.get_queue().submit(
+        kind,
+        run_detached,
+        pipeline.STEPS[kind].func_name,
+        dict(st.session_state["user_input"]),
+        snapshot,
+        identity,
+        owner=session_id,
+    )
+    job_inputs()[kind] = {"fingerprint": fingerprint, "speculative": speculative}
+    st.session_state.pop(f"job_messages_{kind}", None)
+
+
+def prefetch() -> None:
+    """上流の結果がそろったステップを裏で先に実行する。"""
+    running = {
+        kind: job_inputs().get(kind, {}).get("fingerprint") for kind in pending_jobs()
+    }
+    for kind in pipeline.prefetchable(
+        st.session_state, output_fingerprints(), running, fused=fused_mode()
+    ):
+        start_job(kind, speculative=True)
+
+
+def cancel_step_jobs(step: int, next_step: int) -> None:
+    """ステップを離れるとき、そのステップの実行中ジョブを上流ごと打ち切る。"""
+    kind = step_job(step)
+    if kind == "fused" and next_step in FUSED_STEPS:
+        return  # 一括実行の結果は移動先のステップでも使う
+    job_id = pending_jobs().pop(kind, None)
+    if job_id is not None:
+        jobs.get_queue().cancel(job_id, "ステップを離れたため中断しました")
+
+
+def archive_action_result(kind: str) -> None:
+    # 診断結果を履歴アーカイブへ（AI_DOCK_ARCHIVE_DB 設定時のみ）
+    try:
+        report_archive.archive_report(
+            st.session_state["user_input"],
+            external_output=st.session_state.get("external_output") or "",
+            swot_output=st.session_state.get("swot_output") or "",
+            root_cause_output=st.session_state.get("root_cause_output") or "",
+            action_result=st.session_state["action_result"],
+        )
+    except Exception as e:
+        st.session_state[f"job_messages_{kind}"].append(
+            ("warning", f"⚠️ 履歴への保存に失敗しました: {e}")
+        )
+
+
+def complete_diagnosis(kind: str) -> None:
+    st.session_state.pop("completion_pending", None)
+    archive_action_result(kind)
+    # 診断完了：同時診断数の枠を次の人へ
+    st.session_state["diagnosis_done"] = True
+    get_admission().leave(current_session_id(), completed=True)
+
+
+def finish_job(kind: str) -> bool:
+    """ジョブが終わっていれば結果をセッションへ反映して True を返す。"""
+    job = jobs.get_queue().get(pending_jobs()[kind])
+    if job is not None and job["status"] in jobs.ACTIVE_STATUSES:
+        return False
+    del pending_jobs()[kind]
+    started = job_inputs().pop(kind, {})
+    fingerprint = pipeline.fingerprint(kind, st.session_state)
+    stale = started.get("fingerprint", fingerprint) != fingerprint
+    if job is not None and job["status"] == "done" and stale:
+        # 実行中に入力（回答・上流の結果）が変わった → 古い入力の結果は使わない
+        if started.get("speculative"):
+            metrics.counter("diagnosis.prefetch.discarded").inc()
+        else:
+            st.session_state[f"job_messages_{kind}"] = [
+                (
+                    "warning",
+                    "⚠️ 実行中に入力が変わったため、結果を破棄しました。"
+                    "もう一度実行してください。",
+                )
+            ]
+        prefetch()
+        return True
+    if job is not None and job["status"] == "done":
+        result = job["result"]["result"]
+        if kind == "fused":
+            # 1回の結果を SWOT・真因分析・改善アクションへ（上流から順に入力を記録）
+            for k in pipeline.FUSED_STEPS if result else ():
+                output_key = pipeline.STEPS[k].output_key
+                st.session_state[output_key] = result[output_key]
+                output_fingerprints()[k] = pipeline.fingerprint(k, st.session_state)
+            action_result = (result or {}).get("action_result") or {}
+        else:
+            st.session_state[pipeline.STEPS[kind].output_key] = result
+            output_fingerprints()[kind] = fingerprint
+            action_result = result if kind == "actions" else {}
+        if started.get("speculative"):
+            metrics.counter("diagnosis.prefetch.completed").inc()
+        st.session_state[f"job_messages_{kind}"] = list(job["result"]["messages"])
+        # 診断関数がジョブ内で残した値（失敗時のトレースバックなど）
+        st.session_state.update(job["result"].get("state") or {})
+        if job["started_at"] and job["finished_at"]:
+            metrics.histogram(f"diagnosis.step_sec.{kind}").observe(
+                job["finished_at"] - job["started_at"]
+            )
+        if action_result.get("evaluations"):
+            if started.get("speculative") and st.session_state.get("step") != 6:
+                # 先読みの結果は、利用者が Step6 で見るまで保存・完了扱いにしない
+                st.session_state["completion_pending"] = kind
+            else:
+                complete_diagnosis(kind)
+    elif job is not None and job["status"] == "cancelled":
+        st.session_state[f"job_messages_{kind}"] = [
+            ("warning", f"⏹ AI実行を中断しました: {job['error']}")
+        ]
+    else:
+        reason = (job or {}).get("error") or "ジョブが見つかりません"
+        st.session_state[f"job_messages_{kind}"] = [
+            ("error", f"❌ AI実行に失敗しました: {reason.splitlines()[0]}")
+        ]
+    prefetch()
+    return True
+
+
+@step_fragment(run_every=JOB_POLL_SEC)
+def job_status(kind: str, label: str) -> None:
+    if kind not in pending_jobs() or finish_job(kind):
+        # ステップ表示・PDFパネルへ結果を反映
+        st.rerun()
+    job = jobs.get_queue().get(pending_jobs()[kind]) or {}
+    elapsed = time.time() - job.get("created_at", time.time())
+    waiting = "順番待ち" if job.get("status") == "queued" else label
+    st.info(
+        f"⏳ {waiting}（{elapsed:.0f}秒経過）別のページを見ていても処理は続きます"
+        "（別のステップへ移ると中断します）。"
+    )
+    if kind == "actions" and job.get("progress"):
+        # 届いたアクションから表示（最優先アクションは全件そろってから確定）
+        show_action_result(job["progress"])
+
+
+@step_fragment(run_every=JOB_POLL_SEC)
+def prefetch_monitor(current: str | None) -> None:
+    """表示中のステップ以外（先読み）のジョブの完了を反映する。"""
+    for kind in [k for k in pending_jobs() if k != current]:
+        finish_job(kind)
+    others = [k for k in pending_jobs() if k != current]
+    if not others:
+        # ポーリングを止める（先読みが終わったことをステップバー等へ反映）
+        st.rerun()
+    names = "・".join(JOB_NAMES[k] for k in others)
+    st.caption(f"⚡ 次のステップを先に準備しています：{names}")
+
+
+FUSED_LABEL = "SWOT分析・真因分析・改善アクションを一括実行中…"
+
+
+def show_job(kind: str, label: str) -> None:
+    """実行中なら進捗を、終わっていればジョブ中のメッセージを表示する。"""
+    if kind in pending_jobs():
+        job_status(kind, label)
+    for level, message in st.session_state.get(f"job_messages_{kind}") or []:
+        getattr(st, level)(message)
+
+
 # ===== 各ステップの処理 =====
-if step == 2:
+@step_fragment
+def step_external_view():
     st.markdown(
         '<div class="beauty-card"><b>🌐 外部環境分析</b><br>AIがPEST・競合・業界などのデータをリアルタイムで自動分析します。</div>',
         unsafe_allow_html=True,
@@ -284,13 +512,8 @@ if step == 2:
         st.warning("⚠️ 先に『基本情報入力』を行ってください。")
     else:
         if st.button("▶ AI実行", key="run_extenv", help="外部環境のAI分析を開始"):
-            try:  # ★ 追加: 例外を捕捉して画面に表示
-                with st.spinner("分析中…"):
-                    raw = show_external_environment_analysis_ai(user_input)
-                    st.session_state["external_output"] = raw
-            except Exception as e:
-                st.exception(e)
-                st.stop()
+            start_job("external")
+        show_job("external", "分析中…")
         output = st.session_state.get("external_output", "")
         if output:
             display_external_analysis(output)
@@ -300,21 +523,22 @@ if step == 2:
                 unsafe_allow_html=True,
             )
 
-elif step == 3:
+@step_fragment
+def step_questions_view():
     st.markdown(
         '<div class="beauty-card"><b>🔍 AIからの質問</b><br>経営状況を深掘りする追加ヒアリングを自動生成。</div>',
         unsafe_allow_html=True,
     )
     # すでにsessionに質問があればそれを使い、なければ初回のみ生成
-    if (
-        "deep_dive_questions" in st.session_state
-        and st.session_state["deep_dive_questions"]
-    ):
-        questions = st.session_state["deep_dive_questions"]
-    else:
-        with st.spinner("AIが質問を自動生成中..."):
-            questions = deep_dive_questions_ai(st.session_state["user_input"])
-        st.session_state["deep_dive_questions"] = questions
+    questions = st.session_state.get("deep_dive_questions")
+    if questions is None:
+        start_job("questions")
+    show_job("questions", "AIが質問を自動生成中...")
+    if not questions:
+        if questions is not None and st.button("🔄 質問を再生成", key="retry_questions"):
+            start_job("questions")
+            st.rerun(scope="fragment")
+        return
 
     st.markdown("<div style='margin:1.4em 0;'></div>", unsafe_allow_html=True)
 
@@ -353,10 +577,12 @@ elif step == 3:
                     for i in range(1, len(questions) + 1)
                 }
                 st.session_state["deep_dive_answers"] = ans
+                prefetch()
             st.success("✅ 回答を保存しました。次のステップへお進みください。")
 
 
-elif step == 4:
+@step_fragment
+def step_swot_view():
     st.markdown(
         '<div class="beauty-card"><b>📝 SWOT分析</b><br>あなたの会社の強み・弱み・機会・脅威をAIが自動で整理。</div>',
         unsafe_allow_html=True,
@@ -365,11 +591,15 @@ elif step == 4:
     if not deep_dive_answers or not any(deep_dive_answers.values()):
         st.warning("先にAIからの質問にすべて回答してください。")
     else:
+        st.session_state["fused_mode"] = st.checkbox(
+            "⚡ SWOT分析・真因分析・改善アクションをまとめて実行",
+            value=fused_mode(),
+            key="fused_mode_checkbox",
+            help="AIへの問い合わせを1回にまとめ、Step4〜6の結果を一度に作ります。",
+        )
         if st.button("▶ AI実行", key="run_swot"):
-            with st.spinner("SWOT分析中…"):
-                st.session_state["swot_output"] = show_swot_section_ai(
-                    st.session_state["user_input"]
-                )
+            start_job(run_kind("swot"))
+        show_job(run_kind("swot"), FUSED_LABEL if fused_mode() else "SWOT分析中…")
         output = st.session_state.get("swot_output")
         if output:
             st.markdown(
@@ -382,18 +612,16 @@ elif step == 4:
                 unsafe_allow_html=True,
             )
 
-# step==5 真因分析部分
-elif step == 5:
+@step_fragment
+def step_root_cause_view():
     st.markdown(
         '<div class="beauty-card"><b>🔎 真因分析</b><br>問題の根本原因をAIで分解・特定します。</div>',
         unsafe_allow_html=True,
     )
     # ここで「AI実行」ボタンを実装（他stepと同じパターン）
     if st.button("▶ AI実行", key="run_rootcause"):
-        with st.spinner("真因分析中…"):
-            st.session_state["root_cause_output"] = root_cause_analysis_ai(
-                st.session_state["user_input"]
-            )
+        start_job(run_kind("root_cause"))
+    show_job(run_kind("root_cause"), FUSED_LABEL if fused_mode() else "真因分析中…")
     output = st.session_state.get("root_cause_output")
     if output:
         formatted = format_root_cause_output(output)
@@ -408,39 +636,23 @@ elif step == 5:
         )
 
 
-elif step == 6:
-    st.markdown(
-        '<div class="beauty-card"><b>💡 改善アクション提案</b><br>経営改善策をAIで提案します。</div>',
-        unsafe_allow_html=True,
-    )
-    if st.button("▶ AI実行", key="run_action"):
-        if not all(
-            st.session_state.get(k) for k in ("swot_output", "root_cause_output")
-        ):
-            st.warning("先にSWOT分析と真因分析を完了してください。")
-        else:
-            with st.spinner("提案＆評価中…"):
-                st.session_state["action_result"] = action_with_eval_ai(
-                    st.session_state["user_input"]
-                )
-    result = st.session_state.get("action_result", {})
-    if result:
-        actions_md = result.get("actions_md", "")
-        if actions_md:
-            formatted_md = format_action_output(actions_md)
-            st.markdown(
-                f'<div class="beauty-card" style="background:#eef7fe;border-left:6px solid #2574b8;">{formatted_md}</div>',
-                unsafe_allow_html=True,
-            )
-        evaluations = result.get("evaluations", [])
-        if evaluations:
-            # 詳細（expander）のみ表示
-            for ev in evaluations:
-                with st.expander(
-                    f"📝 {ev['title']} の評価根拠（クリックで詳細）", expanded=False
-                ):
-                    st.markdown(
-                        f"""
+def show_action_result(result: dict) -> None:
+    actions_md = result.get("actions_md", "")
+    if actions_md:
+        formatted_md = format_action_output(actions_md)
+        st.markdown(
+            f'<div class="beauty-card" style="background:#eef7fe;border-left:6px solid #2574b8;">{formatted_md}</div>',
+            unsafe_allow_html=True,
+        )
+    evaluations = result.get("evaluations", [])
+    if evaluations:
+        # 詳細（expander）のみ表示
+        for ev in evaluations:
+            with st.expander(
+                f"📝 {ev['title']} の評価根拠（クリックで詳細）", expanded=False
+            ):
+                st.markdown(
+                    f"""
 | 項目 | 点数 | 根拠 |
 |:----------|:----:|:--------------------------|
 | V（経済価値）        | {ev.get('V','')} | {ev.get('root_V','')} |
@@ -454,9 +666,40 @@ elif step == 6:
 | リスク               | {ev.get('リスク','')} | {ev.get('root_リスク','')} |
 | **合計点数**         | **{ev['total']}** | |
 """
-                    )
-                    st.success(f"この案の合計点数：**{ev['total']}**")
-            st.info("※同点の場合は現場状況や経営優先度に応じて決定を！")
+                )
+                st.success(f"この案の合計点数：**{ev['total']}**")
+        st.info("※同点の場合は現場状況や経営優先度に応じて決定を！")
+
+
+@step_fragment
+def step_action_view():
+    st.markdown(
+        '<div class="beauty-card"><b>💡 改善アクション提案</b><br>経営改善策をAIで提案します。</div>',
+        unsafe_allow_html=True,
+    )
+    if st.button("▶ AI実行", key="run_action"):
+        if fused_mode():
+            start_job("fused")
+        elif not all(
+            st.session_state.get(k) for k in ("swot_output", "root_cause_output")
+        ):
+            st.warning("先にSWOT分析と真因分析を完了してください。")
+        else:
+            start_job("actions")
+    kind = run_kind("actions")
+    show_job(kind, FUSED_LABEL if fused_mode() else "提案＆評価中…")
+    if kind == "actions" and kind in pending_jobs():
+        # 実行中は job_status が途中経過を表示する（前回の結果は出さない）
+        return
+    result = st.session_state.get("action_result", {})
+    pending = st.session_state.get("completion_pending")
+    if pending and pipeline.is_fresh(
+        pending, st.session_state, output_fingerprints()
+    ):
+        # 先読みで作られていた結果を、ここで初めて利用者が見た
+        complete_diagnosis(pending)
+    if result:
+        show_action_result(result)
     else:
         st.markdown(
             '<button class="ai-run-btn">▶ AI実行ボタンを押してください。</button>',
@@ -465,22 +708,25 @@ elif step == 6:
 
 
 # ==========================
-# Step7: PDF 出力（ここはそのまま）
+# Step7: PDF 出力
 # ==========================
-if step == TOTAL_STEPS:
-    st.header("📄 PDFレポート出力")
-    pdf_filename = f"AI経営診断レポート_{datetime.today().strftime('%Y%m%d')}.pdf"
-    user_input = st.session_state.get("user_input", {})
-    external_output = st.session_state.get("external_output", "")
-    deep_dive_questions = st.session_state.get("deep_dive_questions", [])
-    swot_output = st.session_state.get("swot_output", "")
-    root_cause_output = st.session_state.get("root_cause_output", "")
-    action_result = st.session_state.get("action_result") or {}
-    action_eval_output = action_result.get("evaluations", [])
+@st.cache_data(show_spinner=False, max_entries=64)
+def build_pdf_bytes(
+    user_input_text: str,
+    external_output: str,
+    questions_text: str,
+    swot_output: str,
+    root_cause_output: str,
+    action_eval_output: list[dict],
+) -> bytes:
+    """入力が同じならPDFは作り直さない（内容をキーにキャッシュ）。"""
+    # ReportLab はPDFを出すこのステップで初めて読み込む
+    from pdf_generator import create_pdf
+
     report_blocks = [
-        {"title": "【基本情報】", "content": str(user_input)},
+        {"title": "【基本情報】", "content": user_input_text},
         {"title": "【外部環境分析】", "content": external_output},
-        {"title": "【AIからの質問】", "content": str(deep_dive_questions)},
+        {"title": "【AIからの質問】", "content": questions_text},
         {"title": "【SWOT分析】", "content": swot_output},
         {"title": "【真因分析】", "content": root_cause_output},
     ]
@@ -491,10 +737,45 @@ if step == TOTAL_STEPS:
         action_eval_output=action_eval_output,
         root_cause_output=root_cause_output,
     )
-    pdf_buffer.seek(0)
+    return pdf_buffer.getvalue()
+
+
+@step_fragment
+def pdf_panel():
+    st.header("📄 PDFレポート出力")
+    pdf_filename = f"AI経営診断レポート_{datetime.today().strftime('%Y%m%d')}.pdf"
+    action_result = st.session_state.get("action_result") or {}
+    pdf_bytes = build_pdf_bytes(
+        str(st.session_state.get("user_input") or {}),
+        st.session_state.get("external_output") or "",
+        str(st.session_state.get("deep_dive_questions") or []),
+        st.session_state.get("swot_output") or "",
+        st.session_state.get("root_cause_output") or "",
+        action_result.get("evaluations", []),
+    )
     st.download_button(
         label="📄 PDFをダウンロード",
-        data=pdf_buffer,
+        data=pdf_bytes,
         file_name=pdf_filename,
         mime="application/pdf",
     )
+
+
+# ===== 表示（各ステップ・PDFパネルはフラグメント単位で再実行） =====
+STEP_VIEWS = {
+    2: step_external_view,
+    3: step_questions_view,
+    4: step_swot_view,
+    5: step_root_cause_view,
+    6: step_action_view,
+}
+show_step_bar(step)
+if step in STEP_VIEWS:
+    STEP_VIEWS[step]()
+if any(kind != step_job(step) for kind in pending_jobs()):
+    prefetch_monitor(step_job(step))
+if step == TOTAL_STEPS:
+    pdf_panel()
+
+# ---- 大きなセッション値をストアへ退避（次回実行時に init_page で復元） ----
+offload_session_state()
@@ -6,6 +6,8 @@ init_page(title="📄 レポート履歴")
 import streamlit as st
 import os
 
+from modules.session_store import offload_session_state
+
 
 # --------------------------------------------
 # 2️⃣ レポート履歴ページ
@@ -29,36 +31,117 @@ st.markdown(
 )
 
 # --------------------------------------------
-# 3️⃣ 【仮】 PDF履歴ファイルリスト表示（ダミー）
+# 3️⃣ PDF履歴リスト表示（アーカイブ有効時はDBから／無効時はダミー）
 # --------------------------------------------
+from datetime import date, timedelta
+
+from modules import report_archive
+
+if report_archive.is_enabled():
+    st.subheader("📑 診断履歴（最新50件）")
+    reports = report_archive.list_reports(limit=50)
+    if not reports:
+        st.info("まだ診断履歴がありません。")
+    for report in reports:
+        st.write(
+            f"📅 {report['created_at'][:10]} | 🏢 {report['company']} | "
+            f"🏭 {report['industry']} | 🚩 {report['best_action']}（{report['best_total']}点）"
+        )
+
+    # ---- CSV / Parquet エクスポート ----
+    st.subheader("📤 履歴エクスポート")
+    with st.form("export_form"):
+        c1, c2 = st.columns(2)
+        with c1:
+            date_from = st.date_input("開始日", value=date.today() - timedelta(days=365))
+            industry = st.text_input("業種（部分一致）", value="")
+        with c2:
+            date_to = st.date_input("終了日", value=date.today())
+            region = st.text_input("地域（部分一致）", value="")
+        formats = report_archive.available_formats()
+        fmt = st.radio("形式", formats, horizontal=True)
+        if "parquet" not in formats:
+            st.caption("Parquet出力には pyarrow が必要です（pip install pyarrow）")
+        include_text = st.checkbox("分析本文（SWOT・真因など）も含める", value=False)
+        prepared = st.form_submit_button("▶ エクスポート準備")
+
+    if prepared:
+        st.session_state["export_params"] = {
+            "fmt": fmt,
+            "include_text": include_text,
+            "date_from": date_from,
+            "date_to": date_to,
+            "industry": industry.strip() or None,
+            "region": region.strip() or None,
+        }
+
+    params = st.session_state.get("export_params")
+    if params:
+        filters = {k: params[k] for k in ("date_from", "date_to", "industry", "region")}
+        n = report_archive.count_reports(**filters)
+        _, mime, ext = report_archive.EXPORT_FORMATS[params["fmt"]]
 
-# 仮想的な履歴（Starter版なら → データベース連携予定）
-dummy_reports = [
-    {
-        "date": "2025-06-06",
-        "company": "株式会社テストカンパニー",
-        "filename": "AI_Dock_Report_20250606.pdf",
-    },
-    {
-        "date": "2025-06-01",
-        "company": "株式会社サンプル製作所",
-        "filename": "AI_Dock_Report_20250601.pdf",
-    },
-    {
-        "date": "2025-05-25",
-        "company": "合同会社デモ商会",
-        "filename": "AI_Dock_Report_20250525.pdf",
-    },
-]
-
-# 表示
-st.subheader("📑 出力済みレポート一覧（仮）")
-
-for report in dummy_reports:
-    st.write(f"📅 {report['date']} | 🏢 {report['company']} | 📄 {report['filename']}")
-    st.button(
-        f"📥 ダウンロード（{report['filename']}）", key=f"download_{report['filename']}"
-    )
+        def _build_export() -> bytes:
+            # 一時ファイルへチャンク単位で書き出してから bytes で返す。
+            # download_button は結果をすべてメモリに載せるため、画面からの出力は
+            # ファイル1つ分のメモリを使う（件数が多い一括出力は CLI
+            # `python -m modules.report_archive` を使う。こちらはメモリ一定）
+            # （この中の st.error は表示されないため、形式の確認はボタンの表示前に行う）
+            import tempfile
+
+            with tempfile.TemporaryFile() as tmp:
+                report_archive.export(
+                    tmp, params["fmt"], include_text=params["include_text"], **filters
+                )
+                tmp.seek(0)
+                return tmp.read()
+
+        available = params["fmt"] in report_archive.available_formats()
+        if not available:
+            st.error(f"❌ この環境では {ext.upper()} を出力できません。")
+        st.write(f"対象件数：**{n}** 件")
+        st.caption(
+            "件数が多い場合は、サーバー上で `python -m modules.report_archive` を"
+            "実行すると、メモリを増やさずにファイルへ書き出せます。"
+        )
+        st.download_button(
+            label=f"📥 {ext.upper()}をダウンロード",
+            data=_build_export,
+            file_name=f"AI経営診断履歴_{date.today().strftime('%Y%m%d')}.{ext}",
+            mime=mime,
+            disabled=n == 0 or not available,
+        )
+else:
+    # 仮想的な履歴（Starter版なら → データベース連携予定）
+    dummy_reports = [
+        {
+            "date": "2025-06-06",
+            "company": "株式会社テストカンパニー",
+            "filename": "AI_Dock_Report_20250606.pdf",
+        },
+        {
+            "date": "2025-06-01",
+            "company": "株式会社サンプル製作所",
+            "filename": "AI_Dock_Report_20250601.pdf",
+        },
+        {
+            "date": "2025-05-25",
+            "company": "合同会社デモ商会",
+            "filename": "AI_Dock_Report_20250525.pdf",
+        },
+    ]
+
+    # 表示
+    st.subheader("📑 出力済みレポート一覧（仮）")
+
+    for report in dummy_reports:
+        st.write(
+            f"📅 {report['date']} | 🏢 {report['company']} | 📄 {report['filename']}"
+        )
+        st.button(
+            f"📥 ダウンロード（{report['filename']}）",
+            key=f"download_{report['filename']}",
+        )
 
 # --------------------------------------------
 # 4️⃣ 今後予定する高度機能（Starter/Pro）
@@ -74,6 +157,8 @@ st.markdown(
 ✅ 過去レポートとの差分比較  
 ✅ グラフ表示（診断スコア推移）  
 ✅ レポート検索・フィルター  
-✅ CSVエクスポート  
 """
 )
+
+# ---- 大きなセッション値をストアへ退避（次回実行時に init_page で復元） ----
+offload_session_state()
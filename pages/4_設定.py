@@ -3,10 +3,19 @@ from config import init_page
 
 init_page(title="⚙️ 設定")
 
+import os
+
 import streamlit as st
 
+from modules.circuit_breaker import breaker_states
+from modules.metrics import metrics
+from modules.session_store import offload_session_state, session_memory_report
+
 st.title("⚙️ 設定")
 
+# 全セッションの使用量・サーバー全体の LLM 統計は運用者向け（AI_DOCK_ADMIN=1 のときだけ表示）
+ADMIN_VIEWS = os.getenv("AI_DOCK_ADMIN", "0") == "1"
+
 st.markdown(
     """
 こちらは **AI経営診断GPT Lite版** の  
@@ -37,6 +46,98 @@ if st.button("▶ プロファイル更新"):
     # ✅ ここに本番時は「セッション更新／DB保存」などを入れる予定
     st.success("✅ プロファイルを更新しました！（仮）")
 
+# --------------------------------------------
+# 🧠 セッションメモリ使用量（大きな診断データの退避状況）
+# --------------------------------------------
+with st.expander("🧠 セッションメモリ使用量", expanded=False):
+    rows = session_memory_report(all_sessions=ADMIN_VIEWS)
+    if rows:
+        st.dataframe(
+            [
+                {
+                    "セッション": ("★現在 " if r["is_current"] else "")
+                    + r["session_id"][:8],
+                    "メモリ(KB)": round(r["memory_bytes"] / 1024, 1),
+                    "ディスク(KB)": round(r["disk_bytes"] / 1024, 1),
+                    "アイドル(秒)": r["idle_sec"],
+                    "退避済み": r["spilled"],
+                }
+                for r in rows
+            ],
+            use_container_width=True,
+        )
+    else:
+        st.caption("退避中のデータはありません。")
+
+# --------------------------------------------
+# 📈 LLM呼び出しの統計（このサーバープロセスの起動以降。運用者向け）
+# --------------------------------------------
+if ADMIN_VIEWS:
+    with st.expander("📈 LLM呼び出し統計", expanded=False):
+        snapshot = metrics.snapshot(
+            prefixes=(
+                "llm.",
+                "external_cache.",
+                "diagnosis.prefetch.",
+                "digest.",
+                "structured.",
+            )
+        )
+        counters, histograms = snapshot["counters"], snapshot["histograms"]
+        if counters:
+            st.dataframe(
+                [{"項目": k, "回数": int(v)} for k, v in counters.items()],
+                use_container_width=True,
+            )
+            st.caption(
+                "llm.singleflight.coalesced: 同一リクエストの同時実行をまとめ、"
+                "上流への送信を省略した回数／external_cache.hit: 外部環境分析の観点を"
+                "業種×地域の共有キャッシュから返した回数／diagnosis.prefetch: 上流がそろった"
+                "ステップを先読み実行した回数（discarded は入力が変わって破棄した回数）／"
+                "digest.hit: Step4〜6 の前提ブロックを作り直さずに使い回した回数"
+                "（compressed は質問・回答を要約した回数）／llm.tokens.cached: 入力トークンのうち"
+                "プロバイダー側のプロンプトキャッシュから読まれた数／structured.repaired: 壊れた"
+                "関数呼び出しの出力（途中切れ・末尾カンマなど）をその場で直した回数"
+                "（filled は既定値で埋めた項目数、reask は欠けた項目だけを聞き直した回数）"
+            )
+        if histograms:
+            st.dataframe(
+                [
+                    {
+                        "項目": k,
+                        "件数": int(h["count"]),
+                        "p50(秒)": round(h["p50"], 3),
+                        "p95(秒)": round(h["p95"], 3),
+                        "最大(秒)": round(h["max"], 3),
+                    }
+                    for k, h in histograms.items()
+                ],
+                use_container_width=True,
+            )
+            st.caption("llm.scheduler.queue_wait_sec: 上流へ送るまでの待ち時間")
+        breakers = breaker_states()
+        if breakers:
+            st.markdown("**サーキットブレーカー（接続先／モデル別）**")
+            st.dataframe(
+                [
+                    {
+                        "接続先": b["endpoint"],
+                        "状態": {
+                            "closed": "正常",
+                            "open": "遮断中",
+                            "half_open": "試行中",
+                        }[b["state"]],
+                        "直近の呼び出し": b["calls"],
+                        "失敗": b["failures"],
+                        "遅延": b["slow"],
+                    }
+                    for b in breakers
+                ],
+                use_container_width=True,
+            )
+        if not counters and not histograms:
+            st.caption("まだLLM呼び出しはありません。")
+
 # --------------------------------------------
 # 4️⃣ 今後予定する高度機能（Starter/Pro）
 # --------------------------------------------
@@ -54,3 +155,6 @@ st.markdown(
 ✅ データエクスポート（CSV/Excel）  
 """
 )
+
+# ---- 大きなセッション値をストアへ退避（次回実行時に init_page で復元） ----
+offload_session_state()
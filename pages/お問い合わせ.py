@@ -1,18 +1,8 @@
 import streamlit as st
+from config import inject_analytics
 
-st.markdown(
-    """
-<!-- Google Analytics -->
-<script async src="https://www.googletagmanager.com/gtag/js?id=G-TRBGYB90K3"></script>
-<script>
-  window.dataLayer = window.dataLayer || [];
-  function gtag(){dataLayer.push(arguments);}
-  gtag('js', new Date());
-  gtag('config', 'G-TRBGYB90K3');
-</script>
-""",
-    unsafe_allow_html=True,
-)
+# ▼ Google Analytics（GA4）タグ
+inject_analytics()
 
 st.title("お問い合わせ")
 
@@ -3,6 +3,7 @@ from __future__ import annotations
 import io
 import re
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 from typing import List, Dict, Any
 
@@ -21,44 +22,53 @@ from reportlab.platypus import (
     Flowable,
 )
 
-# フォント設定
-_FONT = "Helvetica"
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+
+# フォント設定（TTFの読み込みは初回のPDF生成時に1回だけ）
 font_path = Path(__file__).parent / "fonts" / "ipag.ttf"
-if font_path.exists():
-    pdfmetrics.registerFont(TTFont("IPAGothic", str(font_path)))
-    _FONT = "IPAGothic"
 
-from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
 
-styles = getSampleStyleSheet()
-TITLE = ParagraphStyle(
-    "Title",
-    parent=styles["Title"],
-    fontName=_FONT,
-    fontSize=22,
-    leading=26,
-    alignment=TA_CENTER,
-    spaceAfter=24,
-)
-H1 = ParagraphStyle(
-    "Heading1",
-    parent=styles["Heading1"],
-    fontName=_FONT,
-    fontSize=14,
-    leading=20,
-    spaceBefore=12,
-    spaceAfter=12,
-    textColor=colors.HexColor("#0D2E5A"),
-)
-BODY = ParagraphStyle(
-    "BodyText",
-    parent=styles["Normal"],
-    fontName=_FONT,
-    fontSize=11,
-    leading=18,
-    spaceAfter=10,
-    alignment=TA_LEFT,
-)
+@lru_cache(maxsize=None)
+def _font() -> str:
+    if font_path.exists():
+        pdfmetrics.registerFont(TTFont("IPAGothic", str(font_path)))
+        return "IPAGothic"
+    return "Helvetica"
+
+
+@lru_cache(maxsize=None)
+def _styles() -> tuple[ParagraphStyle, ParagraphStyle, ParagraphStyle]:
+    """TITLE, H1, BODY を返す。"""
+    styles = getSampleStyleSheet()
+    title = ParagraphStyle(
+        "Title",
+        parent=styles["Title"],
+        fontName=_font(),
+        fontSize=22,
+        leading=26,
+        alignment=TA_CENTER,
+        spaceAfter=24,
+    )
+    h1 = ParagraphStyle(
+        "Heading1",
+        parent=styles["Heading1"],
+        fontName=_font(),
+        fontSize=14,
+        leading=20,
+        spaceBefore=12,
+        spaceAfter=12,
+        textColor=colors.HexColor("#0D2E5A"),
+    )
+    body = ParagraphStyle(
+        "BodyText",
+        parent=styles["Normal"],
+        fontName=_font(),
+        fontSize=11,
+        leading=18,
+        spaceAfter=10,
+        alignment=TA_LEFT,
+    )
+    return title, h1, body
 
 
 # タイトル中の絵文字・特殊記号を除去
@@ -83,7 +93,7 @@ class HighlightBox(Flowable):
         self.canv.setFillColor(colors.HexColor(self.color))
         self.canv.roundRect(0, 0, self.width, self.height, 10, fill=1, stroke=0)
         self.canv.setFillColor(colors.HexColor("#0D2E5A"))
-        self.canv.setFont(_FONT, 12)
+        self.canv.setFont(_font(), 12)
         self.canv.drawString(16, self.height - 28, clean_title(self.text))
         self.canv.restoreState()
 
@@ -101,6 +111,7 @@ def _md_to_html(text: str) -> str:
 
 # 本文ブロック追加
 def _add_body_block(story: list, text: str):
+    _, H1, BODY = _styles()
     for line in text.strip().splitlines():
         l = line.rstrip()
         if not l:
@@ -115,6 +126,7 @@ def _add_body_block(story: list, text: str):
 
 
 def _build_eval_tbl(evals: List[Dict[str, Any]]):
+    _, _, BODY = _styles()
     if not evals:
         return Paragraph("※ アクション統合評価なし", BODY)
 
@@ -138,7 +150,7 @@ def _build_eval_tbl(evals: List[Dict[str, Any]]):
                 ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
                 ("ALIGN", (1, 1), (-2, -1), "CENTER"),
                 ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
-                ("FONTNAME", (0, 0), (-1, -1), _FONT),
+                ("FONTNAME", (0, 0), (-1, -1), _font()),
                 ("FONTSIZE", (0, 0), (-1, -1), 9.5),
                 (
                     "ROWBACKGROUNDS",
@@ -161,7 +173,7 @@ def _header_footer(canvas, doc):
     canvas.setStrokeColor(colors.HexColor("#888888"))
     canvas.setLineWidth(0.3)
     canvas.line(50, 45, w - 50, 45)
-    canvas.setFont(_FONT, 8)
+    canvas.setFont(_font(), 8)
     canvas.drawRightString(w - 50, 30, str(doc.page))
     canvas.restoreState()
 
@@ -184,6 +196,7 @@ def create_pdf(
         bottomMargin=60,
         title="AI経営診断レポート",
     )
+    TITLE, H1, BODY = _styles()
     story: list = []
 
     # Cover
@@ -0,0 +1,16 @@
+// Google Analytics（GA4）― 再実行のたびに読み込まれても初期化は1回だけ
+(function () {
+  if (window.__aiDockGa4) return;
+  window.__aiDockGa4 = true;
+
+  var tag = document.createElement("script");
+  tag.async = true;
+  tag.src = "https://www.googletagmanager.com/gtag/js?id=G-TRBGYB90K3";
+  document.head.appendChild(tag);
+
+  window.dataLayer = window.dataLayer || [];
+  function gtag() { window.dataLayer.push(arguments); }
+  window.gtag = gtag;
+  gtag("js", new Date());
+  gtag("config", "G-TRBGYB90K3");
+})();
@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
+import functools
+from typing import Callable
+
 import streamlit as st
 from config import _apply_global_styles
+from modules.session_store import session_scope
 
 
 def init_session(keys: list[str]) -> None:
@@ -11,6 +15,27 @@ def init_session(keys: list[str]) -> None:
             st.session_state[k] = None
 
 
+def step_fragment(
+    func: Callable | None = None, *, run_every: float | None = None
+) -> Callable:
+    """
+    ステップ表示用の st.fragment。
+    - 操作時はこのフラグメントだけが再実行される
+    - 再実行の前後で退避中のセッション値を復元／退避する
+    - run_every を指定すると一定間隔で自動再実行（ジョブ完了のポーリング等）
+    """
+    if func is None:
+        return functools.partial(step_fragment, run_every=run_every)
+
+    @st.fragment(run_every=run_every)
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with session_scope():
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
 def show_navigation(step: int, min_step: int = 1, max_step: int = 6) -> None:
     prev_col, _, next_col = st.columns([1, 6, 1])
     with prev_col:
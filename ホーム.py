@@ -1,131 +1,16 @@
 # main.py  ― Notionライクなトップページ
 # ==============================================
 import streamlit as st
-from config import init_page
+from config import init_page, inject_analytics, use_stylesheet
+from modules.session_store import offload_session_state
 
 init_page(title="AI経営コンサルタントLite（β版）", layout="centered")
 
 # ▼ Google Analytics（GA4）タグ
-st.markdown(
-    """
-<!-- Google Analytics -->
-<script async src="https://www.googletagmanager.com/gtag/js?id=G-TRBGYB90K3"></script>
-<script>
-  window.dataLayer = window.dataLayer || [];
-  function gtag(){dataLayer.push(arguments);}
-  gtag('js', new Date());
-  gtag('config', 'G-TRBGYB90K3');
-</script>
-""",
-    unsafe_allow_html=True,
-)
+inject_analytics()
 
 # ---------- グローバル CSS  --------------------------------
-st.markdown(
-    """
-<style>
-/* ========= Google Font (Inter & Noto Sans JP) ========== */
-@import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;600;700&family=Noto+Sans+JP:wght@400;600&display=swap');
-
-/* ========= カラートークン (Notion風) ========== */
-:root {
-  --bg:          #f6f7f9;
-  --card-bg:     #ffffff;
-  --border:      #e0e0e0;
-  --shadow:      rgba(0,0,0,0.06);
-  --text:        #37352f;
-  --text-sub:    #6e6e6e;
-  --accent:      #0b5fff;
-}
-
-/* ========= ベーススタイル ========== */
-html, body, .stApp, .main { 
-  background-color: var(--bg) !important;
-  color: var(--text);
-  font-family: 'Inter', 'Noto Sans JP', sans-serif;
-  font-size: 16px;
-}
-
-/* ========= カード (Notionページ風) ========== */
-.main-card {
-  background: var(--card-bg);
-  border: 1px solid var(--border);
-  border-radius: 12px;
-  padding: 2.2rem 2.7rem 2rem;
-  margin: 2.2rem auto;
-  max-width: 1800px;
-  box-shadow: 0 4px 12px var(--shadow);
-}
-
-/* ========= 見出し ========== */
-.main-title {
-  font-size: 2.2rem;
-  font-weight: 700;
-  margin-bottom: 0.5rem;
-  letter-spacing: 0.4px;
-  text-align: center;
-  color: var(--text);
-}
-.main-sub {
-  font-size: 1.05rem;
-  color: var(--text-sub);
-  text-align: center;
-  margin-bottom: 2.2rem;
-}
-
-/* ========= ステップリスト ========== */
-.step-list {
-  list-style: none; padding-left: 0;
-}
-.step-list li {
-  margin: 0.4rem 0 0.4rem 0;
-  padding-left: 1.6rem;
-  position: relative;
-}
-.step-list li::before {
-  content: "•";
-  position: absolute;
-  left: 0;
-  color: var(--accent);
-  font-size: 1.1rem;
-  line-height: 1;
-}
-
-/* ========= ノートブロック  ========== */
-.note-block {
-  background: #eef3ff;
-  border-left: 4px solid var(--accent);
-  padding: 1rem 1.3rem;
-  border-radius: 6px;
-  color: var(--text);
-  margin-top: 1.8rem;
-  font-size: 0.95rem;
-}
-
-/* ========= フッター (固定) ========== */
-.footer {
-  position: fixed;
-  bottom: 0; left: 0; width: 100%;
-  background: var(--bg);
-  border-top: 1px solid var(--border);
-  padding: 0.7rem 0;
-  text-align: center;
-  font-size: 0.9rem;
-  color: var(--text-sub);
-  z-index: 99;
-}
-.footer a { color: var(--accent); text-decoration: none; margin: 0 1rem; }
-.footer a:hover { text-decoration: underline; }
-
-/* ========= レスポンシブ ========== */
-@media (max-width: 640px){
-  .main-card { padding: 1.5rem 1.2rem; margin: 1.2rem auto; }
-  .main-title { font-size: 1.6rem; }
-}
-</style>
-""",
-    unsafe_allow_html=True,
-)
+use_stylesheet("home.css")
 
 # ---------- ページ内容  --------------------------------
 st.markdown(
@@ -180,3 +65,6 @@ st.markdown(
 """,
     unsafe_allow_html=True,
 )
+
+# ---- 大きなセッション値をストアへ退避（次回実行時に init_page で復元） ----
+offload_session_state()